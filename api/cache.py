@@ -0,0 +1,142 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from rest_framework.response import Response
+
+
+def _version_key(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def get_model_version(model):
+    """
+    Current cache version of a model. Cached data derived from the model
+    should include it in the key so a bump makes the old entries unreachable.
+    """
+    key = _version_key(model)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses old versions
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_model_versions(models):
+    """Versions of several models, fetched in a single cache round trip"""
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    return [versions[key] if key in versions else get_model_version(model)
+            for key, model in zip(keys, models)]
+
+
+def bump_model_version(model):
+    key = _version_key(model)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+        return cache.get(key)
+
+
+def bump_model_version_on_commit(model):
+    """
+    Bump now and again once the surrounding transaction commits, so entries
+    cached from a read that raced the uncommitted write are unreachable too.
+    """
+    bump_model_version(model)
+    transaction.on_commit(lambda: bump_model_version(model))
+
+
+def _bump_sender_version(sender, **kwargs):
+    bump_model_version_on_commit(sender)
+
+
+def track_model_versions(*models):
+    """Bump each model's cache version whenever one of its rows is written"""
+    for model in models:
+        post_save.connect(_bump_sender_version, sender=model,
+                          dispatch_uid=f'version:{model._meta.label_lower}:save')
+        post_delete.connect(_bump_sender_version, sender=model,
+                            dispatch_uid=f'version:{model._meta.label_lower}:delete')
+
+
+class CacheStats:
+    """Per-process hit/miss counters for the response cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, name, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            names = sorted(set(self.hits) | set(self.misses))
+            return {name: {'hits': self.hits[name], 'misses': self.misses[name]}
+                    for name in names}
+
+    def reset(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+
+response_cache_stats = CacheStats()
+
+
+class CachedResponseMixin:
+    """
+    Read-through cache for the safe actions of a viewset.
+
+    The serialized response data is cached under a key made of the view,
+    action, scheme and host, URL kwargs, sorted query string and the
+    current version of every model in `cache_models`, so a write to any of
+    them makes old entries unreachable instead of serving stale data.
+    """
+    cache_models = ()
+
+    def get_response_cache_key(self, request):
+        versions = ':'.join(str(version) for version in
+                            get_model_versions(self.cache_models))
+        query = sorted(request.query_params.lists())
+        kwargs = sorted(self.kwargs.items())
+        # Pagination links in the data are absolute, built from the request
+        origin = f'{request.scheme}://{request.get_host()}'
+        digest = hashlib.md5(f'{origin}{kwargs!r}{query!r}'.encode()).hexdigest()
+        return f'response:{self.basename}:{self.action}:{versions}:{digest}'
+
+    def cached_response(self, request, build):
+        name = f'{self.basename}-{self.action}'
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            response_cache_stats.record(name, hit=True)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response_cache_stats.record(name, hit=False)
+        response = build()
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(
+                request, *args, **kwargs))
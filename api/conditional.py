@@ -0,0 +1,94 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for the safe actions of a viewset.
+
+    Validators come from one `MAX(updated_at)`, `COUNT(*)` aggregate per
+    queryset in `get_validator_querysets()`, so `If-None-Match` and
+    `If-Modified-Since` are answered with a 304 before anything is
+    serialized. Successful responses also carry `Cache-Control` and a
+    `Surrogate-Key` header so an edge cache can purge by object id.
+
+    When combined with CachedResponseMixin the validators are cached next to
+    the response data, under the same versioned key, so a cache hit costs
+    no queries and the ETag always describes the body that is served.
+    """
+    surrogate_key_prefix = None
+
+    def get_validator_querysets(self):
+        queryset = self.get_queryset()
+        if self.action == 'retrieve':
+            lookup = self.lookup_url_kwarg or self.lookup_field
+            return [queryset.filter(**{self.lookup_field: self.kwargs[lookup]})]
+        return [self.filter_queryset(queryset)]
+
+    def get_validators(self):
+        key = None
+        if hasattr(self, 'get_response_cache_key'):
+            key = self.get_response_cache_key(self.request) + ':validators'
+            validators = cache.get(key)
+            if validators is not None:
+                return validators
+
+        validators = self.compute_validators()
+        if key is not None:
+            cache.set(key, validators, settings.RESPONSE_CACHE_TIMEOUT)
+        return validators
+
+    def compute_validators(self):
+        parts = [self.request.get_full_path()]
+        last_modified = None
+        for queryset in self.get_validator_querysets():
+            stats = queryset.order_by().aggregate(
+                last_modified=Max('updated_at'), count=Count('pk'))
+            parts.append(f"{stats['count']}:{stats['last_modified']}")
+            if stats['last_modified'] and (
+                    last_modified is None or stats['last_modified'] > last_modified):
+                last_modified = stats['last_modified']
+        etag = '"{}"'.format(hashlib.md5('|'.join(parts).encode()).hexdigest())
+        return etag, last_modified
+
+    def get_surrogate_keys(self, data):
+        prefix = self.surrogate_key_prefix or self.basename
+        keys = [self.basename]
+        items = data.get('results', [data]) if isinstance(data, dict) else data
+        keys += [f"{prefix}-{item['id']}" for item in items
+                 if isinstance(item, dict) and 'id' in item]
+        return keys
+
+    def conditional_response(self, request, build):
+        etag, last_modified = self.get_validators()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if not_modified is None:
+            response = build()
+            if response.status_code != 200:
+                return response
+            response['Surrogate-Key'] = ' '.join(
+                dict.fromkeys(self.get_surrogate_keys(response.data)))
+        else:
+            response = not_modified
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(timestamp)
+        response['Cache-Control'] = (
+            f'public, max-age=0, s-maxage={settings.EDGE_CACHE_MAX_AGE}')
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, lambda: super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, lambda: super(ConditionalGetMixin, self).retrieve(
+                request, *args, **kwargs))
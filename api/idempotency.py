@@ -0,0 +1,124 @@
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from api.models import IdempotencyKey
+from api.renderers import ORJSONRenderer
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def request_fingerprint(request):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def purge_expired(batch_size=1000, stdout=None):
+    """
+    Delete keys older than IDEMPOTENCY_KEY_TTL, `batch_size` rows per
+    statement so a large backlog never holds long locks.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    total = 0
+    while True:
+        batch = list(IdempotencyKey.objects.filter(created_at__lt=cutoff)
+                     .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return total
+        total += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
+        if stdout is not None:
+            stdout.write(f'Deleted {total} idempotency keys')
+
+
+class IdempotentMixin:
+    """
+    Lets clients retry unsafe actions safely with an `Idempotency-Key`
+    header. The first request with a key records a fingerprint of the
+    request and, once done, its response; retries with the same key get
+    that response replayed without running the action again. Reusing a
+    key for a different request is a 422, and retrying while the first
+    attempt is still running is a 409; an attempt still unfinished after
+    IDEMPOTENCY_LEASE seconds is presumed dead and a retry takes it over.
+    Server errors are not recorded, so those can be retried. Keys are per
+    user and expire after IDEMPOTENCY_KEY_TTL seconds (see
+    `manage.py purge_idempotency_keys`).
+    """
+
+    def idempotent_response(self, request, build):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return build()
+
+        fingerprint = request_fingerprint(request)
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user, key=key[:255], fingerprint=fingerprint)
+        except IntegrityError:
+            return self.replay(request, key[:255], fingerprint, build)
+        return self.record_response(record, build)
+
+    def record_response(self, record, build):
+        try:
+            response = build()
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+            return response
+
+        record.status_code = response.status_code
+        record.response = json.loads(ORJSONRenderer().render(response.data) or 'null')
+        record.save(update_fields=['status_code', 'response'])
+        return response
+
+    def replay(self, request, key, fingerprint, build):
+        record = IdempotencyKey.objects.filter(
+            user=request.user, key=key).first()
+        if record is None:
+            # Expired or failed between our insert and this read
+            return Response(
+                {'detail': 'This request is already being processed.'},
+                status=status.HTTP_409_CONFLICT)
+        age = timezone.now() - record.created_at
+        if age > timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL):
+            # Not purged yet, but no longer replayed; the key is free again
+            return self.take_over(record, fingerprint, build)
+        if record.fingerprint != fingerprint:
+            return Response(
+                {'detail': f'{IDEMPOTENCY_HEADER} was already used for a different request.'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if record.status_code is None:
+            if age > timedelta(seconds=settings.IDEMPOTENCY_LEASE):
+                # The first attempt died without finishing or cleaning up
+                return self.take_over(record, fingerprint, build)
+            return Response(
+                {'detail': 'This request is already being processed.'},
+                status=status.HTTP_409_CONFLICT)
+        response = Response(record.response, status=record.status_code)
+        response[REPLAYED_HEADER] = 'true'
+        return response
+
+    def take_over(self, record, fingerprint, build):
+        """Restart an expired or abandoned `record` for this request"""
+        # created_at doubles as the start of the current attempt; matching
+        # on it lets only one of several concurrent retries win
+        now = timezone.now()
+        claimed = IdempotencyKey.objects.filter(
+            pk=record.pk, created_at=record.created_at).update(
+            fingerprint=fingerprint, status_code=None, response=None, created_at=now)
+        if not claimed:
+            return Response(
+                {'detail': 'This request is already being processed.'},
+                status=status.HTTP_409_CONFLICT)
+        record.fingerprint, record.status_code, record.response = fingerprint, None, None
+        record.created_at = now
+        return self.record_response(record, build)
@@ -0,0 +1,205 @@
+import hashlib
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+_SQL_PREVIEW = 300
+
+
+def fingerprint(sql):
+    """Stable id of a query's shape; `IN (%s, %s, ...)` lists of any length match"""
+    normalized = _IN_LIST.sub('(...)', sql)
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+
+class QueryRecorder:
+    """Execute wrapper counting and timing the queries of one request"""
+
+    def __init__(self, capture):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.samples = {}
+        # Up to `capture` of (alias, sql, params, duration, many)
+        self.queries = []
+        self.capture = capture
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            key = fingerprint(sql)
+            self.fingerprints[key] += 1
+            self.samples.setdefault(key, sql)
+            if len(self.queries) < self.capture:
+                self.queries.append((
+                    context['connection'].alias, sql, params, duration, many))
+
+    @property
+    def duplicates(self):
+        """`{fingerprint: count}` of queries run more than once"""
+        return {key: count for key, count in self.fingerprints.items() if count > 1}
+
+
+def describe_param(param):
+    """Type and size of a query parameter, which is kept instead of its value"""
+    if isinstance(param, (str, bytes, bytearray, memoryview, list, tuple, dict)):
+        return f'{type(param).__name__}[{len(param)}]'
+    return type(param).__name__
+
+
+def explain(alias, sql, params):
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{prefix} {sql}', params)
+        return '\n'.join(' '.join(str(column) for column in row)
+                         for row in cursor.fetchall())
+
+
+class QueryStats:
+    """Per-process query counts and DB time per view, plus recent slow requests"""
+
+    def __init__(self, slow_log_size=50, max_duplicates=10):
+        self._lock = threading.Lock()
+        self.views = {}
+        self.slow = deque(maxlen=slow_log_size)
+        self.max_duplicates = max_duplicates
+
+    def record(self, name, recorder, slow=None):
+        with self._lock:
+            view = self.views.setdefault(name, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_time_ms': 0.0, 'max_db_time_ms': 0.0,
+                'duplicate_queries': 0, 'slow_requests': 0, 'duplicates': {},
+            })
+            db_time = recorder.duration * 1000
+            view['requests'] += 1
+            view['queries'] += recorder.count
+            view['max_queries'] = max(view['max_queries'], recorder.count)
+            view['db_time_ms'] += db_time
+            view['max_db_time_ms'] = max(view['max_db_time_ms'], db_time)
+            duplicates = view['duplicates']
+            for key, count in recorder.duplicates.items():
+                view['duplicate_queries'] += count - 1
+                if key in duplicates:
+                    duplicates[key]['requests'] += 1
+                    duplicates[key]['max_count'] = max(duplicates[key]['max_count'], count)
+                elif len(duplicates) < self.max_duplicates:
+                    duplicates[key] = {'sql': recorder.samples[key][:_SQL_PREVIEW],
+                                       'requests': 1, 'max_count': count}
+            if slow is not None:
+                view['slow_requests'] += 1
+                self.slow.append(slow)
+
+    def snapshot(self):
+        with self._lock:
+            views = {}
+            for name, view in sorted(self.views.items()):
+                views[name] = {
+                    **view,
+                    'avg_queries': round(view['queries'] / view['requests'], 2),
+                    'avg_db_time_ms': round(view['db_time_ms'] / view['requests'], 3),
+                    'db_time_ms': round(view['db_time_ms'], 3),
+                    'max_db_time_ms': round(view['max_db_time_ms'], 3),
+                    'duplicates': {key: dict(value) for key, value
+                                   in view['duplicates'].items()},
+                }
+            return {'views': views, 'slow_requests': list(self.slow)}
+
+    def reset(self):
+        with self._lock:
+            self.views.clear()
+            self.slow.clear()
+
+
+query_stats = QueryStats()
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Counts and times the SQL of every request under QUERY_INSTRUMENTATION_PATHS
+    with a connection execute wrapper, and reports it in `query_stats`
+    (served to admins at /api/v1/query-stats/) and, with DEBUG or to staff,
+    in a `Server-Timing` header. Requests at or over QUERY_SLOW_DB_MS of DB
+    time or QUERY_SLOW_COUNT queries also log their slowest queries with
+    their EXPLAIN output; parameter values are reduced to types and sizes.
+
+    The wrapper only adds a timer and a hash per query; the SQL is kept by
+    reference, and EXPLAIN only runs for slow requests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def instrumented(self, request):
+        return settings.QUERY_INSTRUMENTATION and request.path_info.startswith(
+            tuple(settings.QUERY_INSTRUMENTATION_PATHS))
+
+    def __call__(self, request):
+        if not self.instrumented(request):
+            return self.get_response(request)
+
+        recorder = request.query_recorder = QueryRecorder(
+            capture=settings.QUERY_CAPTURE_LIMIT)
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        name = match.view_name if match is not None else 'unresolved'
+        slow = None
+        if (recorder.duration * 1000 >= settings.QUERY_SLOW_DB_MS or
+                recorder.count >= settings.QUERY_SLOW_COUNT):
+            slow = self.slow_entry(request, name, recorder, total)
+        query_stats.record(name, recorder, slow)
+        if not self.show_timing(request):
+            return response
+
+        duplicates = sum(count - 1 for count in recorder.duplicates.values())
+        timing = (f'db;dur={recorder.duration * 1000:.1f};'
+                  f'desc="{recorder.count} queries, {duplicates} duplicate", '
+                  f'app;dur={total * 1000:.1f}')
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+        return response
+
+    def show_timing(self, request):
+        # Timings help tell which requests hit the database; only for staff
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or (user is not None and user.is_staff)
+
+    def slow_entry(self, request, name, recorder, total):
+        slowest = sorted(recorder.queries, key=lambda query: -query[3])
+        queries = []
+        for index, (alias, sql, params, duration, many) in enumerate(
+                slowest[:settings.QUERY_SLOW_CAPTURE]):
+            entry = {'sql': sql, 'params': [describe_param(param) for param in params or ()]
+                     if not many else None, 'duration_ms': round(duration * 1000, 3),
+                     'count': recorder.fingerprints[fingerprint(sql)]}
+            if (index < settings.QUERY_EXPLAIN_LIMIT and not many and
+                    sql.lstrip()[:6].upper() == 'SELECT'):
+                try:
+                    entry['explain'] = explain(alias, sql, params)
+                except Exception as e:
+                    entry['explain'] = f'{type(e).__name__}: {e}'
+            queries.append(entry)
+        return {
+            'view': name, 'method': request.method, 'path': request.path,
+            'duration_ms': round(total * 1000, 3),
+            'db_time_ms': round(recorder.duration * 1000, 3),
+            'query_count': recorder.count, 'queries': queries,
+        }
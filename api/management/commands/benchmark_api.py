@@ -0,0 +1,184 @@
+import json
+import random
+import statistics
+import time
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from order.models import Cart, Order
+from order.services import CartService, OrderService
+from store.models import Category, Product
+from store.pagination import ProductPagination
+from users.authentication import TokenObtainPairSerializer
+from users.models import User
+
+
+def percentile(timings, share):
+    """Nearest-rank percentile of sorted `timings`"""
+    return timings[min(len(timings) - 1, max(0, round(share * len(timings)) - 1))]
+
+
+class Command(BaseCommand):
+    help = ('Drive the API endpoints in-process against the current database and '
+            'report latency percentiles and queries per request')
+
+    scenarios = ('product-list', 'product-search', 'product-filter',
+                 'product-detail', 'cart-add', 'checkout', 'order-history')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--scenario', action='append', choices=self.scenarios,
+                            help='Run only these scenarios (repeatable)')
+        parser.add_argument('--clear-cache', action='store_true',
+                            help='Clear the response cache before every request')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', help='Write the results as JSON')
+        parser.add_argument('--baseline',
+                            help='JSON results of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=25.0,
+                            help='Allowed p99 slowdown against the baseline, in percent')
+
+    def request(self, method, path, data=None):
+        if self.clear_cache:
+            cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, data, format='json')
+            elapsed = time.perf_counter() - start
+        return response, elapsed, len(ctx.captured_queries)
+
+    def run(self, name, step, iterations, warmup):
+        timings, queries, errors = [], [], 0
+        for i in range(warmup + iterations):
+            setup = getattr(self, f'setup_{name.replace("-", "_")}', None)
+            if setup is not None:
+                setup()
+            response, elapsed, count = self.request(*step())
+            if i < warmup:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(count)
+            if response.status_code >= 400:
+                errors += 1
+        timings.sort()
+        return {
+            'requests': iterations, 'errors': errors,
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+        }
+
+    # Scenarios return (method, path, data); setup_* runs untimed before each
+
+    def product_list(self):
+        pages = self.product_count // ProductPagination.page_size
+        page = self.random.randint(1, max(1, min(pages, 100)))
+        return 'get', f'/api/v1/products/?page={page}', None
+
+    def product_search(self):
+        words = self.random.choice(self.names).split()
+        return 'get', '/api/v1/products/', {'search': words[0]}
+
+    def product_filter(self):
+        return 'get', '/api/v1/products/', {
+            'category_id': self.random.choice(self.category_ids),
+            'price__gt': 100, 'ordering': '-average_rating'}
+
+    def product_detail(self):
+        return 'get', f'/api/v1/products/{self.random.choice(self.product_ids)}/', None
+
+    def cart_add(self):
+        return 'post', f'/api/v1/carts/{self.cart.pk}/items/', {
+            'product_id': self.random.choice(self.product_ids), 'quantity': 1}
+
+    def setup_checkout(self):
+        Cart.objects.filter(user=self.user).delete()
+        self.cart = Cart.objects.create(user=self.user)
+        for product_id in self.random.sample(self.product_ids, min(3, len(self.product_ids))):
+            CartService.add_item(self.cart.pk, product_id, 1)
+
+    def checkout(self):
+        return 'post', '/api/v1/orders/', {'cart_id': str(self.cart.pk)}
+
+    def order_history(self):
+        return 'get', '/api/v1/orders/', None
+
+    def setup(self):
+        self.product_ids = list(Product.objects.filter(stock__gt=0)
+                                .values_list('pk', flat=True)[:10_000])
+        if not self.product_ids:
+            raise CommandError('No products with stock to benchmark; run '
+                               '`manage.py generate_data` first')
+        self.product_count = Product.objects.count()
+        self.names = list(Product.objects.filter(pk__in=self.product_ids[:500])
+                          .values_list('name', flat=True))
+        self.category_ids = list(Category.objects.values_list('pk', flat=True)[:500]) or [0]
+        self.user = User.objects.create_user(
+            email=f'benchmark-{time.time_ns()}@example.com', password=None)
+        token = TokenObtainPairSerializer.get_token(self.user).access_token
+        # A host ALLOWED_HOSTS accepts; the test client's default is not
+        self.client = APIClient(HTTP_HOST='127.0.0.1')
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def teardown(self):
+        # Put back the stock the checkouts took
+        for order in Order.objects.filter(user=self.user):
+            OrderService.cancel_order(order, self.user)
+        self.user.delete()
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.clear_cache = options['clear_cache']
+        self.setup()
+        results = {}
+        try:
+            for name in options['scenario'] or self.scenarios:
+                if name == 'cart-add':
+                    Cart.objects.filter(user=self.user).delete()
+                    self.cart = Cart.objects.create(user=self.user)
+                results[name] = self.run(
+                    name, getattr(self, name.replace('-', '_')),
+                    options['iterations'], options['warmup'])
+                self.report(name, results[name])
+        finally:
+            self.teardown()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<15} p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+            f"queries {result['queries_mean']:6.2f} (max {result['queries_max']})"
+            + (f"  errors {result['errors']}" if result['errors'] else ''))
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result['p99_ms'] > before['p99_ms'] * (1 + tolerance / 100):
+                regressions.append(
+                    f"{name}: p99 {before['p99_ms']:.2f} -> {result['p99_ms']:.2f} ms")
+            if result['queries_max'] > before['queries_max']:
+                regressions.append(
+                    f"{name}: queries {before['queries_max']} -> {result['queries_max']}")
+            if result['errors'] > before['errors']:
+                regressions.append(
+                    f"{name}: errors {before['errors']} -> {result['errors']}")
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n  '
+                               + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,183 @@
+import random
+import time
+from decimal import Decimal
+from uuid import uuid4
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.cache import bump_model_version
+from order.models import Cart, CartItem, Order, OrderItem
+from store.models import Category, Product, ProductImage, Review
+from store.search import get_search_backend
+from store.services import RatingService
+from store.snapshots import rebuild_all
+from users.models import User
+
+WORDS = (
+    'cotton', 'denim', 'linen', 'wool', 'silk', 'leather', 'classic', 'slim',
+    'relaxed', 'oversized', 'vintage', 'summer', 'winter', 'casual', 'formal',
+    'striped', 'printed', 'plain', 'knit', 'waterproof', 'jacket', 'shirt',
+    'jeans', 'dress', 'hoodie', 'sweater', 'trousers', 'skirt', 'sneakers',
+    'boots', 'cap', 'scarf', 'polo', 'blazer', 'shorts', 'kurta', 'panjabi',
+    'saree', 'tee', 'cardigan',
+)
+COMMENTS = (
+    'Great quality for the price.', 'Runs a little small.',
+    'Colour is exactly as pictured.', 'Fabric feels cheap.',
+    'Fast delivery, would buy again.', 'Not worth it.',
+    'Comfortable and fits well.', 'Stitching came loose after a week.',
+)
+
+
+class Command(BaseCommand):
+    help = ('Bulk-generate a synthetic catalog with users, reviews, carts and '
+            'orders for load testing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--images', type=int, default=2,
+                            help='Images per product')
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--reviews', type=int, default=50_000)
+        parser.add_argument('--carts', type=float, default=0.3,
+                            help='Share of users with a cart')
+        parser.add_argument('--cart-items', type=int, default=3)
+        parser.add_argument('--orders', type=int, default=2,
+                            help='Orders per user')
+        parser.add_argument('--order-items', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=1_000)
+        parser.add_argument('--chunk-size', type=int, default=5_000)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Skip rating aggregates, search index and snapshots')
+
+    def insert(self, model, objects, total, label=None):
+        """bulk_create `objects` in chunks and return their primary keys"""
+        pks = []
+        chunk = []
+        label = label or model._meta.verbose_name_plural
+        for obj in objects:
+            chunk.append(obj)
+            if len(chunk) == self.chunk_size:
+                pks += self.flush(model, chunk)
+                chunk = []
+                self.stdout.write(f'  {label}: {len(pks)}/{total}')
+        if chunk:
+            pks += self.flush(model, chunk)
+        return pks
+
+    def flush(self, model, chunk):
+        with transaction.atomic():
+            created = model.objects.bulk_create(chunk)
+        pks = [obj.pk for obj in created]
+        if pks and pks[0] is None:
+            raise CommandError(
+                'The database did not return primary keys from bulk_create; '
+                'use PostgreSQL or SQLite 3.35+')
+        return pks
+
+    def words(self, count):
+        return ' '.join(self.random.choices(WORDS, k=count))
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        run = uuid4().hex[:8]
+        start = time.perf_counter()
+
+        category_ids = self.insert(Category, (
+            Category(name=f'{self.words(1).title()} {run} {i}',
+                     description=self.words(8))
+            for i in range(options['categories'])), options['categories'])
+
+        prices = []
+
+        def products():
+            for i in range(options['products']):
+                price = Decimal(self.random.randrange(100, 2_000_000)) / 100
+                prices.append(price)
+                yield Product(
+                    name=f'{self.words(3).title()} {run}-{i}',
+                    description=self.words(30), price=price,
+                    stock=options['stock'], image='sample',
+                    category_id=self.random.choice(category_ids) if category_ids else None,
+                    featured=self.random.random() < 0.02)
+
+        product_ids = self.insert(Product, products(), options['products'])
+        price_of = dict(zip(product_ids, prices))
+
+        self.insert(ProductImage, (
+            ProductImage(product_id=product_id, image='sample')
+            for product_id in product_ids for _ in range(options['images'])),
+            len(product_ids) * options['images'])
+
+        # Hashing is the slow part of creating users; they share one password
+        password = make_password('benchmark')
+        user_ids = self.insert(User, (
+            User(email=f'user-{run}-{i}@example.com', password=password,
+                 first_name=self.words(1).title(), last_name=self.words(1).title())
+            for i in range(options['users'])), options['users'])
+
+        if product_ids and user_ids:
+            self.insert(Review, (
+                Review(product_id=self.random.choice(product_ids),
+                       user_id=self.random.choice(user_ids),
+                       rating=self.random.choices(range(1, 6), (1, 1, 2, 4, 5))[0],
+                       comment=self.random.choice(COMMENTS))
+                for _ in range(options['reviews'])), options['reviews'])
+
+            cart_users = [pk for pk in user_ids if self.random.random() < options['carts']]
+            cart_ids = self.insert(
+                Cart, (Cart(user_id=pk) for pk in cart_users), len(cart_users))
+            self.insert(CartItem, (
+                CartItem(cart_id=cart_id, product_id=product_id,
+                         quantity=self.random.randint(1, 3))
+                for cart_id in cart_ids
+                for product_id in self.random.sample(
+                    product_ids, min(options['cart_items'], len(product_ids)))),
+                len(cart_ids) * options['cart_items'], 'cart items')
+            self.generate_orders(user_ids, product_ids, price_of, options)
+
+        if not options['skip_derived']:
+            self.stdout.write('Recomputing rating aggregates')
+            RatingService.recompute(chunk_size=options['chunk_size'])
+            self.stdout.write('Rebuilding the search index')
+            get_search_backend().rebuild()
+            self.stdout.write('Rebuilding product snapshots')
+            rebuild_all()
+        for model in (Category, Product, ProductImage, Review):
+            bump_model_version(model)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated run {run} in {time.perf_counter() - start:.1f}s'))
+
+    def generate_orders(self, user_ids, product_ids, price_of, options):
+        orders = []
+        items = []
+        statuses = [status for status, _ in Order.STATUS_CHOICES]
+        for user_id in user_ids:
+            for _ in range(options['orders']):
+                order = Order(user_id=user_id, status=self.random.choice(statuses),
+                              total_price=0)
+                for product_id in self.random.sample(
+                        product_ids, min(options['order_items'], len(product_ids))):
+                    quantity = self.random.randint(1, 3)
+                    price = price_of[product_id]
+                    order.total_price += price * quantity
+                    items.append(OrderItem(order=order, product_id=product_id,
+                                           price=price, quantity=quantity,
+                                           total_price=price * quantity))
+                orders.append(order)
+            if len(orders) >= self.chunk_size:
+                self.flush_orders(orders, items)
+                orders, items = [], []
+        self.flush_orders(orders, items)
+
+    def flush_orders(self, orders, items):
+        # Order ids are client-side UUIDs, so items can reference them directly
+        if orders:
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                OrderItem.objects.bulk_create(items, batch_size=self.chunk_size)
+            self.stdout.write(f'  orders: +{len(orders)} ({len(items)} items)')
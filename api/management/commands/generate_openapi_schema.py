@@ -0,0 +1,22 @@
+from pathlib import Path
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from api.schema import STATIC_SCHEMA, encode_schema, generate_schema
+
+
+class Command(BaseCommand):
+    help = ('Write the OpenAPI document to api/static/ so collectstatic ships '
+            'it with the build; run it before collectstatic')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=str(Path(apps.get_app_config('api').path)
+                                    / 'static' / STATIC_SCHEMA))
+
+    def handle(self, *args, **options):
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        schema = generate_schema()
+        output.write_bytes(encode_schema(schema))
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(schema['paths'])} paths to {output}"))
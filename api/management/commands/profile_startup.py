@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter, like a serverless cold start
+SCRIPT = '''
+import io, json, sys, time
+start = time.perf_counter()
+from drivnbd.wsgi import application
+loaded = time.perf_counter()
+
+def get(path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+        'wsgi.multithread': False, 'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    status = []
+    body = b''.join(application(environ, lambda s, h, e=None: status.append(s)))
+    return status[0], len(body)
+
+status, size = get(sys.argv[1])
+first = time.perf_counter()
+get(sys.argv[1])
+second = time.perf_counter()
+print(json.dumps({
+    'import': loaded - start, 'first': first - loaded, 'second': second - first,
+    'status': status, 'size': size, 'modules': len(sys.modules),
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """`{module: (self_us, cumulative_us)}` from `python -X importtime` output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = ('Measure cold-start import time and time-to-first-response of the '
+            'WSGI app, with per-module import costs')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/v1/products/')
+        parser.add_argument('--top', type=int, default=25)
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Cold starts to time, plus one to profile imports')
+        parser.add_argument('--eager', action='store_true',
+                            help='Profile with LAZY_STARTUP disabled')
+
+    def cold_start(self, path, eager, importtime=False):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'drivnbd.settings')}
+        if eager:
+            env['LAZY_STARTUP'] = 'False'
+        flags = ['-X', 'importtime'] if importtime else []
+        result = subprocess.run(
+            [sys.executable, *flags, '-c', SCRIPT, path],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(result.stderr[-2000:])
+        return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    def handle(self, *args, **options):
+        # -X importtime slows imports down, so it only runs once, untimed
+        timings = sorted(
+            (self.cold_start(options['path'], options['eager'])[0]
+             for _ in range(max(1, options['runs']))),
+            key=lambda timing: timing['import'] + timing['first'])
+        median = timings[len(timings) // 2]
+        modules = parse_importtime(self.cold_start(
+            options['path'], options['eager'], importtime=True)[1])
+
+        self.stdout.write(
+            f"{'eager' if options['eager'] else 'lazy'} startup, "
+            f"median of {len(timings)} cold starts for {options['path']} "
+            f"({median['status']}, {median['size']} bytes)")
+        self.stdout.write(
+            f"  import wsgi     {median['import'] * 1000:8.1f} ms\n"
+            f"  first response  {median['first'] * 1000:8.1f} ms\n"
+            f"  time to first   {(median['import'] + median['first']) * 1000:8.1f} ms\n"
+            f"  warm response   {median['second'] * 1000:8.1f} ms\n"
+            f"  modules loaded  {median['modules']:8d}")
+
+        packages = Counter()
+        for name, (self_us, _) in modules.items():
+            packages[name.split('.')[0]] += self_us
+        self.stdout.write('\nImport time by top-level package (self, ms)')
+        for name, total in packages.most_common(options['top']):
+            self.stdout.write(f'  {total / 1000:8.1f}  {name}')
+
+        self.stdout.write('\nSlowest modules (cumulative, ms)')
+        slowest = sorted(modules.items(), key=lambda item: -item[1][1])
+        for name, (_, cumulative_us) in slowest[:options['top']]:
+            self.stdout.write(f'  {cumulative_us / 1000:8.1f}  {name}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from api.tasks import retry_failed, work
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (see api.tasks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Tasks claimed per query, TASK_BATCH_SIZE by default')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no task is due instead of polling')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when no task is due')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Queue tasks that ran out of attempts again first')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f'Requeued {retry_failed()} failed tasks')
+        succeeded, failed = work(
+            batch_size=options['batch_size'], once=options['once'],
+            sleep=options['sleep'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ran {succeeded + failed} tasks ({failed} failed)'))
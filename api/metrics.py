@@ -0,0 +1,372 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_header = struct.Struct('i')
+_double = struct.Struct('d')
+
+
+class MmapStore:
+    """
+    One process's metric values in a memory-mapped file, so that a scrape
+    served by any worker can add up the values of all of them (the same
+    layout idea as prometheus_client's multiprocess mode). The file starts
+    with the number of bytes used, followed by `(key length, key, value)`
+    entries padded to 8 bytes; values are written in place.
+    """
+    initial_size = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(self.initial_size)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        # Maps replaced by a bigger one stay open: writers may still hold
+        # them, and writes through any of them land in the same file
+        self._old_maps = []
+        self._used = _header.unpack_from(self._map, 0)[0] or 8
+        self.positions = {key: position for key, position, _ in self._entries(
+            self._map, self._used)}
+
+    @staticmethod
+    def _entries(data, used):
+        position = 8
+        while position < used:
+            length = _header.unpack_from(data, position)[0]
+            position += 4
+            key = data[position:position + length].decode()
+            position += length + (8 - (length + 4) % 8) % 8
+            yield key, position, _double.unpack_from(data, position)[0]
+            position += 8
+
+    @classmethod
+    def read(cls, path):
+        """`(key, value)` of every entry in a store file"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < 8:
+            return []
+        return [(key, value) for key, _, value in
+                cls._entries(data, _header.unpack_from(data, 0)[0])]
+
+    def position(self, key):
+        """Offset of `key`'s value, adding the entry if it is new"""
+        with self._lock:
+            position = self.positions.get(key)
+            if position is not None:
+                return position
+            encoded = key.encode()
+            padding = (8 - (len(encoded) + 4) % 8) % 8
+            entry = (_header.pack(len(encoded)) + encoded + b' ' * padding +
+                     _double.pack(0.0))
+            while self._used + len(entry) > self._capacity:
+                self._capacity *= 2
+                self._file.truncate(self._capacity)
+                self._old_maps.append(self._map)
+                self._map = mmap.mmap(self._file.fileno(), self._capacity)
+            self._map[self._used:self._used + len(entry)] = entry
+            self._used += len(entry)
+            _header.pack_into(self._map, 0, self._used)
+            position = self.positions[key] = self._used - 8
+            return position
+
+    def write(self, position, value):
+        _double.pack_into(self._map, position, value)
+
+    def close(self):
+        for old in self._old_maps:
+            old.close()
+        self._map.close()
+        self._file.close()
+
+
+class Metric:
+    """
+    Values are kept per thread, so observations take no lock; collecting
+    adds up the shards of every thread that has recorded one. With a store
+    the threads share one locked shard instead, so the file holds a single
+    entry per series and process however many threads come and go.
+    """
+    type = None
+
+    def __init__(self, registry, name, help, labels):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.reset()
+
+    def reset(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # One {label values: ([value per slot], [store offsets] or None)}
+        # per thread; kept after the thread exits so no counts are lost
+        self._shards = []
+        self._process_shard = None
+
+    def slots(self):
+        return 1
+
+    def _series(self, labelvalues):
+        store = self.registry.store
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            if store is None:
+                with self._lock:
+                    self._shards.append(shard)
+        series = shard.get(labelvalues)
+        if series is None:
+            if store is None:
+                series = shard[labelvalues] = ([0.0] * self.slots(), None)
+            else:
+                # The thread's shard only caches the process-wide series
+                with self._lock:
+                    if self._process_shard is None:
+                        self._process_shard = {}
+                        self._shards.append(self._process_shard)
+                    series = self._process_shard.get(labelvalues)
+                    if series is None:
+                        series = self._process_shard[labelvalues] = (
+                            [0.0] * self.slots(), [
+                                store.position(json.dumps([self.name, labelvalues, slot]))
+                                for slot in range(self.slots())])
+                shard[labelvalues] = series
+        return series
+
+    def collect(self):
+        """`{label values: [values]}` summed over this process's threads"""
+        with self._lock:
+            shards = list(self._shards)
+        collected = {}
+        for shard in shards:
+            for labelvalues, (values, _) in list(shard.items()):
+                totals = collected.setdefault(labelvalues, [0.0] * len(values))
+                for slot, value in enumerate(values):
+                    totals[slot] += value
+        return collected
+
+    def samples(self, values):
+        """`(suffix, extra labels, value)` lines of one series"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        try:
+            values, positions = self._local.shard[labelvalues]
+        except (AttributeError, KeyError):
+            values, positions = self._series(labelvalues)
+        if positions is None:
+            values[0] += amount
+            return
+        with self._lock:
+            values[0] += amount
+            self.registry.store.write(positions[0], values[0])
+
+    def samples(self, values):
+        yield '', (), values[0]
+
+
+class Histogram(Metric):
+    """
+    Fixed-bucket histogram. Slots hold the non-cumulative count of each
+    bucket, then the +Inf bucket, then the sum; the count is their total.
+    """
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labels, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, help, labels)
+
+    def slots(self):
+        return len(self.buckets) + 2
+
+    def observe(self, value, *labelvalues):
+        bucket = bisect_left(self.buckets, value)
+        try:
+            values, positions = self._local.shard[labelvalues]
+        except (AttributeError, KeyError):
+            values, positions = self._series(labelvalues)
+        if positions is None:
+            values[bucket] += 1
+            values[-1] += value
+            return
+        write = self.registry.store.write
+        with self._lock:
+            values[bucket] += 1
+            values[-1] += value
+            write(positions[bucket], values[bucket])
+            write(positions[-1], values[-1])
+
+    def samples(self, values):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), values):
+            cumulative += count
+            yield '_bucket', (('le', _format_value(bound)),), cumulative
+        yield '_sum', (), values[-1]
+        yield '_count', (), cumulative
+
+
+def _format_value(value):
+    return value if isinstance(value, str) else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Registry:
+    """
+    Metrics of this process. With a `directory` each process also mirrors
+    its values into `<directory>/metrics_<pid>.db` and `collect()` adds up
+    every file there, so any gunicorn worker can serve the whole picture.
+    The directory must be emptied when the server (re)starts, which
+    gunicorn.conf.py does.
+    """
+
+    def __init__(self, directory=None):
+        self.metrics = {}
+        self.directory = directory
+        self.store = None
+        self._open_store()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _open_store(self):
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.store = MmapStore(os.path.join(
+                self.directory, f'metrics_{os.getpid()}.db'))
+
+    def _after_fork(self):
+        # Values recorded before the fork belong to the parent's file
+        self.store = None
+        self._open_store()
+        self.reset()
+
+    def reset(self):
+        """Forget this process's values (those already in the store stay)"""
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def collect(self):
+        """`{metric name: {label values: [values]}}` across processes"""
+        if self.store is None:
+            return {name: metric.collect() for name, metric in self.metrics.items()}
+
+        collected = defaultdict(dict)
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.db')):
+            for key, value in MmapStore.read(path):
+                name, labelvalues, slot = json.loads(key)
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                values = collected[name].setdefault(
+                    tuple(labelvalues), [0.0] * metric.slots())
+                values[slot] += value
+        return collected
+
+    def expose(self):
+        """All metrics in the Prometheus text exposition format"""
+        collected = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labelvalues, values in sorted(collected.get(name, {}).items()):
+                labels = tuple(zip(metric.labels, labelvalues))
+                for suffix, extra, value in metric.samples(values):
+                    pairs = ','.join(f'{key}="{_escape(label)}"'
+                                     for key, label in labels + extra)
+                    lines.append(f'{name}{suffix}{{{pairs}}} {_format_value(value)}'
+                                 if pairs else f'{name}{suffix} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(settings.METRICS_MULTIPROCESS_DIR or None)
+
+LABELS = ('view', 'action')
+# Other methods are labelled `other`, so clients cannot add series at will
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+requests_total = registry.counter(
+    'http_requests_total', 'API requests by view, action, method and status.',
+    LABELS + ('method', 'status'))
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time to build API responses.', LABELS)
+request_db_time = registry.histogram(
+    'http_request_db_seconds', 'Time API requests spent in SQL queries.', LABELS)
+request_serializer_time = registry.histogram(
+    'http_request_serializer_seconds',
+    'Time API requests spent serializing response data, including any '
+    'queries that triggers.', LABELS)
+
+
+def add_serializer_time(request, seconds):
+    """Count `seconds` of serialization towards the request's metrics"""
+    request = getattr(request, '_request', request)
+    if request is not None:
+        request.serializer_seconds = getattr(request, 'serializer_seconds', 0.0) + seconds
+
+
+class MetricsMiddleware:
+    """
+    Records count, latency, DB time (from api.instrumentation) and
+    serializer time of requests under METRICS_PATHS, labelled with the view
+    name and viewset action.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (settings.METRICS and request.path_info.startswith(
+                tuple(settings.METRICS_PATHS))):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        if match is None:
+            view, action = 'unresolved', ''
+        else:
+            view = match.view_name
+            actions = getattr(match.func, 'actions', None) or {}
+            action = actions.get(request.method.lower(), '')
+        method = request.method if request.method in METHODS else 'other'
+        requests_total.inc(view, action, method, str(response.status_code))
+        request_duration.observe(duration, view, action)
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is not None:
+            request_db_time.observe(recorder.duration, view, action)
+        request_serializer_time.observe(
+            getattr(request, 'serializer_seconds', 0.0), view, action)
+        return response
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+from importlib import metadata
+from pathlib import Path
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.staticfiles.storage import staticfiles_storage
+from drf_yasg import openapi
+from drf_yasg.app_settings import swagger_settings
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.renderers import ReDocRenderer, SwaggerUIRenderer
+# View annotations live outside the views so only the docs import drf_yasg
+import store.schema  # noqa: F401
+
+API_INFO = openapi.Info(
+    title="DrivnBD E-Commerce API",
+    default_version='v1',
+    description="API Documentation for DrivnBD E-Commerce Project",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="contact@drivnbd.com"),
+    license=openapi.License(name="BSD License"),
+)
+
+# Written by `manage.py generate_openapi_schema`, served by WhiteNoise
+STATIC_SCHEMA = 'api/openapi.json'
+FINGERPRINT_KEY = 'x-schema-fingerprint'
+# Subpackages that never contribute to the schema
+_SKIPPED = {'migrations', 'management', 'tests', '__pycache__'}
+_PACKAGES = ('Django', 'djangorestframework', 'drf-yasg', 'djoser',
+             'djangorestframework_simplejwt', 'django-filter')
+
+_lock = threading.Lock()
+_memo = {}
+
+
+def schema_fingerprint():
+    """
+    Hash of everything the generated schema depends on: the source of the
+    project's own modules, subpackages included (URLconfs, settings, views,
+    serializers, filters, models), the versions of the packages
+    contributing endpoints and the swagger settings. Computed once per
+    process.
+    """
+    if 'fingerprint' in _memo:
+        return _memo['fingerprint']
+    digest = hashlib.sha256()
+    base = Path(settings.BASE_DIR)
+    roots = [base / Path(*settings.ROOT_URLCONF.split('.')[:-1])]
+    roots += [Path(config.path) for config in apps.get_app_configs()
+              if Path(config.path).is_relative_to(base)]
+    paths = set()
+    for root in roots:
+        paths.update(
+            path for path in root.rglob('*.py')
+            if not _SKIPPED.intersection(path.relative_to(root).parts)
+            and path.name != 'tests.py')
+    for path in sorted(paths):
+        digest.update(str(path.relative_to(base)).encode())
+        digest.update(path.read_bytes())
+    for package in _PACKAGES:
+        try:
+            digest.update(f'{package}=={metadata.version(package)}'.encode())
+        except metadata.PackageNotFoundError:
+            pass
+    digest.update(repr(sorted(getattr(settings, 'SWAGGER_SETTINGS', {}).items())).encode())
+    _memo['fingerprint'] = digest.hexdigest()[:16]
+    return _memo['fingerprint']
+
+
+def generate_schema(version=''):
+    """The public OpenAPI document, independent of any request"""
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(API_INFO, version)
+    schema = generator.get_schema(request=None, public=True)
+    schema[FINGERPRINT_KEY] = schema_fingerprint()
+    return schema
+
+
+def get_schema(version=''):
+    """
+    generate_schema(), memoized per process and fingerprint. Processes
+    sharing the cache (serverless instances, workers) also share the
+    result, so builds that do not ship the static schema generate it once
+    per deploy rather than once per cold start.
+    """
+    key = (schema_fingerprint(), version)
+    schema = _memo.get(key)
+    if schema is None:
+        with _lock:
+            schema = _memo.get(key)
+            if schema is None:
+                cache_key = f'openapi-schema:{key[0]}:{version}'
+                schema = cache.get(cache_key)
+                if schema is None:
+                    schema = generate_schema(version)
+                    cache.set(cache_key, schema, None)
+                _memo[key] = schema
+    return schema
+
+
+def encode_schema(schema):
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def static_schema_url():
+    """
+    URL of the build-time schema if it was collected and still matches the
+    code, else None (the docs then fetch the schema view instead).
+    """
+    if 'static_url' not in _memo:
+        _memo['static_url'] = _find_static_schema()
+    return _memo['static_url']
+
+
+def _find_static_schema():
+    try:
+        if not staticfiles_storage.exists(STATIC_SCHEMA):
+            return None
+        with staticfiles_storage.open(STATIC_SCHEMA) as f:
+            fingerprint = json.load(f).get(FINGERPRINT_KEY)
+        if fingerprint != schema_fingerprint():
+            return None
+        return staticfiles_storage.url(STATIC_SCHEMA)
+    except (OSError, ValueError):
+        # Unreadable or missing from the staticfiles manifest
+        return None
+
+
+def clear():
+    _memo.clear()
+
+
+class StaticSchemaSwaggerUIRenderer(SwaggerUIRenderer):
+    def get_swagger_ui_settings(self):
+        data = super().get_swagger_ui_settings()
+        data['url'] = static_schema_url() or data.get('url')
+        return {key: value for key, value in data.items() if value is not None}
+
+
+class StaticSchemaReDocRenderer(ReDocRenderer):
+    def get_redoc_settings(self):
+        data = super().get_redoc_settings()
+        data['url'] = static_schema_url() or data.get('url')
+        return {key: value for key, value in data.items() if value is not None}
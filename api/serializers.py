@@ -0,0 +1,72 @@
+import time
+from rest_framework import permissions, serializers
+from api.metrics import add_serializer_time
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def _param_set(request, name):
+    value = request.query_params.get(name) if request is not None else None
+    if not value:
+        return None
+    return {field.strip() for field in value.split(',') if field.strip()}
+
+
+def sparse_fieldset(request):
+    """
+    The `(fields, omit)` sets requested with `?fields=` / `?omit=`, or
+    `(None, None)` when the request does not ask for a sparse fieldset.
+    Only safe methods honour them.
+    """
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return None, None
+    return _param_set(request, FIELDS_PARAM), _param_set(request, OMIT_PARAM)
+
+
+def wants_field(request, name):
+    """Whether the response for `request` will include the top-level field"""
+    fields, omit = sparse_fieldset(request)
+    if fields is not None and name not in fields:
+        return False
+    return not (omit and name in omit)
+
+
+class SparseFieldsMixin:
+    """
+    Lets clients trim the top-level fields of a read response with
+    `?fields=a,b` or `?omit=c`. Dropped fields are never evaluated, so
+    views can also skip the queries behind them (see `wants_field`).
+    """
+
+    def _is_response_root(self):
+        parent = self.parent
+        return parent is None or (
+            isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_response_root():
+            return fields
+        request = self.context.get('request')
+        return {name: field for name, field in fields.items()
+                if wants_field(request, name)}
+
+    def to_representation(self, instance):
+        if not self._is_response_root():
+            return super().to_representation(instance)
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            add_serializer_time(self.context.get('request'),
+                                time.perf_counter() - start)
+
+    def filter_representation(self, data):
+        """Apply the sparse fieldset to an already built representation"""
+        fields, omit = sparse_fieldset(self.context.get('request'))
+        if fields is None and not omit:
+            return data
+        return {name: value for name, value in data.items()
+                if (fields is None or name in fields) and
+                not (omit and name in omit)}
@@ -0,0 +1,129 @@
+import functools
+import logging
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from api.models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def task(func=None, *, max_attempts=None, atomic=True):
+    """
+    Make `func` a background task. `func.enqueue(*args, **kwargs)` stores
+    the call, with JSON-serializable arguments, in the caller's transaction,
+    so it only runs if that commits. `manage.py run_tasks` executes queued
+    calls and retries failures with exponential backoff, up to
+    `max_attempts` (TASK_MAX_ATTEMPTS) times. With TASK_QUEUE_EAGER they run
+    in-process as soon as the transaction commits instead.
+
+    Tasks run in a transaction unless `atomic=False`, for tasks that wait
+    on the network and manage their own writes.
+    """
+    if func is None:
+        return functools.partial(task, max_attempts=max_attempts, atomic=atomic)
+
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    def enqueue(*args, **kwargs):
+        return enqueue_call(name, args, kwargs, max_attempts)
+
+    func.enqueue = enqueue
+    func.atomic = atomic
+    return func
+
+
+def enqueue_call(name, args=(), kwargs=None, max_attempts=None):
+    job = Task.objects.create(
+        name=name, args=list(args), kwargs=kwargs or {},
+        max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS,
+        run_at=timezone.now())
+    if settings.TASK_QUEUE_EAGER:
+        transaction.on_commit(lambda: run_batch(Task.objects.filter(pk=job.pk)))
+    return job
+
+
+def _due(now):
+    lease = timedelta(seconds=settings.TASK_LEASE)
+    return Task.objects.filter(
+        Q(status=Task.PENDING, run_at__lte=now) |
+        Q(status=Task.RUNNING, locked_at__lt=now - lease))
+
+
+def dequeue(batch_size, queryset=None):
+    """
+    Claim up to `batch_size` due tasks, oldest first. On Postgres the rows
+    are selected with FOR UPDATE SKIP LOCKED, so concurrent workers claim
+    disjoint batches without waiting on each other; SQLite serializes
+    the claiming transactions instead.
+    """
+    now = timezone.now()
+    queryset = _due(now) if queryset is None else queryset & _due(now)
+    with transaction.atomic():
+        queryset = queryset.order_by('run_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if ids:
+            Task.objects.filter(pk__in=ids).update(
+                status=Task.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+    return list(Task.objects.filter(pk__in=ids).order_by('run_at', 'pk'))
+
+
+def execute(job):
+    """Run one claimed task; returns whether it succeeded"""
+    try:
+        func = import_string(job.name)
+        with transaction.atomic() if getattr(func, 'atomic', True) else nullcontext():
+            func(*job.args, **job.kwargs)
+    except Exception as e:
+        logger.exception('Task %s (%s) failed', job.pk, job.name)
+        job.error = f'{type(e).__name__}: {e}'
+        if job.attempts >= job.max_attempts:
+            job.status = Task.FAILED
+        else:
+            job.status = Task.PENDING
+            job.run_at = timezone.now() + timedelta(
+                seconds=settings.TASK_RETRY_DELAY * 2 ** (job.attempts - 1))
+        job.locked_at = None
+        job.save(update_fields=['status', 'run_at', 'locked_at', 'error'])
+        return False
+    job.delete()
+    return True
+
+
+def run_batch(queryset=None, batch_size=None):
+    """Claim and run one batch; returns `(succeeded, failed)`"""
+    results = [execute(job) for job in dequeue(
+        batch_size or settings.TASK_BATCH_SIZE, queryset)]
+    return results.count(True), results.count(False)
+
+
+def work(batch_size=None, once=False, sleep=1.0, stdout=None):
+    """
+    Run batches until the queue is empty (`once`) or forever, sleeping
+    `sleep` seconds whenever nothing is due. Returns the totals.
+    """
+    succeeded = failed = 0
+    while True:
+        done, errors = run_batch(batch_size=batch_size)
+        succeeded += done
+        failed += errors
+        if done or errors:
+            if stdout is not None:
+                stdout.write(f'Ran {done + errors} tasks ({errors} failed)')
+            continue
+        if once:
+            return succeeded, failed
+        time.sleep(sleep)
+
+
+def retry_failed():
+    """Queue failed tasks again with a fresh set of attempts"""
+    return Task.objects.filter(status=Task.FAILED).update(
+        status=Task.PENDING, attempts=0, run_at=timezone.now())
@@ -0,0 +1,31 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryCountMixin:
+    """
+    Helpers for asserting that an endpoint issues a constant number of
+    queries, no matter how many rows it returns. The cache is cleared before
+    every request so the uncached path is what gets measured.
+    """
+
+    def count_queries(self, url, **extra):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, url, grow, **extra):
+        """
+        Hit `url` once, call `grow()` to add more rows to the result and hit
+        it again; both requests must issue the same number of queries.
+        """
+        baseline = self.count_queries(url, **extra)
+        grow()
+        cache.clear()
+        with self.assertNumQueries(baseline):
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200, response.content)
+        return baseline
@@ -1,3 +1,500 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import runpy
+import threading
+import tempfile
+import uuid
+from decimal import Decimal
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from order.models import Cart, CartItem, Order, OrderItem
+from store.models import Category, Product, ProductImage, ProductSnapshot, Review
+from users.models import User
+from api import schema
+from api.idempotency import purge_expired
+from api.instrumentation import QueryRecorder, fingerprint, query_stats
+from api.metrics import Registry, registry
+from api.models import IdempotencyKey, Task
+from api.parsers import ORJSONParser
+from api.renderers import ORJSONRenderer
+from api.tasks import dequeue, run_batch, task, work
 
-# Create your tests here.
+
+class ORJSONRendererTests(SimpleTestCase):
+    data = {
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'price': Decimal('2490.50'),
+        'created_at': datetime.datetime(2025, 9, 27, 10, 12, tzinfo=datetime.timezone.utc),
+        'day': datetime.date(2025, 9, 27),
+        'detail': gettext_lazy('Not found.'),
+        'items': [{'name': 'Tee   line'}, (1, 2)],
+    }
+
+    def test_output_matches_stdlib_renderer(self):
+        import json
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(self.data)),
+            json.loads(JSONRenderer().render(self.data)))
+
+    def test_line_separators_are_escaped(self):
+        self.assertIn(b'\\u2028', ORJSONRenderer().render(self.data))
+
+    def test_indent(self):
+        rendered = ORJSONRenderer().render(
+            {'a': 1}, 'application/json; indent=4')
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+
+class ORJSONParserTests(SimpleTestCase):
+    def test_parses_like_stdlib_parser(self):
+        body = b'{"product_id": 3, "quantity": 2, "note": "\\u00e9"}'
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(body)),
+                         JSONParser().parse(io.BytesIO(body)))
+
+    def test_invalid_json(self):
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"quantity": '))
+
+
+@override_settings(IDEMPOTENCY_KEY_TTL=3600)
+class PurgeIdempotencyKeysTests(TestCase):
+    def test_deletes_only_expired_keys_in_batches(self):
+        user = User.objects.create_user(email='buyer@example.com', password=None)
+        for i in range(5):
+            IdempotencyKey.objects.create(user=user, key=f'key-{i}', fingerprint='f')
+        IdempotencyKey.objects.filter(key__in=['key-0', 'key-1', 'key-2']).update(
+            created_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(purge_expired(batch_size=2), 3)
+        self.assertEqual(
+            sorted(IdempotencyKey.objects.values_list('key', flat=True)),
+            ['key-3', 'key-4'])
+
+
+class OpenAPISchemaTests(TestCase):
+    def setUp(self):
+        schema.clear()
+        self.addCleanup(schema.clear)
+
+    def test_schema_is_generated_once_per_process(self):
+        first = self.client.get('/api/docs/?format=openapi')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()[schema.FINGERPRINT_KEY],
+                         schema.schema_fingerprint())
+        with mock.patch('api.schema.generate_schema') as generate:
+            second = self.client.get('/api/redoc/?format=openapi')
+        generate.assert_not_called()
+        self.assertEqual(second.json(), first.json())
+
+    def test_processes_share_the_generated_schema(self):
+        cache.clear()
+        first = schema.get_schema()
+        # A fresh process with the same code finds it in the shared cache
+        schema.clear()
+        with mock.patch('api.schema.generate_schema') as generate:
+            self.assertEqual(schema.get_schema(), first)
+        generate.assert_not_called()
+
+    def test_fingerprint_covers_subpackages(self):
+        with tempfile.TemporaryDirectory() as root:
+            package = Path(root, 'shop')
+            (package / 'api').mkdir(parents=True)
+            (package / 'migrations').mkdir()
+            for path in ('urls.py', 'api/views.py', 'migrations/0001_initial.py'):
+                (package / path).write_text('# v1\n')
+            config = mock.Mock(path=str(package))
+
+            def fingerprint():
+                schema.clear()
+                with override_settings(BASE_DIR=root, ROOT_URLCONF='shop.urls'), \
+                        mock.patch('api.schema.apps.get_app_configs',
+                                   return_value=[config]):
+                    return schema.schema_fingerprint()
+
+            before = fingerprint()
+            (package / 'migrations/0001_initial.py').write_text('# v2\n')
+            self.assertEqual(fingerprint(), before)
+            (package / 'api/views.py').write_text('# v2\n')
+            self.assertNotEqual(fingerprint(), before)
+
+    def test_view_annotations_reach_the_schema(self):
+        paths = schema.generate_schema()['paths']
+        self.assertEqual(paths['/products/']['get']['summary'],
+                         'Retrieve a list of products')
+        self.assertIn('limit', [parameter['name'] for parameter
+                                in paths['/products/suggest/']['get']['parameters']])
+
+    def test_docs_load_the_static_schema_only_while_it_is_current(self):
+        with tempfile.TemporaryDirectory() as root, \
+                override_settings(STATIC_ROOT=root):
+            path = Path(root, schema.STATIC_SCHEMA)
+            path.parent.mkdir(parents=True)
+            path.write_bytes(schema.encode_schema(schema.generate_schema()))
+            self.assertEqual(schema.static_schema_url(), '/static/api/openapi.json')
+            response = self.client.get('/api/docs/')
+            self.assertIn(b'/static/api/openapi.json', response.content)
+
+            schema.clear()
+            data = json.loads(path.read_bytes())
+            data[schema.FINGERPRINT_KEY] = 'stale'
+            path.write_text(json.dumps(data))
+            self.assertIsNone(schema.static_schema_url())
+
+
+calls = []
+
+
+@task
+def record(value, fail=0):
+    calls.append(value)
+    if calls.count(value) <= fail:
+        raise ConnectionError('relay unavailable')
+
+
+@task
+def create_category(name):
+    Category.objects.create(name=name)
+    raise ConnectionError('relay unavailable')
+
+
+@task(atomic=False)
+def create_category_without_transaction(name):
+    Category.objects.create(name=name)
+    raise ConnectionError('relay unavailable')
+
+
+@override_settings(TASK_RETRY_DELAY=60, TASK_MAX_ATTEMPTS=3, TASK_QUEUE_EAGER=False)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_tasks_run_once_and_are_removed(self):
+        record.enqueue('a')
+        record.enqueue(value='b')
+        self.assertEqual(calls, [])
+        self.assertEqual(work(once=True), (2, 0))
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertFalse(Task.objects.exists())
+
+    def test_failures_are_retried_with_backoff(self):
+        job = record.enqueue('a', fail=1)
+        with self.assertLogs('api.tasks', 'ERROR'):
+            self.assertEqual(run_batch(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Task.PENDING, 1))
+        self.assertIn('relay unavailable', job.error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=50))
+        # Not due yet
+        self.assertEqual(run_batch(), (0, 0))
+
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(run_batch(), (1, 0))
+        self.assertEqual(calls, ['a', 'a'])
+
+    def test_failed_tasks_roll_back_unless_not_atomic(self):
+        create_category.enqueue('Rolled back')
+        create_category_without_transaction.enqueue('Kept')
+        with self.assertLogs('api.tasks', 'ERROR'):
+            self.assertEqual(run_batch(), (0, 2))
+        self.assertEqual(list(Category.objects.values_list('name', flat=True)),
+                         ['Kept'])
+
+    def test_tasks_fail_after_max_attempts(self):
+        job = record.enqueue('a', fail=5)
+        with override_settings(TASK_RETRY_DELAY=0), \
+                self.assertLogs('api.tasks', 'ERROR') as logs:
+            work(once=True)
+        self.assertEqual(len(logs.records), 3)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Task.FAILED, 3))
+        self.assertEqual(len(calls), 3)
+
+    def test_batches_and_abandoned_tasks(self):
+        for value in range(5):
+            record.enqueue(value)
+        claimed = dequeue(3)
+        self.assertEqual([job.args for job in claimed], [[0], [1], [2]])
+        self.assertEqual([job.args for job in dequeue(10)], [[3], [4]])
+        self.assertEqual(dequeue(10), [])
+
+        # A worker died holding the first batch
+        Task.objects.filter(pk__in=[job.pk for job in claimed]).update(
+            locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual([job.args for job in dequeue(10)], [[0], [1], [2]])
+
+    def test_eager_tasks_run_when_the_transaction_commits(self):
+        with override_settings(TASK_QUEUE_EAGER=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                record.enqueue('a')
+                self.assertEqual(calls, [])
+        self.assertEqual(calls, ['a'])
+        self.assertFalse(Task.objects.exists())
+
+
+class QueryInstrumentationTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+        query_stats.reset()
+        self.admin = User.objects.create_user(email='admin@example.com', is_staff=True)
+
+    def test_server_timing_header(self):
+        self.assertFalse(self.client.get('/api/v1/products/').has_header('Server-Timing'))
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/v1/products/')
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ queries, 0 duplicate", app;dur=[\d.]+$')
+        self.assertFalse(self.client.get('/admin/login/').has_header('Server-Timing'))
+        with override_settings(DEBUG=True):
+            self.client.force_authenticate(None)
+            self.assertTrue(self.client.get('/api/v1/products/').has_header('Server-Timing'))
+
+    def test_duplicate_queries_are_fingerprinted(self):
+        self.assertEqual(fingerprint('SELECT 1 WHERE id IN (%s, %s)'),
+                         fingerprint('SELECT 1 WHERE id IN (%s)'))
+        recorder = QueryRecorder(capture=10)
+        with connection.execute_wrapper(recorder):
+            for pk in (1, 2, 3):
+                User.objects.filter(pk=pk).exists()
+            User.objects.count()
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(list(recorder.duplicates.values()), [3])
+        self.assertGreater(recorder.duration, 0)
+
+    def test_stats_are_aggregated_per_view_for_admins(self):
+        self.client.get('/api/v1/products/')
+        self.client.get('/api/v1/products/')
+        self.assertEqual(self.client.get('/api/v1/query-stats/').status_code, 401)
+        self.client.force_authenticate(self.admin)
+        stats = self.client.get('/api/v1/query-stats/').json()
+        products = stats['views']['products-list']
+        self.assertEqual(products['requests'], 2)
+        self.assertEqual(products['queries'], products['avg_queries'] * 2)
+        self.assertEqual(stats['slow_requests'], [])
+
+    @override_settings(QUERY_SLOW_COUNT=1, QUERY_EXPLAIN_LIMIT=1)
+    def test_slow_requests_capture_sql_and_explain(self):
+        self.client.get('/api/v1/categories/')
+        slow = query_stats.snapshot()['slow_requests']
+        self.assertEqual(len(slow), 1)
+        self.assertEqual(slow[0]['view'], 'category-list')
+        self.assertIn('SELECT', slow[0]['queries'][0]['sql'])
+        self.assertTrue(slow[0]['queries'][0]['explain'])
+
+    @override_settings(QUERY_SLOW_COUNT=1)
+    def test_slow_requests_keep_no_parameter_values(self):
+        self.client.get('/api/v1/products/?search=secret-term')
+        queries = query_stats.snapshot()['slow_requests'][0]['queries']
+        self.assertNotIn('secret', json.dumps(queries))
+        params = [param for query in queries for param in query['params'] or ()]
+        self.assertTrue(params)
+        self.assertTrue(all(param.startswith(('str[', 'int')) for param in params),
+                        params)
+
+
+def observe_in_child(directory):
+    child = Registry(directory)
+    latency = child.histogram('latency_seconds', 'Latency.', ('view',), buckets=(0.1, 1))
+    latency.observe(0.05, 'products-list')
+    latency.observe(5, 'products-list')
+
+
+@override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1'])
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+
+    def metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode().splitlines()
+
+    def test_requests_are_counted_and_timed_per_action(self):
+        self.client.get('/api/v1/products/')
+        self.client.get('/api/v1/products/')
+        self.client.get('/api/v1/products/999/')
+        lines = self.metrics()
+        self.assertIn('http_requests_total{view="products-list",action="list",'
+                      'method="GET",status="200"} 2.0', lines)
+        self.assertIn('http_requests_total{view="products-detail",action="retrieve",'
+                      'method="GET",status="404"} 1.0', lines)
+        for name in ('duration', 'db', 'serializer'):
+            self.assertIn(f'http_request_{name}_seconds_count'
+                          f'{{view="products-list",action="list"}} 2.0', lines)
+        self.assertIn('http_request_duration_seconds_bucket'
+                      '{view="products-list",action="list",le="+Inf"} 2.0', lines)
+        # /metrics itself is not recorded
+        self.assertFalse([line for line in self.metrics() if 'view="metrics"' in line])
+
+    def test_serializer_time_is_recorded(self):
+        Category.objects.create(name='Menswear')
+        self.client.get('/api/v1/categories/')
+        line = next(line for line in self.metrics() if line.startswith(
+            'http_request_serializer_seconds_sum{view="category-list"'))
+        self.assertGreater(float(line.split()[-1]), 0)
+
+    @override_settings(METRICS_TOKEN='scrape-me', METRICS_ALLOWED_IPS=[])
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, 404)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_hidden_unless_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8'])
+    def test_allowed_networks(self):
+        self.assertEqual(self.client.get(
+            '/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get(
+            '/metrics', REMOTE_ADDR='203.0.113.9').status_code, 404)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics = Registry()
+        latency = metrics.histogram('latency_seconds', 'Latency.', ('view',), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            latency.observe(value, 'products-list')
+        self.assertEqual(metrics.expose().splitlines(), [
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{view="products-list",le="0.1"} 2.0',
+            'latency_seconds_bucket{view="products-list",le="1.0"} 3.0',
+            'latency_seconds_bucket{view="products-list",le="+Inf"} 4.0',
+            'latency_seconds_sum{view="products-list"} 3.65',
+            'latency_seconds_count{view="products-list"} 4.0',
+        ])
+
+    def test_threads_do_not_lose_counts(self):
+        metrics = Registry()
+        hits = metrics.counter('hits_total', 'Hits.', ('view',))
+
+        def work():
+            for _ in range(1000):
+                hits.inc('products-list')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.collect()['hits_total'], {('products-list',): [8000.0]})
+
+    def test_multiprocess_values_are_added_up(self):
+        with tempfile.TemporaryDirectory() as directory:
+            parent = Registry(directory)
+            latency = parent.histogram('latency_seconds', 'Latency.', ('view',), buckets=(0.1, 1))
+            latency.observe(0.5, 'products-list')
+            child = multiprocessing.get_context('fork').Process(
+                target=observe_in_child, args=(directory,))
+            child.start()
+            child.join()
+            self.assertEqual(child.exitcode, 0)
+            self.assertEqual(len(list(Path(directory).iterdir())), 2)
+            self.assertEqual(parent.collect()['latency_seconds'],
+                             {('products-list',): [1.0, 1.0, 1.0, 5.55]})
+            parent.store.close()
+
+    def test_store_entries_are_per_process_not_per_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            metrics = Registry(directory)
+            hits = metrics.counter('hits_total', 'Hits.', ('view',))
+            threads = [threading.Thread(target=lambda: [
+                hits.inc('products-list') for _ in range(100)]) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(metrics.store.positions), 1)
+            self.assertEqual(metrics.collect()['hits_total'],
+                             {('products-list',): [800.0]})
+            metrics.store.close()
+
+    def test_unknown_methods_share_a_label(self):
+        self.client.generic('BREW', '/api/v1/products/')
+        self.client.generic('PURGE', '/api/v1/products/')
+        lines = [line for line in self.metrics() if line.startswith('http_requests_total{')]
+        self.assertEqual([line.split('method=')[1].split(',')[0] for line in lines],
+                         ['"other"'])
+        self.assertIn('} 2.0', lines[0])
+
+    def test_gunicorn_clears_the_multiprocess_directory_on_start(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'metrics_123.db').write_bytes(b'stale')
+            conf = runpy.run_path(str(Path(settings.BASE_DIR, 'gunicorn.conf.py')))
+            with mock.patch.dict(os.environ, {'METRICS_MULTIPROCESS_DIR': directory}):
+                conf['on_starting'](None)
+            self.assertEqual(list(Path(directory).iterdir()), [])
+
+
+class GenerateDataTests(TestCase):
+    def test_generates_the_requested_volumes(self):
+        call_command('generate_data', categories=3, products=40, images=2, users=10,
+                     reviews=100, carts=1, cart_items=2, orders=2, order_items=3,
+                     chunk_size=16, seed=1, stdout=io.StringIO())
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(ProductImage.objects.count(), 80)
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Review.objects.count(), 100)
+        self.assertEqual(CartItem.objects.count(), 2 * Cart.objects.count())
+        self.assertEqual(Order.objects.count(), 20)
+        self.assertEqual(OrderItem.objects.count(), 60)
+        order = Order.objects.first()
+        self.assertEqual(order.total_price, sum(
+            item.total_price for item in order.items.all()))
+        # Derived data is rebuilt after the bulk inserts
+        self.assertEqual(sum(Product.objects.values_list('review_count', flat=True)), 100)
+        self.assertEqual(ProductSnapshot.objects.count(), 40)
+
+
+class BenchmarkApiTests(TestCase):
+    def setUp(self):
+        call_command('generate_data', categories=2, products=30, users=3, reviews=20,
+                     seed=1, stdout=io.StringIO())
+
+    def test_reports_latency_and_queries_per_scenario(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory, 'baseline.json')
+            stdout = io.StringIO()
+            call_command('benchmark_api', iterations=3, warmup=1, seed=1,
+                         output=str(output), stdout=stdout)
+            results = json.loads(output.read_text())
+            self.assertEqual(list(results), [
+                'product-list', 'product-search', 'product-filter',
+                'product-detail', 'cart-add', 'checkout', 'order-history'])
+            for result in results.values():
+                self.assertEqual(result['errors'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertIn('checkout', stdout.getvalue())
+            # Benchmark user, carts and orders are removed; stock is restored
+            self.assertEqual(User.objects.count(), 3)
+            self.assertFalse(Product.objects.exclude(stock=1000).exists())
+
+            results['product-detail']['queries_max'] = 0
+            output.write_text(json.dumps(results))
+            with self.assertRaisesRegex(CommandError, 'product-detail: queries'):
+                call_command('benchmark_api', iterations=3, warmup=0,
+                             scenario=['product-detail'], baseline=str(output),
+                             stdout=io.StringIO())
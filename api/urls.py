@@ -3,6 +3,8 @@ from store.views import ProductViewSet, CategoryViewSet, ReviewViewSet, ProductI
 from order.views import CartViewSet, CartItemViewSet, OrderViewSet
 from rest_framework_nested import routers
 from rest_framework.routers import DefaultRouter
+from api.views import cache_stats, query_stats_view
+from drivnbd.lazy import lazy_include
 
 router = DefaultRouter()
 router.register('products', ProductViewSet, basename='products')
@@ -24,6 +26,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('', include(product_router.urls)),
     path('', include(cart_router.urls)),
-    path('auth/', include('djoser.urls')),
-    path('auth/', include('djoser.urls.jwt')),
+    path('auth/', lazy_include('djoser.urls')),
+    path('auth/', lazy_include('djoser.urls.jwt')),
+    path('cache-stats/', cache_stats, name='cache-stats'),
+    path('query-stats/', query_stats_view, name='query-stats'),
 ]
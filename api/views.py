@@ -1,3 +1,20 @@
-from django.shortcuts import render
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from api.cache import response_cache_stats
+from api.instrumentation import query_stats
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    """Response cache hits and misses per view action, for this process"""
+    return Response(response_cache_stats.snapshot())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def query_stats_view(request):
+    """Query counts and DB time per view, and recent slow requests, for this process"""
+    return Response(query_stats.snapshot())
 
-# Create your views here.
@@ -0,0 +1,7 @@
+from django.contrib import admin
+
+# With LAZY_STARTUP the admin app is installed as SimpleAdminConfig, so the
+# admin modules are only discovered once the admin is first requested
+admin.autodiscover()
+
+urlpatterns = admin.site.get_urls()
@@ -0,0 +1,38 @@
+from drf_yasg.renderers import _SpecRenderer
+from drf_yasg.views import SPEC_RENDERERS, get_schema_view
+from rest_framework import permissions
+from rest_framework.response import Response
+from django.urls import path
+from api.schema import (
+    API_INFO, StaticSchemaReDocRenderer, StaticSchemaSwaggerUIRenderer, get_schema)
+
+
+class SchemaView(get_schema_view(
+    API_INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+)):
+    """
+    Serves the schema generated once per process (see api.schema) instead of
+    introspecting every view on each hit. The UIs load the build-time copy
+    from static files when it is up to date.
+    """
+
+    def get(self, request, version='', format=None):
+        if not isinstance(request.accepted_renderer, _SpecRenderer):
+            return super().get(request, version, format)
+        return Response(get_schema(request.version or version or ''))
+
+
+def docs_view(ui_renderer, other_renderer):
+    return SchemaView.as_cached_view(
+        cache_timeout=0,
+        renderer_classes=(ui_renderer, other_renderer, *SPEC_RENDERERS))
+
+
+urlpatterns = [
+    path('docs/', docs_view(StaticSchemaSwaggerUIRenderer, StaticSchemaReDocRenderer),
+         name='schema-swagger-ui'),
+    path('redoc/', docs_view(StaticSchemaReDocRenderer, StaticSchemaSwaggerUIRenderer),
+         name='schema-redoc'),
+]
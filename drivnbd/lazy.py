@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.urls import include
+
+
+def lazy_include(urlconf, app_name=None, namespace=None):
+    """
+    include() that, with LAZY_STARTUP on, leaves `urlconf` unimported until
+    a request is routed into it (or a URL inside it is reversed), so a cold
+    start only pays for the modules behind the URLs it actually serves.
+    """
+    if settings.LAZY_STARTUP:
+        return (urlconf, app_name, namespace)
+    return include((urlconf, app_name) if app_name else urlconf, namespace=namespace)
@@ -1,8 +1,8 @@
 from urllib.parse import urlparse
 from pathlib import Path
-import cloudinary
 import dj_database_url
-from decouple import config
+from corsheaders.defaults import default_headers
+from decouple import Csv, config
 from datetime import timedelta
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -10,6 +10,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Core
 SECRET_KEY = config("SECRET_KEY")
 DEBUG = config("DEBUG", default=False, cast=bool)
+# Defer admin discovery and the docs/auth URL modules until first use, to
+# keep serverless cold starts short (see `manage.py profile_startup`)
+LAZY_STARTUP = config("LAZY_STARTUP", default=True, cast=bool)
 ALLOWED_HOSTS = [
     "drivnbd-serverside.vercel.app",
     ".vercel.app",
@@ -26,12 +29,13 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
     "https://drivnbd-client.vercel.app"
 ]
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 # Apps
 INSTALLED_APPS = [
     "whitenoise.runserver_nostatic",
     # Django
-    "django.contrib.admin",
+    "django.contrib.admin.apps.SimpleAdminConfig" if LAZY_STARTUP else "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
@@ -61,6 +65,8 @@ MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "api.metrics.MetricsMiddleware",
+    "api.instrumentation.QueryInstrumentationMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -92,13 +98,69 @@ TEMPLATES = [
 WSGI_APPLICATION = "drivnbd.wsgi.app"
 
 # Database
+DATABASE_URL = config("DATABASE_URL")
 DATABASES = {
-    "default": dj_database_url.config(
-        default=config("DATABASE_URL"),  # pyright: ignore[reportArgumentType]
+    "default": dj_database_url.parse(
+        DATABASE_URL,  # pyright: ignore[reportArgumentType]
         conn_max_age=600,
-        ssl_require=True,
+        # SQLite (local development and tests) has no notion of sslmode
+        ssl_require=urlparse(DATABASE_URL).scheme != "sqlite",  # pyright: ignore[reportArgumentType]
     )
 }
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # SQLite has no row locks; take the write lock when a transaction starts
+    # so concurrent checkouts queue on it instead of failing with "locked"
+    DATABASES["default"].setdefault("OPTIONS", {})["transaction_mode"] = "IMMEDIATE"
+
+# Cache
+# Local memory per process by default; point CACHE_BACKEND/CACHE_LOCATION at a
+# shared backend (e.g. django.core.cache.backends.redis.RedisCache) in production
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="drivnbd"),
+    }
+}
+RESPONSE_CACHE_TIMEOUT = config("RESPONSE_CACHE_TIMEOUT", default=300, cast=int)
+# Shared caches (CDN) may keep catalog responses this long; purge by Surrogate-Key
+EDGE_CACHE_MAX_AGE = config("EDGE_CACHE_MAX_AGE", default=60, cast=int)
+# Seconds an Idempotency-Key response is replayed for; run purge_idempotency_keys
+IDEMPOTENCY_KEY_TTL = config("IDEMPOTENCY_KEY_TTL", default=24 * 60 * 60, cast=int)
+# Seconds after which an unfinished Idempotency-Key request may be retried
+IDEMPOTENCY_LEASE = config("IDEMPOTENCY_LEASE", default=60, cast=int)
+
+# Query counts, DB time and slow-request capture (api.instrumentation)
+QUERY_INSTRUMENTATION = config("QUERY_INSTRUMENTATION", default=True, cast=bool)
+QUERY_INSTRUMENTATION_PATHS = ("/api/v1/",)
+# A request is slow from this much DB time (ms) or this many queries
+QUERY_SLOW_DB_MS = config("QUERY_SLOW_DB_MS", default=200, cast=float)
+QUERY_SLOW_COUNT = config("QUERY_SLOW_COUNT", default=50, cast=int)
+# Queries kept per request, logged per slow request, and EXPLAINed per slow request
+QUERY_CAPTURE_LIMIT = 200
+QUERY_SLOW_CAPTURE = 10
+QUERY_EXPLAIN_LIMIT = 3
+
+# Request metrics served at /metrics (api.metrics). Under gunicorn, point
+# METRICS_MULTIPROCESS_DIR at a directory so every worker's values are
+# served; gunicorn.conf.py empties it when the server starts
+METRICS = config("METRICS", default=True, cast=bool)
+METRICS_PATHS = ("/api/v1/",)
+METRICS_MULTIPROCESS_DIR = config("METRICS_MULTIPROCESS_DIR", default="")
+# /metrics is a 404 unless scrapers send METRICS_TOKEN as a bearer token or
+# connect from one of METRICS_ALLOWED_IPS (addresses or networks, matched
+# against REMOTE_ADDR, so never list a proxy's address)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+METRICS_ALLOWED_IPS = config("METRICS_ALLOWED_IPS", default="", cast=Csv())
+
+# Background tasks (api.tasks), run by `manage.py run_tasks`. With
+# TASK_QUEUE_EAGER they run in-process after the request's transaction commits
+TASK_QUEUE_EAGER = config("TASK_QUEUE_EAGER", default=False, cast=bool)
+TASK_BATCH_SIZE = config("TASK_BATCH_SIZE", default=20, cast=int)
+TASK_MAX_ATTEMPTS = config("TASK_MAX_ATTEMPTS", default=5, cast=int)
+# Seconds before the first retry, doubling with each further attempt
+TASK_RETRY_DELAY = config("TASK_RETRY_DELAY", default=30, cast=float)
+# Seconds after which a running task is assumed abandoned and run again
+TASK_LEASE = config("TASK_LEASE", default=300, cast=int)
 
 # Passwords
 AUTH_PASSWORD_VALIDATORS = [
@@ -121,20 +183,46 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 MEDIA_URL = "/media/"
 DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.MediaCloudinaryStorage"
 
+# Product image uploads (store.uploads); set the backend to
+# store.uploads.LocalImageBackend to keep images on the local filesystem
+IMAGE_UPLOAD_BACKEND = config(
+    "IMAGE_UPLOAD_BACKEND", default="store.uploads.CloudinaryImageBackend")
+# Where uploads wait for the upload task; every worker must be able to read
+# it, so the default keeps them in the database
+IMAGE_UPLOAD_STAGING_STORAGE = config(
+    "IMAGE_UPLOAD_STAGING_STORAGE", default="store.uploads.DatabaseStagingStorage")
+# Retries of storage and network errors, spaced by TASK_RETRY_DELAY
+IMAGE_UPLOAD_RETRIES = config("IMAGE_UPLOAD_RETRIES", default=3, cast=int)
+# Renditions stored with each product image, by longest edge in pixels
+IMAGE_VARIANTS = {"thumbnail": 200, "medium": 600, "large": 1200}
+
 # Auth / DRF
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ),
 }
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
+    # Embeds the claims ClaimsJWTAuthentication builds request.user from
+    "TOKEN_OBTAIN_SERIALIZER": "users.authentication.TokenObtainPairSerializer",
 }
+# Seconds a process trusts its cached is_active flag for a token's user
+JWT_USER_STATUS_TTL = config("JWT_USER_STATUS_TTL", default=60, cast=int)
 
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -159,6 +247,15 @@ DJOSER = {
         "user_create": "users.serializers.UserCreateSerializer",
         "current_user": "users.serializers.UserSerializer",
     },
+    # Delivered by `manage.py run_tasks` instead of during the request
+    "EMAIL": {
+        "activation": "users.email.ActivationEmail",
+        "confirmation": "users.email.ConfirmationEmail",
+        "password_reset": "users.email.PasswordResetEmail",
+        "password_changed_confirmation": "users.email.PasswordChangedConfirmationEmail",
+        "username_changed_confirmation": "users.email.UsernameChangedConfirmationEmail",
+        "username_reset": "users.email.UsernameResetEmail",
+    },
 }
 
 
@@ -171,12 +268,13 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 
 
-# Cloudinary
-cloudinary.config(
-    cloud_name=config("CLOUD_NAME"),
-    api_key=config("API_KEY"),
-    api_secret=config("API_SECRET"),
-    secure=True,
-)
+# Cloudinary; applied by StoreConfig.ready() and by cloudinary_storage itself,
+# so settings do not import the SDK
+CLOUDINARY_STORAGE = {
+    "CLOUD_NAME": config("CLOUD_NAME"),
+    "API_KEY": config("API_KEY"),
+    "API_SECRET": config("API_SECRET"),
+    "SECURE": True,
+}
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
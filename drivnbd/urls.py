@@ -1,37 +1,20 @@
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
 from django.conf.urls.static import static
-from django.contrib import admin
-from django.urls import path, include
+from django.urls import path
 from django.conf import settings
-from .views import api_root_view
+from .lazy import lazy_include
+from .views import api_root_view, metrics_view
 
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="DrivnBD E-Commerce API",
-        default_version='v1',
-        description="API Documentation for DrivnBD E-Commerce Project",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@drivnbd.com"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
-
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    path('admin/', lazy_include('drivnbd.admin_urls', 'admin', 'admin')),
     path('', api_root_view),
-    path('api/v1/', include('api.urls'), name='api-root'),
-    path('api/docs/', schema_view.with_ui('swagger',
-         cache_timeout=0), name='schema-swagger-ui'),
-    path('api/redoc/', schema_view.with_ui('redoc',
-         cache_timeout=0), name='schema-redoc'),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/v1/', lazy_include('api.urls'), name='api-root'),
+    # api/docs/ and api/redoc/; built on first use, drf_yasg is slow to import
+    path('api/', lazy_include('drivnbd.docs_urls')),
 ]
 
 if settings.DEBUG:
-    urlpatterns += [path('__debug__/', include('debug_toolbar.urls'))]
+    urlpatterns += [path('__debug__/', lazy_include('debug_toolbar.urls'))]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
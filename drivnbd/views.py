@@ -1,5 +1,36 @@
+import hmac
+import ipaddress
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import redirect
+from api.metrics import CONTENT_TYPE, registry
 
 
 def api_root_view(request):
-    return redirect('api-root')
\ No newline at end of file
+    return redirect('api-root')
+
+
+def metrics_allowed(request):
+    token = settings.METRICS_TOKEN
+    if token and hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(),
+            f'Bearer {token}'.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    """
+    Request metrics in the Prometheus text format, for scrapers sending
+    `Authorization: Bearer <METRICS_TOKEN>` or connecting from an address
+    in METRICS_ALLOWED_IPS. Everyone else gets a 404, including when
+    neither is configured.
+    """
+    if not metrics_allowed(request):
+        raise Http404
+    return HttpResponse(registry.expose(), content_type=CONTENT_TYPE)
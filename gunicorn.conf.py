@@ -0,0 +1,14 @@
+import glob
+import os
+from decouple import config
+
+# Loaded by `gunicorn drivnbd.wsgi` from the project root
+
+
+def on_starting(server):
+    # Metric files of the previous run (api.metrics) would otherwise be
+    # added to the new workers' values; runs once, in the master
+    directory = config("METRICS_MULTIPROCESS_DIR", default="")
+    if directory:
+        for path in glob.glob(os.path.join(directory, "metrics_*.db")):
+            os.remove(path)
@@ -0,0 +1,113 @@
+import threading
+import time
+from uuid import uuid4
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from order.models import Cart, CartItem, Order
+from order.services import InsufficientStock, OrderService
+from store.models import Category, Product
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Place concurrent checkouts against a few hot products and report '
+            'throughput and oversell')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--checkouts', type=int, default=25,
+                            help='Checkouts attempted per thread')
+        parser.add_argument('--products', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=100)
+        parser.add_argument('--quantity', type=int, default=1)
+        parser.add_argument('--retries', type=int, default=5,
+                            help='Retries of a checkout that hit a lock timeout')
+
+    def setup(self, options):
+        run = uuid4().hex[:8]
+        self.category = Category.objects.create(name=f'benchmark-{run}')
+        self.products = [
+            Product.objects.create(
+                name=f'Benchmark {run} {i}', description='Checkout benchmark',
+                price=10, stock=options['stock'], image='sample',
+                category=self.category)
+            for i in range(options['products'])
+        ]
+        self.users = [
+            User.objects.create_user(email=f'bench-{run}-{i}@example.com',
+                                     password=None)
+            for i in range(options['threads'])
+        ]
+
+    def teardown(self):
+        User.objects.filter(pk__in=[u.pk for u in self.users]).delete()
+        self.category.delete()
+
+    def worker(self, user, options, stats, lock):
+        try:
+            for _ in range(options['checkouts']):
+                cart = Cart.objects.create(user=user)
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product=product,
+                             quantity=options['quantity'])
+                    for product in self.products
+                ])
+                outcome = 'failed'
+                for _ in range(options['retries'] + 1):
+                    try:
+                        OrderService.create_order(user_id=user.pk, cart_id=cart.pk)
+                        outcome = 'placed'
+                        break
+                    except InsufficientStock:
+                        outcome = 'rejected'
+                        break
+                    except OperationalError:
+                        # SQLite has no row locks and times out under contention
+                        with lock:
+                            stats['lock_errors'] += 1
+                        time.sleep(0.01)
+                Cart.objects.filter(pk=cart.pk).delete()
+                with lock:
+                    stats[outcome] += 1
+        finally:
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        self.setup(options)
+        stats = {'placed': 0, 'rejected': 0, 'failed': 0, 'lock_errors': 0}
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=self.worker, args=(user, options, stats, lock))
+            for user in self.users
+        ]
+        try:
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            ordered = options['quantity'] * Order.objects.filter(
+                user__in=self.users).exclude(status=Order.CANCELED).count()
+            remaining = dict(Product.objects.filter(
+                pk__in=[p.pk for p in self.products]).values_list('pk', 'stock'))
+            oversold = max(0, ordered - options['stock'])
+            mismatched = [pk for pk, stock in remaining.items()
+                          if options['stock'] - stock != ordered]
+
+            self.stdout.write(
+                f"{connection.vendor}: {options['threads']} threads, "
+                f"{sum(stats[k] for k in ('placed', 'rejected', 'failed'))} "
+                f"checkouts in {elapsed:.2f} s "
+                f"({stats['placed'] / elapsed:.1f} orders/s)")
+            self.stdout.write(
+                f"placed {stats['placed']}  rejected {stats['rejected']}  "
+                f"failed {stats['failed']}  lock errors {stats['lock_errors']}")
+            self.stdout.write(
+                f"stock left {sorted(remaining.values())}  oversold {oversold}")
+            if oversold or mismatched:
+                self.stderr.write(
+                    f'Stock does not match placed orders for products {mismatched}')
+        finally:
+            self.teardown()
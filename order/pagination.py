@@ -0,0 +1,14 @@
+from store.pagination import DefaultPagination, KeysetPagination
+
+
+class OrderCursorPagination(KeysetPagination):
+    ordering = '-created_at'
+
+
+class OrderPagination(DefaultPagination):
+    """
+    Order history stays unpaginated by default; `?pagination=cursor` opts
+    into keyset pages ordered by created_at, newest first.
+    """
+    page_size = None
+    cursor_pagination_class = OrderCursorPagination
@@ -1,7 +1,8 @@
 from rest_framework import serializers
 from order.models import Cart, CartItem, Order, OrderItem
 from store.models import Product
-from order.services import OrderService
+from order.services import CartService, InsufficientStock, OrderService
+from api.serializers import SparseFieldsMixin
 
 
 class EmptySerializer(serializers.Serializer):
@@ -26,22 +27,29 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         product_id = self.validated_data['product_id'] # type: ignore
         quantity = self.validated_data['quantity'] # type: ignore
 
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            self.instance = cart_item.save()
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data) # type: ignore
+        # The product is checked by the upsert itself, in the same statement
+        self.instance = CartService.add_item(cart_id, product_id, quantity)
+        if self.instance is None:
+            raise serializers.ValidationError(
+                {'product_id': [f"Product with id {product_id} does not exists"]})
 
         return self.instance
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
+
+class CartItemOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] != 'remove' and 'quantity' not in attrs:
             raise serializers.ValidationError(
-                f"Product with id {value} does not exists")
-        return value
+                {'quantity': f"This field is required for '{attrs['op']}'."})
+        return attrs
+
+
+class BulkCartItemSerializer(serializers.Serializer):
+    operations = CartItemOperationSerializer(many=True, allow_empty=False)
 
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
@@ -50,7 +58,7 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         fields = ['quantity']
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer()
     total_price = serializers.SerializerMethodField(
         method_name='get_total_price')
@@ -60,23 +68,39 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'product', 'total_price']
 
     def get_total_price(self, cart_item: CartItem):
+        subtotal = getattr(cart_item, 'subtotal', None)
+        if subtotal is not None:
+            return subtotal
         return cart_item.quantity * cart_item.product.price
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField(
         method_name='get_total_price')
+    item_count = serializers.SerializerMethodField(
+        method_name='get_item_count')
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total_price']
+        fields = ['id', 'user', 'items', 'total_price', 'item_count']
         read_only_fields = ['user']
 
+    # `total` and `item_count` are annotated by CartService.with_totals;
+    # carts built in memory (e.g. by the bulk endpoint) fall back to Python
     def get_total_price(self, cart: Cart):
+        total = getattr(cart, 'total', None)
+        if total is not None:
+            return total
         return sum(
             [item.product.price * item.quantity for item in cart.items.all()]) # type: ignore
 
+    def get_item_count(self, cart: Cart):
+        count = getattr(cart, 'item_count', None)
+        if count is not None:
+            return count
+        return sum([item.quantity for item in cart.items.all()]) # type: ignore
+
 
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
@@ -97,6 +121,9 @@ class CreateOrderSerializer(serializers.Serializer):
         try:
             order = OrderService.create_order(user_id=user_id, cart_id=cart_id)
             return order
+        except InsufficientStock:
+            # Answered by OrderViewSet.create with the per-item conflicts
+            raise
         except ValueError as e:
             raise serializers.ValidationError(str(e))
 
@@ -118,7 +145,7 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
         fields = ['status']
 
  
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
 
     class Meta:
@@ -1,51 +1,300 @@
 from order.models import Cart, CartItem, OrderItem, Order
-from django.db import transaction
+from store.models import Product
+from api.cache import bump_model_version_on_commit
+from django.db import connection, transaction
+from django.db.models import (
+    Case, DecimalField, ExpressionWrapper, F, Prefetch, Q, Sum, Value, When,
+    prefetch_related_objects)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from rest_framework.exceptions import PermissionDenied, ValidationError
 
 
+class InsufficientStock(ValueError):
+    def __init__(self, conflicts):
+        super().__init__('Not enough stock for some items in the cart.')
+        self.conflicts = conflicts
+
+
+class StockService:
+    """
+    Reserves and restores product stock for checkouts.
+
+    Must run inside a transaction. Product rows are locked with a single
+    SELECT ... FOR UPDATE in primary key order, so concurrent checkouts
+    touching the same products always queue in the same order and never
+    deadlock. The decrement is a single UPDATE guarded by `stock >= qty`
+    per row, which also keeps backends without row locks from overselling.
+    """
+
+    @staticmethod
+    def _conflicts(quantities, stock):
+        return [
+            {'product_id': product_id, 'requested': quantity,
+             'available': stock.get(product_id, 0)}
+            for product_id, quantity in sorted(quantities.items())
+            if quantity > stock.get(product_id, 0)
+        ]
+
+    @staticmethod
+    def _adjust(quantities, sign):
+        return Case(*[
+            When(pk=product_id, then=F('stock') + sign * quantity)
+            for product_id, quantity in quantities.items()
+        ])
+
+    @staticmethod
+    def reserve(quantities):
+        """
+        Take `quantities` ({product_id: quantity}) out of stock and return
+        the locked products by id. Raises InsufficientStock listing every
+        item that cannot be fulfilled.
+        """
+        if not quantities:
+            # An empty guard would match, and null the stock of, every product
+            return {}
+        products = {
+            product.pk: product for product in
+            Product.objects.select_for_update().filter(
+                pk__in=quantities).order_by('pk')
+        }
+        conflicts = StockService._conflicts(
+            quantities, {pk: product.stock for pk, product in products.items()})
+        if conflicts:
+            raise InsufficientStock(conflicts)
+
+        guard = Q()
+        for product_id, quantity in quantities.items():
+            guard |= Q(pk=product_id, stock__gte=quantity)
+        updated = Product.objects.filter(guard).update(
+            stock=StockService._adjust(quantities, -1),
+            updated_at=timezone.now())
+        if updated != len(quantities):
+            # Stock moved between the read and the write (no row locks)
+            stock = dict(Product.objects.filter(
+                pk__in=quantities).values_list('pk', 'stock'))
+            raise InsufficientStock(StockService._conflicts(quantities, stock))
+
+        bump_model_version_on_commit(Product)
+        return products
+
+    @staticmethod
+    def release(quantities):
+        """Put `quantities` ({product_id: quantity}) back into stock"""
+        if not quantities:
+            return
+        Product.objects.filter(pk__in=quantities).update(
+            stock=StockService._adjust(quantities, 1),
+            updated_at=timezone.now())
+        bump_model_version_on_commit(Product)
+
+
+def _subtotal(prefix=''):
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * F(f'{prefix}product__price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def _sum(expression):
+    return Coalesce(Sum(expression), Value(0), output_field=expression.output_field)
+
+
+class CartService:
+    @staticmethod
+    def with_subtotals(queryset):
+        """Annotate cart items with `subtotal` (quantity x product price)"""
+        return queryset.select_related('product').annotate(subtotal=_subtotal())
+
+    @staticmethod
+    def with_totals(queryset, items=True):
+        """
+        Annotate carts with `total` and `item_count` (units), and with
+        `items=True` prefetch their items with subtotals.
+        """
+        queryset = queryset.annotate(
+            total=_sum(_subtotal('items__')),
+            item_count=Coalesce(Sum('items__quantity'), Value(0)))
+        if items:
+            queryset = queryset.prefetch_related(Prefetch(
+                'items', queryset=CartService.with_subtotals(CartItem.objects)))
+        return queryset
+
+    @staticmethod
+    def add_item(cart_id, product_id, quantity):
+        """
+        Add `quantity` of a product to a cart, or to the quantity already in
+        it, and return the resulting CartItem. Returns None when the product
+        does not exist.
+        """
+        if connection.vendor in ('postgresql', 'sqlite'):
+            return CartService._upsert(cart_id, product_id, quantity)
+
+        with transaction.atomic():
+            if not Product.objects.filter(pk=product_id).exists():
+                return None
+            item, created = CartItem.objects.select_for_update().get_or_create(
+                cart_id=cart_id, product_id=product_id,
+                defaults={'quantity': quantity})
+            if not created:
+                CartItem.objects.filter(pk=item.pk).update(
+                    quantity=F('quantity') + quantity)
+                item.refresh_from_db(fields=['quantity'])
+            return item
+
+    @staticmethod
+    def _upsert(cart_id, product_id, quantity):
+        # INSERT ... SELECT only inserts when the product exists, and the
+        # ON CONFLICT branch adds to an existing row, all in one statement
+        qn = connection.ops.quote_name
+        item_table = qn(CartItem._meta.db_table)
+        sql = (
+            f'INSERT INTO {item_table} (cart_id, product_id, quantity) '
+            f'SELECT %s, id, %s FROM {qn(Product._meta.db_table)} WHERE id = %s '
+            f'ON CONFLICT (cart_id, product_id) DO UPDATE '
+            f'SET quantity = {item_table}.quantity + excluded.quantity '
+            f'RETURNING id, quantity'
+        )
+        cart = CartItem._meta.get_field('cart').get_db_prep_value(
+            cart_id, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [cart, quantity, product_id])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return CartItem(id=row[0], cart_id=cart_id, product_id=product_id,
+                        quantity=row[1])
+
+    @staticmethod
+    def apply_operations(cart, operations):
+        """
+        Apply a list of `{'op', 'product_id', 'quantity'}` operations to a
+        cart in one transaction and return its items, with products loaded.
+        `add` increases the quantity, `set` replaces it and `remove` drops
+        the item. The cart's `items` are prefetched with subtotals, so it
+        can be serialized without further queries.
+        """
+        with transaction.atomic():
+            items = {
+                item.product_id: item for item in CartItem.objects
+                .select_for_update().filter(cart=cart).select_related('product')
+            }
+            wanted = {op['product_id'] for op in operations if op['op'] != 'remove'}
+            products = Product.objects.in_bulk(wanted - set(items))
+            missing = sorted(wanted - set(items) - set(products))
+            if missing:
+                raise ValidationError(
+                    {'product_id': [f'Product with id {pk} does not exists'
+                                    for pk in missing]})
+
+            quantities = {pk: item.quantity for pk, item in items.items()}
+            for op in operations:
+                product_id = op['product_id']
+                if op['op'] == 'remove':
+                    quantities.pop(product_id, None)
+                elif op['op'] == 'add':
+                    quantities[product_id] = (
+                        quantities.get(product_id, 0) + op['quantity'])
+                else:
+                    quantities[product_id] = op['quantity']
+
+            removed = [item.pk for pk, item in items.items() if pk not in quantities]
+            changed = [item for pk, item in items.items()
+                       if pk in quantities and item.quantity != quantities[pk]]
+            for item in changed:
+                item.quantity = quantities[item.product_id]
+            created = [
+                CartItem(cart=cart, product=products[pk], quantity=quantity)
+                for pk, quantity in quantities.items() if pk not in items
+            ]
+
+            if removed:
+                CartItem.objects.filter(pk__in=removed).delete()
+            if changed:
+                CartItem.objects.bulk_update(changed, ['quantity'])
+            if created:
+                CartItem.objects.bulk_create(created)
+
+        prefetch_related_objects([cart], Prefetch(
+            'items', queryset=CartService.with_subtotals(
+                CartItem.objects.order_by('pk'))))
+        return list(cart.items.all())
+
+
 class OrderService:
     @staticmethod
     def create_order(user_id, cart_id):
         with transaction.atomic():
-            cart = Cart.objects.get(pk=cart_id)
-            cart_items = CartItem.objects.filter(
-                cart=cart).select_related('product').all()
-            total_price = sum([item.product.price *
-                               item.quantity for item in cart_items])
+            # A concurrent checkout of the same cart waits here, then finds
+            # it gone instead of ordering its items a second time
+            cart = Cart.objects.select_for_update().filter(pk=cart_id).first()
+            if cart is None:
+                raise ValueError('No cart found with this id')
+            cart_items = CartItem.objects.filter(cart=cart)
+            quantities = dict(cart_items.values_list('product_id', 'quantity'))
+            if not quantities:
+                raise ValueError('Cart is empty')
+            StockService.reserve(quantities)
+            total_price = cart_items.aggregate(
+                total=_sum(_subtotal()))['total']
 
             order = Order.objects.create(
                 user_id=user_id, total_price=total_price)
-
-            order_items = [
-                OrderItem(
-                    order=order,
-                    product=item.product,
-                    price=item.product.price,
-                    quantity=item.quantity,
-                    total_price=item.product.price * item.quantity
-                )
-                for item in cart_items
-            ]
-            OrderItem.objects.bulk_create(order_items)
+            OrderService._copy_items(order, cart)
 
             cart.delete()
 
             return order
 
     @staticmethod
-    def cancel_order(order, user):
-        if user.is_staff:
-            order.status = Order.CANCELED
-            order.save()
-            return order
+    def _copy_items(order, cart):
+        # INSERT ... SELECT, so checkout cost does not grow with the cart
+        qn = connection.ops.quote_name
 
-        if order.user != user:
-            raise PermissionDenied(
-                {"detail": "You can only cancel your own order."})
+        def column(model, name, alias=''):
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            return f'{alias}{qn(field.column)}'
 
-        if order.status == Order.DELIVERED:
-            raise ValidationError({"detail": "You cannot cancel an order once it is delivered."})
+        price = column(Product, 'price', 'p.')
+        quantity = column(CartItem, 'quantity', 'i.')
+        targets = ', '.join(column(OrderItem, name) for name in (
+            'order', 'product', 'price', 'quantity', 'total_price'))
+        sql = (
+            f"INSERT INTO {qn(OrderItem._meta.db_table)} ({targets}) "
+            f"SELECT %s, {column(Product, 'pk', 'p.')}, {price}, {quantity}, "
+            f"{price} * {quantity} "
+            f"FROM {qn(CartItem._meta.db_table)} i "
+            f"JOIN {qn(Product._meta.db_table)} p "
+            f"ON {column(Product, 'pk', 'p.')} = {column(CartItem, 'product', 'i.')} "
+            f"WHERE {column(CartItem, 'cart', 'i.')} = %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [
+                OrderItem._meta.get_field('order').get_db_prep_value(
+                    order.pk, connection),
+                CartItem._meta.get_field('cart').get_db_prep_value(
+                    cart.pk, connection),
+            ])
+
+    @staticmethod
+    def cancel_order(order, user):
+        if not user.is_staff:
+            if order.user != user:
+                raise PermissionDenied(
+                    {"detail": "You can only cancel your own order."})
+
+        with transaction.atomic():
+            # Checked on the locked row, so a delivery recorded since the
+            # order was loaded is not undone
+            order = Order.objects.select_for_update().get(pk=order.pk)
+            if not user.is_staff and order.status == Order.DELIVERED:
+                raise ValidationError({"detail": "You cannot cancel an order once it is delivered."})
+            if order.status != Order.CANCELED:
+                quantities = {}
+                for product_id, quantity in order.items.values_list(
+                        'product_id', 'quantity'):
+                    quantities[product_id] = quantities.get(product_id, 0) + quantity
+                StockService.release(quantities)
 
-        order.status = Order.CANCELED
-        order.save()
+                order.status = Order.CANCELED
+                order.save()
         return order
@@ -1,3 +1,463 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from uuid import uuid4
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APIRequestFactory
+from api.idempotency import request_fingerprint
+from api.models import IdempotencyKey
+from api.testing import QueryCountMixin
+from order.models import Cart, CartItem, Order
+from order.services import CartService, OrderService, StockService
+from store.models import Category, Product
+from store.tests import make_products
+from users.models import User
 
-# Create your tests here.
+
+class OrderQueryCountTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='buyer@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Menswear')
+        self.cart = Cart.objects.create(user=self.user)
+        self.add_items(self.cart, 2)
+
+    def add_items(self, cart, count):
+        for product in make_products(self.category, count, images=0):
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+    def place_order(self, items):
+        cart = Cart.objects.create(user=self.user)
+        self.add_items(cart, items)
+        return OrderService.create_order(user_id=self.user.pk, cart_id=cart.pk)
+
+    def test_cart_detail_is_constant(self):
+        self.assertConstantQueries(
+            f'/api/v1/carts/{self.cart.pk}/',
+            lambda: self.add_items(self.cart, 5))
+
+    def test_cart_items_is_constant(self):
+        self.assertConstantQueries(
+            f'/api/v1/carts/{self.cart.pk}/items/',
+            lambda: self.add_items(self.cart, 5))
+
+    def test_order_list_is_constant(self):
+        self.cart.delete()
+        self.place_order(2)
+
+        def grow():
+            for _ in range(3):
+                self.place_order(3)
+        self.assertConstantQueries('/api/v1/orders/', grow)
+
+    def test_order_detail_is_constant(self):
+        self.cart.delete()
+        order = self.place_order(2)
+        self.assertConstantQueries(
+            f'/api/v1/orders/{order.pk}/',
+            lambda: order.items.create(
+                product=make_products(self.category, 1, images=0)[0],
+                quantity=1, price=1, total_price=1))
+
+    def test_order_history_cursor_pagination(self):
+        self.cart.delete()
+        orders = [self.place_order(1) for _ in range(12)]
+        response = self.client.get('/api/v1/orders/')
+        self.assertEqual(len(response.data), 12)
+
+        seen, url = [], '/api/v1/orders/?pagination=cursor'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(order['id'] for order in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [str(order.pk) for order in reversed(orders)])
+
+    def test_omitting_items_skips_their_prefetch(self):
+        self.cart.delete()
+        self.place_order(3)
+        full = self.count_queries('/api/v1/orders/')
+        sparse = self.count_queries('/api/v1/orders/?omit=items')
+        self.assertEqual(sparse, full - 2)
+        response = self.client.get('/api/v1/orders/?fields=id,total_price')
+        self.assertEqual(set(response.data[0]), {'id', 'total_price'})
+
+    def test_cart_totals_come_from_the_database(self):
+        self.add_items(self.cart, 1)
+        response = self.client.get(f'/api/v1/carts/{self.cart.pk}/')
+        items = CartItem.objects.filter(cart=self.cart).select_related('product')
+        self.assertEqual(response.data['item_count'], 6)
+        self.assertEqual(response.data['total_price'],
+                         sum(i.product.price * i.quantity for i in items))
+        self.assertEqual(
+            [item['total_price'] for item in response.data['items']],
+            [i.product.price * i.quantity for i in items.order_by('pk')])
+
+    def test_checkout_is_constant(self):
+        def checkout(items):
+            cart = Cart.objects.create(user=self.user)
+            self.add_items(cart, items)
+            with CaptureQueriesContext(connection) as ctx:
+                order = OrderService.create_order(
+                    user_id=self.user.pk, cart_id=cart.pk)
+            return order, len(ctx.captured_queries)
+
+        self.cart.delete()
+        _, small = checkout(1)
+        order, large = checkout(20)
+        self.assertEqual(small, large)
+        items = list(order.items.select_related('product'))
+        self.assertEqual(len(items), 20)
+        for item in items:
+            self.assertEqual(item.price, item.product.price)
+            self.assertEqual(item.total_price, item.product.price * 2)
+        self.assertEqual(order.total_price, sum(i.total_price for i in items))
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='buyer@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = make_products(
+            Category.objects.create(name='Menswear'), 2, images=0)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill_cart(self, *quantities):
+        for product, quantity in zip(self.products, quantities):
+            CartItem.objects.create(
+                cart=self.cart, product=product, quantity=quantity)
+
+    def stock(self):
+        return [p.stock for p in Product.objects.filter(
+            pk__in=[p.pk for p in self.products]).order_by('pk')]
+
+    def test_checkout_decrements_stock(self):
+        self.fill_cart(3, 10)
+        response = self.client.post(
+            '/api/v1/orders/', {'cart_id': self.cart.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), [7, 0])
+
+    def test_insufficient_stock_reports_every_conflict(self):
+        self.fill_cart(11, 12)
+        response = self.client.post(
+            '/api/v1/orders/', {'cart_id': self.cart.pk}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['conflicts'], [
+            {'product_id': self.products[0].pk, 'requested': 11, 'available': 10},
+            {'product_id': self.products[1].pk, 'requested': 12, 'available': 10},
+        ])
+        self.assertEqual(self.stock(), [10, 10])
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(pk=self.cart.pk).exists())
+
+    def test_empty_reservations_leave_stock_alone(self):
+        self.assertEqual(StockService.reserve({}), {})
+        with self.assertRaisesMessage(ValueError, 'Cart is empty'):
+            OrderService.create_order(user_id=self.user.pk, cart_id=self.cart.pk)
+        self.assertEqual(self.stock(), [10, 10])
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_restores_stock_once(self):
+        self.fill_cart(4, 1)
+        order = OrderService.create_order(
+            user_id=self.user.pk, cart_id=self.cart.pk)
+        self.assertEqual(self.stock(), [6, 9])
+        for _ in range(2):
+            response = self.client.post(f'/api/v1/orders/{order.pk}/cancel/')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [10, 10])
+
+    def test_cancel_checks_the_current_status(self):
+        self.fill_cart(4, 1)
+        order = OrderService.create_order(
+            user_id=self.user.pk, cart_id=self.cart.pk)
+        Order.objects.filter(pk=order.pk).update(status=Order.DELIVERED)
+        with self.assertRaises(ValidationError):
+            OrderService.cancel_order(order, self.user)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, Order.DELIVERED)
+        self.assertEqual(self.stock(), [6, 9])
+
+
+class AddCartItemTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='buyer@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = make_products(
+            Category.objects.create(name='Menswear'), 1, images=0)[0]
+        self.cart = Cart.objects.create(user=self.user)
+        self.url = f'/api/v1/carts/{self.cart.pk}/items/'
+
+    def add(self, product_id, quantity):
+        return self.client.post(
+            self.url, {'product_id': product_id, 'quantity': quantity},
+            format='json')
+
+    def test_adding_twice_increments_the_same_item(self):
+        first = self.add(self.product.pk, 2)
+        second = self.add(self.product.pk, 3)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.data, {
+            'id': first.data['id'], 'product_id': self.product.pk, 'quantity': 5})
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+    def test_unknown_product_is_rejected(self):
+        response = self.add(self.product.pk + 100, 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.data)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_add_is_one_statement(self):
+        self.add(self.product.pk, 1)
+        with CaptureQueriesContext(connection) as ctx:
+            CartService.add_item(self.cart.pk, self.product.pk, 1)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+
+class BulkCartItemTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='buyer@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Menswear')
+        self.products = make_products(self.category, 4, images=0)
+        self.cart = Cart.objects.create(user=self.user)
+        self.url = f'/api/v1/carts/{self.cart.pk}/items/bulk/'
+        for product in self.products[:2]:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def bulk(self, operations):
+        return self.client.post(
+            self.url, {'operations': operations}, format='json')
+
+    def test_anonymous_requests_are_rejected(self):
+        self.client.force_authenticate(None)
+        response = self.bulk([
+            {'op': 'add', 'product_id': self.products[2].pk, 'quantity': 1}])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_applies_every_operation(self):
+        p = [product.pk for product in self.products]
+        response = self.bulk([
+            {'op': 'add', 'product_id': p[0], 'quantity': 3},
+            {'op': 'remove', 'product_id': p[1]},
+            {'op': 'set', 'product_id': p[2], 'quantity': 4},
+            {'op': 'add', 'product_id': p[3], 'quantity': 1},
+            {'op': 'add', 'product_id': p[3], 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            {item['product']['id']: item['quantity']
+             for item in response.data['items']},
+            {p[0]: 5, p[2]: 4, p[3]: 2})
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product_id', 'quantity')),
+            {p[0]: 5, p[2]: 4, p[3]: 2})
+        expected = sum(
+            product.price * quantity for product, quantity in
+            zip([self.products[0], self.products[2], self.products[3]], [5, 4, 2]))
+        self.assertEqual(response.data['total_price'], expected)
+
+    def test_query_count_does_not_grow_with_operations(self):
+        def run(products):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.bulk([
+                    {'op': 'set', 'product_id': product.pk, 'quantity': 1}
+                    for product in products])
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries)
+
+        small = run(self.products[2:3] + self.products[:1])
+        large = run(make_products(self.category, 6, images=0) +
+                    self.products[:2])
+        self.assertEqual(small, large)
+
+    def test_unknown_product_rolls_back(self):
+        response = self.bulk([
+            {'op': 'remove', 'product_id': self.products[0].pk},
+            {'op': 'add', 'product_id': self.products[3].pk + 100, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_quantity_required_for_add_and_set(self):
+        response = self.bulk([{'op': 'set', 'product_id': self.products[0].pk}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_users_cart_is_not_found(self):
+        other = User.objects.create_user(
+            email='other@example.com', password='pass1234')
+        self.client.force_authenticate(other)
+        response = self.bulk([{'op': 'remove', 'product_id': self.products[0].pk}])
+        self.assertEqual(response.status_code, 404)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='buyer@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = make_products(
+            Category.objects.create(name='Menswear'), 2, images=0)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+
+    def post(self, url, data, key='retry-1'):
+        return self.client.post(
+            url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_checkout_replays_the_first_order(self):
+        first = self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        self.assertEqual(first.status_code, 201)
+
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+        tables = {Cart._meta.db_table, CartItem._meta.db_table, Order._meta.db_table}
+        self.assertFalse([q for q in ctx.captured_queries
+                          if any(table in q['sql'] for table in tables)])
+
+    def test_reusing_a_key_for_another_request_is_rejected(self):
+        self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        other = self.post('/api/v1/orders/', {'cart_id': str(uuid4())})
+        self.assertEqual(other.status_code, 422)
+
+    def test_keys_are_per_user(self):
+        self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        other = User.objects.create_user(
+            email='other@example.com', password='pass1234')
+        self.client.force_authenticate(other)
+        response = self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_retries_take_over_abandoned_attempts(self):
+        # The first attempt's record, left unfinished by a dead worker
+        request = APIRequestFactory().post(
+            '/api/v1/orders/', {'cart_id': str(self.cart.pk)}, format='json')
+        IdempotencyKey.objects.create(
+            user=self.user, key='retry-1', fingerprint=request_fingerprint(request))
+        busy = self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        self.assertEqual(busy.status_code, 409)
+
+        IdempotencyKey.objects.update(
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LEASE + 1))
+        retry = self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_expired_keys_are_not_replayed(self):
+        self.post('/api/v1/orders/', {'cart_id': str(self.cart.pk)})
+        IdempotencyKey.objects.update(
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL + 1))
+        retry = self.post('/api/v1/orders/', {'cart_id': str(uuid4())})
+        self.assertEqual(retry.status_code, 400)
+        self.assertNotIn('Idempotent-Replayed', retry)
+
+    def test_bulk_cart_mutations_apply_once(self):
+        url = f'/api/v1/carts/{self.cart.pk}/items/bulk/'
+        operations = {'operations': [
+            {'op': 'add', 'product_id': self.products[0].pk, 'quantity': 2}]}
+        first = self.post(url, operations)
+        retry = self.post(url, operations)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(CartItem.objects.get().quantity, 3)
+
+
+class ConcurrentAddCartItemTests(TransactionTestCase):
+    def test_concurrent_clicks_are_all_counted(self):
+        user = User.objects.create_user(email='buyer@example.com', password=None)
+        cart = Cart.objects.create(user=user)
+        product = make_products(
+            Category.objects.create(name='Menswear'), 1, images=0)[0]
+        clicks, errors = 8, []
+        barrier = threading.Barrier(clicks)
+
+        def click():
+            try:
+                barrier.wait()
+                for _ in range(50):
+                    try:
+                        CartService.add_item(cart.pk, product.pk, 1)
+                        break
+                    except OperationalError:
+                        # The shared in-memory SQLite test database reports
+                        # "table is locked" instead of waiting for the lock
+                        time.sleep(0.01)
+                else:
+                    errors.append('gave up waiting for the lock')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=click) for _ in range(clicks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, clicks)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_a_cart_is_ordered_once(self):
+        user = User.objects.create_user(email='buyer@example.com', password=None)
+        cart = Cart.objects.create(user=user)
+        products = make_products(
+            Category.objects.create(name='Menswear'), 2, images=0)
+        for product in products:
+            CartItem.objects.create(cart=cart, product=product, quantity=3)
+        checkouts, orders, rejected, errors = 4, [], [], []
+        barrier = threading.Barrier(checkouts)
+
+        def checkout():
+            try:
+                barrier.wait()
+                for _ in range(50):
+                    try:
+                        orders.append(OrderService.create_order(user.pk, cart.pk))
+                        break
+                    except ValueError as e:
+                        rejected.append(str(e))
+                        break
+                    except OperationalError:
+                        # The shared in-memory SQLite test database reports
+                        # "table is locked" instead of waiting for the lock
+                        time.sleep(0.01)
+                else:
+                    errors.append('gave up waiting for the lock')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout) for _ in range(checkouts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(len(rejected), checkouts - 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(sorted(Product.objects.values_list('stock', flat=True)),
+                         [7, 7])
@@ -1,13 +1,18 @@
-from django.shortcuts import render
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404, render
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from order import serializers as orderSz
-from order.serializers import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer
+from order.serializers import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, BulkCartItemSerializer
 from order.models import Cart, CartItem, Order
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
-from order.services import OrderService
+from order.services import CartService, InsufficientStock, OrderService
+from order.pagination import OrderPagination
+from api.idempotency import IdempotentMixin
+from api.serializers import wants_field
 from rest_framework.response import Response
+from rest_framework import status
 
 
 class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
@@ -20,10 +25,17 @@ class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gener
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Cart.objects.none()
-        return Cart.objects.prefetch_related('items__product').filter(user=self.request.user)
+        queryset = Cart.objects.filter(user=self.request.user)
+        if wants_field(self.request, 'total_price') or wants_field(self.request, 'item_count'):
+            return CartService.with_totals(
+                queryset, items=wants_field(self.request, 'items'))
+        if wants_field(self.request, 'items'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'items', queryset=CartService.with_subtotals(CartItem.objects)))
+        return queryset
 
     def create(self, request, *args, **kwargs):
-        existing_cart = Cart.objects.filter(user=request.user).first()
+        existing_cart = self.get_queryset().first()
 
         if existing_cart:
             # Return the existing cart if it exists
@@ -34,13 +46,16 @@ class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gener
         return super().create(request, *args, **kwargs)
 
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(IdempotentMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
+    permission_classes = [IsAuthenticated]
 
     def get_serializer_class(self):
-        if self.request.method == 'POST':
+        if self.action == 'bulk':
+            return BulkCartItemSerializer
+        if self.action == 'create':
             return AddCartItemSerializer
-        elif self.request.method == 'PATCH':
+        elif self.action == 'partial_update':
             return UpdateCartItemSerializer
         return CartItemSerializer
 
@@ -49,14 +64,41 @@ class CartItemViewSet(ModelViewSet):
         if getattr(self, 'swagger_fake_view', False):
             return context
 
-        return {'cart_id': self.kwargs.get('cart_pk')}
+        return {**context, 'cart_id': self.kwargs.get('cart_pk')}
 
     def get_queryset(self):
-        return CartItem.objects.select_related('product').filter(cart_id=self.kwargs.get('cart_pk'))
+        return CartService.with_subtotals(
+            CartItem.objects.filter(cart_id=self.kwargs.get('cart_pk')))
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, cart_pk=None):
+        """Apply many add/set/remove operations to the cart at once"""
+        return self.idempotent_response(
+            request, lambda: self.apply_bulk(request, cart_pk))
+
+    def apply_bulk(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = get_object_or_404(Cart, pk=cart_pk, user=request.user)
+        CartService.apply_operations(cart, serializer.validated_data['operations'])
+        return Response(CartSerializer(
+            cart, context=self.get_serializer_context()).data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(IdempotentMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'delete', 'patch', 'head', 'options']
+    pagination_class = OrderPagination
+
+    def create(self, request, *args, **kwargs):
+        return self.idempotent_response(
+            request, lambda: self.place_order(request, *args, **kwargs))
+
+    def place_order(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except InsufficientStock as e:
+            return Response({'detail': str(e), 'conflicts': e.conflicts},
+                            status=status.HTTP_409_CONFLICT)
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -88,13 +130,17 @@ class OrderViewSet(ModelViewSet):
         return orderSz.OrderSerializer
 
     def get_serializer_context(self):
+        context = super().get_serializer_context()
         if getattr(self, 'swagger_fake_view', False):
-            return super().get_serializer_context()
-        return {'user_id': self.request.user.pk, 'user': self.request.user}
+            return context
+        return {**context, 'user_id': self.request.user.pk, 'user': self.request.user}
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Order.objects.none()
+        queryset = Order.objects.all()
+        if wants_field(self.request, 'items'):
+            queryset = queryset.prefetch_related('items__product')
         if self.request.user.is_staff:
-            return Order.objects.prefetch_related('items__product').all()
-        return Order.objects.prefetch_related('items__product').filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
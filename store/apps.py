@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        import store.signals  # noqa: F401
+        import cloudinary
+        from django.conf import settings
+        credentials = settings.CLOUDINARY_STORAGE
+        cloudinary.config(
+            cloud_name=credentials['CLOUD_NAME'],
+            api_key=credentials['API_KEY'],
+            api_secret=credentials['API_SECRET'],
+            secure=credentials['SECURE'],
+        )
+        from django.contrib.auth import get_user_model
+        from api.cache import track_model_versions
+        from store.models import Category, Product, ProductImage, Review
+        track_model_versions(Category, Product, ProductImage, Review,
+                             get_user_model())
@@ -1,5 +1,7 @@
 from django_filters.rest_framework import FilterSet
+from rest_framework.filters import SearchFilter
 from store.models import Product
+from store.search import get_search_backend, tokenize
 
 
 class ProductFilter(FilterSet):
@@ -8,5 +10,21 @@ class ProductFilter(FilterSet):
         model = Product
         fields = {
             'category_id': ['exact'],
-            'price': ['gt', 'lt']
+            'price': ['gt', 'lt'],
+            'average_rating': ['gte', 'lte'],
+            'review_count': ['gte'],
         }
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Ranked full-text search over the indexed product search document.
+    Results come back best match first unless OrderingFilter, which runs
+    after this backend, is given an explicit ordering.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '')
+        if not tokenize(term):
+            return queryset
+        return get_search_backend().search(queryset, term)
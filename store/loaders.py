@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+
+
+class UserLoader:
+    """
+    Dataloader-style batch loader for users.
+
+    Collect the ids needed for a page with `prime()`, then `load()` each one;
+    all primed ids are fetched with a single `IN` query and every user is
+    serialized only once, no matter how many rows reference it.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._pending = set()
+        self._cache = {}
+
+    def prime(self, ids):
+        self._pending.update(pk for pk in ids if pk not in self._cache)
+
+    def load(self, pk):
+        if pk not in self._cache:
+            self._pending.add(pk)
+            self._dispatch()
+        return self._cache.get(pk)
+
+    def _dispatch(self):
+        if not self._pending:
+            return
+        users = get_user_model().objects.filter(pk__in=self._pending).only(
+            'id', 'first_name', 'last_name')
+        for user in users:
+            self._cache[user.pk] = self.serializer_class(user).data
+        for pk in self._pending:
+            self._cache.setdefault(pk, None)
+        self._pending.clear()
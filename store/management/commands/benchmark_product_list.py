@@ -0,0 +1,49 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from store.models import Product
+from store.serializers import ProductSerializer, ProductSnapshotSerializer
+from store.snapshots import rebuild_all
+
+
+class Command(BaseCommand):
+    help = ('Compare product list latency of the live serializer against '
+            'stored snapshots')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def measure(self, build):
+        timings = []
+        for _ in range(self.iterations):
+            start = time.perf_counter()
+            JSONRenderer().render(build())
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return (statistics.mean(timings), timings[len(timings) // 2],
+                timings[int(len(timings) * 0.99) - 1])
+
+    def handle(self, *args, **options):
+        self.iterations = options['iterations']
+        size = options['page_size']
+        if not Product.objects.exists():
+            self.stderr.write('No products to benchmark')
+            return
+        rebuild_all()
+
+        def serializer_path():
+            page = Product.objects.select_related(
+                'category').prefetch_related('images')[:size]
+            return ProductSerializer(page, many=True).data
+
+        def snapshot_path():
+            page = Product.objects.select_related('snapshot')[:size]
+            return ProductSnapshotSerializer(page, many=True).data
+
+        for name, build in (('serializer', serializer_path),
+                            ('snapshot', snapshot_path)):
+            mean, p50, p99 = self.measure(build)
+            self.stdout.write(
+                f'{name:<12} mean {mean:.3f} ms  p50 {p50:.3f} ms  p99 {p99:.3f} ms')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from store.models import ProductImage
+from store.uploads import upload_pipeline
+
+
+class Command(BaseCommand):
+    help = 'Store responsive variants for product images uploaded without them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild variants for every uploaded image')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.filter(
+            status=ProductImage.READY).exclude(image__isnull=True).exclude(image='')
+        if not options['all']:
+            images = images.filter(variants={})
+        total = upload_pipeline.build_variants(images.order_by('pk').iterator())
+        self.stdout.write(self.style.SUCCESS(f'Built variants for {total} product images'))
@@ -0,0 +1,312 @@
+import csv
+import io
+import json
+import re
+import sys
+import time
+from datetime import datetime
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, models, transaction
+from django.utils import timezone
+from api.cache import bump_model_version
+from store.models import Category, Product, ProductImage
+from store.search import get_search_backend
+from store.snapshots import build_snapshots
+from store.suggest import suggestion_index
+
+# In dependency order, so each chunk writes referenced rows first
+MODELS = {
+    'store.category': Category,
+    'store.product': Product,
+    'store.productimage': ProductImage,
+}
+FORMATS = {'.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv'}
+_WHITESPACE = re.compile(r'\s*')
+
+
+def iter_json_array(file, read_size=1 << 16):
+    """
+    Yield the items of a top-level JSON array (a loaddata fixture) while
+    holding only about one item and one read in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof, started = '', 0, False, False
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                raise CommandError('Unexpected end of JSON input')
+            chunk = file.read(read_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        char = buffer[position]
+        if not started:
+            if char != '[':
+                raise CommandError('JSON input must be an array of objects')
+            started = True
+            position += 1
+        elif char == ']':
+            return
+        elif char == ',':
+            position += 1
+        else:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise CommandError(f'Invalid JSON near: {buffer[position:position + 80]!r}')
+                # The item continues past the buffer; read more and retry
+                chunk = file.read(read_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield item
+
+
+def iter_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _copy_value(value):
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class Command(BaseCommand):
+    help = ('Stream a catalog of categories, products and product images from '
+            'JSON (loaddata fixtures), NDJSON or CSV and upsert it in chunks. '
+            'updated_at is set by the import; created_at is taken from the '
+            'input, kept for existing rows, or else set by the import.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help='Input format; guessed from the extension by default')
+        parser.add_argument('--model', choices=sorted(MODELS),
+                            help='Model of records that do not name one (CSV rows, '
+                                 'flat JSON objects)')
+        parser.add_argument('--chunk-size', type=int, default=2_000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Use bulk_create upserts on PostgreSQL instead of COPY')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Skip the search index and snapshots of imported '
+                                 'products (rebuild them afterwards)')
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        self.default_model = options['model']
+        self.skip_derived = options['skip_derived']
+        self.use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        self.counts = {model: 0 for model in MODELS.values()}
+        self.pending = 0
+        # {model: {provided fields: {key: instance}}}
+        self.buffers = {model: {} for model in MODELS.values()}
+        self.start = time.perf_counter()
+
+        path = options['path']
+        fmt = options['format'] or FORMATS.get(
+            path[path.rfind('.'):].lower() if '.' in path else '')
+        if fmt is None:
+            raise CommandError('Cannot tell the input format; pass --format')
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            if fmt == 'json':
+                records = iter_json_array(file)
+            elif fmt == 'ndjson':
+                records = iter_ndjson(file)
+            else:
+                records = csv.DictReader(file)
+            for number, record in enumerate(records, 1):
+                try:
+                    self.add(*self.build(record, csv_row=fmt == 'csv'))
+                except (ValidationError, ValueError, TypeError, FieldDoesNotExist) as e:
+                    raise CommandError(f'Record {number}: {e}')
+            self.flush()
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        self.reset_sequences()
+        for model in MODELS.values():
+            bump_model_version(model)
+        suggestion_index.clear()
+
+        elapsed = time.perf_counter() - self.start
+        total = sum(self.counts.values())
+        summary = ', '.join(f'{model._meta.verbose_name}: {count}'
+                            for model, count in self.counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} records ({summary}) in {elapsed:.1f}s, '
+            f'{total / max(elapsed, 1e-9):,.0f} records/s'))
+
+    def build(self, record, csv_row=False):
+        """Instance and provided field names of a fixture-style or flat record"""
+        if not isinstance(record, dict):
+            raise ValueError('records must be objects')
+        if 'fields' in record:
+            label, pk, fields = record.get('model'), record.get('pk'), record['fields']
+        else:
+            fields = dict(record)
+            label = fields.pop('model', None) or self.default_model
+            pk = fields.pop('pk', fields.pop('id', None))
+        model = MODELS.get((label or '').lower())
+        if model is None:
+            raise ValueError(f'unsupported model {label!r}; expected one of '
+                             f'{", ".join(MODELS)}')
+
+        instance = model()
+        if pk not in (None, ''):
+            instance.pk = model._meta.pk.to_python(pk)
+        provided = []
+        for name, value in fields.items():
+            field = model._meta.get_field(name)
+            if not field.concrete or field.many_to_many or field.primary_key:
+                raise ValueError(f'{name} cannot be imported')
+            if csv_row and value == '' and (field.null or not field.empty_strings_allowed):
+                value = None
+            if value is None and not field.null:
+                if not field.empty_strings_allowed:
+                    raise ValueError(f'{name} cannot be null')
+                value = ''
+            if value is not None:
+                target = field.target_field if field.is_relation else field
+                value = target.to_python(value)
+                if (isinstance(value, datetime) and settings.USE_TZ
+                        and timezone.is_naive(value)):
+                    value = timezone.make_aware(value)
+            setattr(instance, field.attname, value)
+            provided.append(field.name)
+        return model, instance, frozenset(provided)
+
+    def add(self, model, instance, provided):
+        group = self.buffers[model].setdefault(provided, {})
+        # A row may only be upserted once per statement; the last record wins
+        key = instance.pk if instance.pk is not None else id(instance)
+        if key not in group:
+            self.pending += 1
+        group[key] = instance
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        product_ids = set()
+        with transaction.atomic():
+            for model, groups in self.buffers.items():
+                for provided, instances in groups.items():
+                    instances = list(instances.values())
+                    self.upsert(model, instances, provided)
+                    self.counts[model] += len(instances)
+                    if model is Product:
+                        product_ids.update(instance.pk for instance in instances)
+                    elif model is ProductImage:
+                        product_ids.update(i.product_id for i in instances if i.product_id)
+                groups.clear()
+        self.pending = 0
+
+        if not self.skip_derived:
+            # bulk writes skip the signals that keep these in step
+            products = list(Product.objects.filter(pk__in=product_ids))
+            get_search_backend().index(products)
+            build_snapshots(products)
+
+        total = sum(self.counts.values())
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(f'  {total} records, {total / max(elapsed, 1e-9):,.0f}/s')
+
+    def upsert(self, model, instances, provided):
+        pk = model._meta.pk
+        fields = model._meta.concrete_fields
+        # created_at-style fields are never rewritten on conflict; bulk_create
+        # stamps them with the current time, so values the input gave are
+        # put back afterwards
+        stamped = [field for field in fields if getattr(field, 'auto_now_add', False)]
+        given = [field for field in stamped if field.name in provided]
+        given_values = [[getattr(instance, field.attname) for field in given]
+                        for instance in instances]
+        update_fields = sorted((provided - {field.name for field in stamped}) | {
+            field.name for field in fields if getattr(field, 'auto_now', False)})
+
+        keyed = [instance for instance in instances if instance.pk is not None]
+        new = [instance for instance in instances if instance.pk is None]
+        if keyed and self.use_copy:
+            self.copy_upsert(model, keyed, update_fields)
+        elif keyed and provided:
+            model.objects.bulk_create(
+                keyed, update_conflicts=True, unique_fields=[pk.name],
+                update_fields=update_fields)
+        elif keyed:
+            model.objects.bulk_create(keyed, ignore_conflicts=True)
+        if new:
+            model.objects.bulk_create(new)
+
+        if given:
+            for instance, values in zip(instances, given_values):
+                for field, value in zip(given, values):
+                    setattr(instance, field.attname, value)
+            model.objects.bulk_update(
+                [instance for instance in instances if instance.pk is not None],
+                [field.name for field in given])
+
+    def copy_upsert(self, model, instances, update_fields):
+        """
+        COPY the rows into a temporary table and upsert from it in one
+        INSERT ... ON CONFLICT, which is several times faster than a
+        multi-row INSERT on PostgreSQL.
+        """
+        qn = connection.ops.quote_name
+        table = model._meta.db_table
+        temp = f'import_{table}'
+        fields = model._meta.concrete_fields
+        columns = ', '.join(qn(field.column) for field in fields)
+
+        buffer = io.StringIO()
+        for instance in instances:
+            values = []
+            for field in fields:
+                value = field.pre_save(instance, True)
+                if isinstance(field, models.JSONField):
+                    value = None if value is None else json.dumps(value, cls=field.encoder)
+                else:
+                    value = field.get_db_prep_save(value, connection)
+                values.append(_copy_value(value))
+            buffer.write(','.join(values) + '\n')
+        buffer.seek(0)
+
+        updates = ', '.join(
+            f'{qn(column)} = EXCLUDED.{qn(column)}' for column in
+            (model._meta.get_field(name).column for name in update_fields))
+        conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMPORARY TABLE {qn(temp)} '
+                           f'(LIKE {qn(table)} INCLUDING DEFAULTS)')
+            copy = f'COPY {qn(temp)} ({columns}) FROM STDIN WITH (FORMAT csv)'
+            if hasattr(cursor.cursor, 'copy_expert'):
+                cursor.cursor.copy_expert(copy, buffer)
+            else:
+                # psycopg 3
+                with cursor.cursor.copy(copy) as writer:
+                    writer.write(buffer.getvalue())
+            cursor.execute(
+                f'INSERT INTO {qn(table)} ({columns}) SELECT {columns} FROM {qn(temp)} '
+                f'ON CONFLICT ({qn(model._meta.pk.column)}) {conflict}')
+            cursor.execute(f'DROP TABLE {qn(temp)}')
+
+    def reset_sequences(self):
+        # Explicit primary keys do not advance the sequences
+        statements = connection.ops.sequence_reset_sql(no_style(), list(MODELS.values()))
+        if statements:
+            try:
+                with connection.cursor() as cursor:
+                    for sql in statements:
+                        cursor.execute(sql)
+            except DatabaseError as e:
+                raise CommandError(f'Could not reset sequences: {e}')
@@ -0,0 +1,20 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from store.uploads import upload_pipeline
+
+
+class Command(BaseCommand):
+    help = ('Queue the upload of product images still waiting in staging, '
+            'e.g. after a worker was stopped mid-upload')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds after which an upload in progress '
+                                 'is considered abandoned')
+
+    def handle(self, *args, **options):
+        total = upload_pipeline.process_stale(
+            stale_after=timedelta(seconds=options['stale_after']),
+            retry_failed=options['retry_failed'])
+        self.stdout.write(self.style.SUCCESS(f'Queued {total} product images'))
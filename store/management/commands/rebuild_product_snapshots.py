@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.snapshots import rebuild_all
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored JSON snapshot of every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = rebuild_all(chunk_size=options['chunk_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} product snapshots'))
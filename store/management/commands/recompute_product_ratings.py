@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.services import RatingService
+
+
+class Command(BaseCommand):
+    help = 'Recompute the review aggregates stored on every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = RatingService.recompute(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed ratings of {total} products'))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:20
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def install_search(apps, schema_editor):
+    from store.search import get_search_backend
+    backend = get_search_backend(schema_editor.connection.vendor)
+    backend.install(schema_editor)
+    backend.rebuild(apps.get_model('store', 'Product'))
+
+
+def uninstall_search(apps, schema_editor):
+    from store.search import get_search_backend
+    get_search_backend(schema_editor.connection.vendor).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_review_product_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(install_search, uninstall_search),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_category_productimage_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSnapshot',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='store.product')),
+                ('updated_at', models.DateTimeField()),
+                ('data', models.JSONField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsnapshot',
+            name='version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -2,12 +2,14 @@ from django.db import models
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from cloudinary.models import CloudinaryField
 
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -24,6 +26,22 @@ class Product(models.Model):
     featured = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by store.search; only populated on Postgres
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Review aggregates, maintained by store.services.RatingService
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.DecimalField(
+        max_digits=3, decimal_places=2, default=0, editable=False, db_index=True)
+
+    # Written only by RatingService's UPDATEs, never by saving a product
+    AGGREGATE_FIELDS = ('review_count', 'rating_sum', 'rating_1', 'rating_2',
+                        'rating_3', 'rating_4', 'rating_5', 'average_rating')
 
     class Meta:
         ordering = ['id',]
@@ -31,11 +49,70 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *, update_fields=None, **kwargs):
+        if self._state.adding or kwargs.get('force_insert'):
+            return super().save(update_fields=update_fields, **kwargs)
+        # A full save would write back aggregates loaded before a review
+        # that was counted since; skip them and pick up the current ones
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key
+                             and field.name not in self.AGGREGATE_FIELDS]
+        super().save(update_fields=update_fields, **kwargs)
+        self.refresh_from_db(fields=self.AGGREGATE_FIELDS)
+
 
 class ProductImage(models.Model):
+    PENDING = 'pending'
+    UPLOADING = 'uploading'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (UPLOADING, 'Uploading'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name='images')
-    image = CloudinaryField('image')
+    # Empty until store.uploads has pushed the staged file to storage
+    image = CloudinaryField('image', null=True, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=READY)
+    staged_file = models.CharField(max_length=255, blank=True, editable=False)
+    attempts = models.PositiveSmallIntegerField(default=0, editable=False)
+    error = models.TextField(blank=True, editable=False)
+    # {name: {url, width, height}} for the original and IMAGE_VARIANTS
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class StagedUpload(models.Model):
+    """
+    Bytes of an uploaded image until store.uploads has stored it, kept in
+    the database so any task worker can read them
+    """
+    name = models.CharField(max_length=255, unique=True)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ProductSnapshot(models.Model):
+    """
+    Stored public representation of a product, valid for `updated_at` and
+    the serializer output of store.snapshots.SNAPSHOT_VERSION `version`
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    updated_at = models.DateTimeField()
+    version = models.PositiveSmallIntegerField(default=0)
+    data = models.JSONField()
+
+    def __str__(self):
+        return f"Snapshot of {self.product_id} at {self.updated_at}"
 
 
 class Review(models.Model):
@@ -49,5 +126,11 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-created_at', '-id'],
+                         name='review_product_created_idx'),
+        ]
+
     def __str__(self):
         return f"Review given by {self.user.first_name} on {self.product.name}"
@@ -1,4 +1,108 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from api.cache import get_model_version
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator whose COUNT(*) is cached per distinct query and model version,
+    so any write to the model makes the cached count unreachable.
+    Unfiltered Postgres tables above `estimate_threshold` rows use the
+    planner's row estimate instead of counting at all.
+    """
+    count_timeout = 60
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+
+        estimate = self._estimate(queryset)
+        if estimate is not None:
+            return estimate
+
+        sql, params = queryset.query.sql_with_params()
+        key = 'pagination:count:{}:{}'.format(
+            get_model_version(queryset.model),
+            hashlib.md5(f'{sql}{params!r}'.encode()).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_timeout)
+        return count
+
+    def _estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= self.estimate_threshold:
+            return int(row[0])
+        return None
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination keyed on the requested ordering field, with `id` as a
+    tie-breaker so pages are stable when that field has duplicates.
+    """
+    page_size = 10
+    ordering = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        field = ordering[0]
+        if field.lstrip('-') in ('id', 'pk'):
+            return (field,)
+        return (field, '-id' if field.startswith('-') else 'id')
+
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    """
+    Page-number pagination with a cached total count. Views that set
+    `cursor_pagination_class` also accept `?pagination=cursor` (or a
+    `cursor` parameter) to switch to keyset pagination, which skips the
+    count and deep OFFSET entirely.
+    """
+    page_size = 10
+    django_paginator_class = CachedCountPaginator
+    cursor_pagination_class = None
+    mode_query_param = 'pagination'
+
+    def use_cursor(self, request):
+        return self.cursor_pagination_class is not None and (
+            request.query_params.get(self.mode_query_param) == 'cursor' or
+            'cursor' in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ProductPagination(DefaultPagination):
+    cursor_pagination_class = KeysetPagination
+
+
+class ReviewCursorPagination(CursorPagination):
+    """Keyset pagination on created_at, newest reviews first"""
+    page_size = 10
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,32 @@
+"""
+OpenAPI annotations of the store views. Applied here rather than as
+decorators in store.views so serving the API never imports drf_yasg;
+api.schema imports this module before generating the schema.
+"""
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from store.serializers import ProductSerializer
+from store.views import ProductViewSet
+
+swagger_auto_schema(
+    operation_summary='Retrieve a list of products'
+)(ProductViewSet.list)
+
+swagger_auto_schema(
+    operation_summary="Create a product by admin",
+    operation_description="This allow an admin to create a product",
+    request_body=ProductSerializer,
+    responses={
+        201: ProductSerializer,
+        400: "Bad Request"
+    }
+)(ProductViewSet.create)
+
+swagger_auto_schema(
+    operation_summary='Suggest products and categories by name prefix',
+    manual_parameters=[
+        openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+        openapi.Parameter('limit', openapi.IN_QUERY,
+                          type=openapi.TYPE_INTEGER),
+    ]
+)(ProductViewSet.suggest)
@@ -0,0 +1,152 @@
+import re
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+
+FTS_TABLE = 'store_product_fts'
+
+
+def tokenize(term):
+    """Split a raw search string into plain word tokens"""
+    return re.findall(r'\w+', term or '')
+
+
+class BaseSearchBackend:
+    """
+    Keeps the product search document up to date and answers ranked queries.
+
+    `search()` filters the given queryset and annotates it with
+    `search_rank`, ordered best match first, so it composes with the rest of
+    the filter backend chain.
+    """
+
+    def install(self, schema_editor):
+        pass
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def rebuild(self, model=None):
+        model = model or self.get_model()
+        self.index(model.objects.only('id', 'name', 'description').iterator())
+
+    def get_model(self):
+        from store.models import Product
+        return Product
+
+    def search(self, queryset, term):
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Weighted tsvector column on Product, backed by a GIN index"""
+    config = 'english'
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS store_product_search_gin '
+            'ON store_product USING gin (search_vector)')
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute('DROP INDEX IF EXISTS store_product_search_gin')
+
+    def document(self):
+        from django.contrib.postgres.search import SearchVector
+        return (SearchVector('name', weight='A', config=self.config) +
+                SearchVector('description', weight='B', config=self.config))
+
+    def index(self, products):
+        ids = [product.pk for product in products]
+        if ids:
+            self.get_model().objects.filter(pk__in=ids).update(
+                search_vector=self.document())
+
+    def rebuild(self, model=None):
+        model = model or self.get_model()
+        model.objects.update(search_vector=self.document())
+
+    def search(self, queryset, term):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        query = SearchQuery(' '.join(tokenize(term)),
+                            config=self.config, search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', 'id')
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """FTS5 virtual table mirroring product name and description"""
+    weights = (10.0, 1.0)
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            "USING fts5(name, description, tokenize='porter unicode61')")
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def index(self, products):
+        rows = [(product.pk, product.name, product.description)
+                for product in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(pk,) for pk, _, _ in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+                'VALUES (%s, %s, %s)', rows)
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(pk,) for pk in product_ids])
+
+    def rebuild(self, model=None):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        super().rebuild(model)
+
+    def search(self, queryset, term):
+        match = ' '.join(f'"{token}"' for token in tokenize(term))
+        table = queryset.model._meta.db_table
+        weights = ', '.join(str(weight) for weight in self.weights)
+        matches = RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,))
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            (match,), output_field=FloatField())
+        return queryset.filter(id__in=matches).annotate(
+            search_rank=rank).order_by('-search_rank', 'id')
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """Unranked icontains matching for databases without full-text support"""
+
+    def search(self, queryset, term):
+        for token in tokenize(term):
+            queryset = queryset.filter(
+                Q(name__icontains=token) | Q(description__icontains=token))
+        return queryset.annotate(search_rank=Value(0.0))
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend(vendor=None):
+    return BACKENDS.get(vendor or connection.vendor, FallbackSearchBackend)()
@@ -1,10 +1,15 @@
+import time
 from rest_framework import serializers
 from decimal import Decimal
 from .models import Category, Product, Review, ProductImage
+from .loaders import UserLoader
+from .snapshots import build_snapshots, is_fresh
 from django.contrib.auth import get_user_model
+from api.metrics import add_serializer_time
+from api.serializers import SparseFieldsMixin
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'product_count']
@@ -13,33 +18,87 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only=True, help_text="Return the number product in this category")
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
-    image = serializers.ImageField()
+class StoredImageField(serializers.ImageField):
+    """
+    Accepts uploads like ImageField, but reads the original's URL from the
+    image's stored variants rather than building it, when it has them.
+    """
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, image):
+        original = image.variants.get('original')
+        if original:
+            return original['url']
+        return super().to_representation(image.image)
+
+
+class ProductImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image = StoredImageField()
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants', 'status']
+        read_only_fields = ['variants', 'status']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
         fields = ['id', 'name', 'description', 'price',
-                  'stock', 'category', 'featured', 'price_with_tax', 'images'] 
+                  'stock', 'category', 'featured', 'price_with_tax', 'images',
+                  'review_count', 'average_rating', 'rating_histogram']
+        read_only_fields = ['review_count', 'average_rating']
 
     price_with_tax = serializers.SerializerMethodField(
         method_name='calculate_tax')
+    rating_histogram = serializers.SerializerMethodField()
 
     def calculate_tax(self, product):
         return round(product.price * Decimal(1.1), 2)
 
+    def get_rating_histogram(self, product):
+        return {str(star): getattr(product, f'rating_{star}')
+                for star in range(1, 6)}
+
     def validate_price(self, price):
         if price < 0:
             raise serializers.ValidationError('Price could not be negative')
         return price
 
 
+class ProductSnapshotListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        start = time.perf_counter()
+        products = list(data.all() if hasattr(data, 'all') else data)
+        build_snapshots([p for p in products if not is_fresh(p)])
+        representation = [self.child.filter_representation(product.snapshot.data)
+                          for product in products]
+        add_serializer_time(self.context.get('request'), time.perf_counter() - start)
+        return representation
+
+
+class ProductSnapshotSerializer(ProductSerializer):
+    """
+    Read path of ProductSerializer that emits each product's stored snapshot
+    instead of serializing it. Missing or stale snapshots are rebuilt in one
+    batch for the whole page.
+    """
+
+    class Meta(ProductSerializer.Meta):
+        list_serializer_class = ProductSnapshotListSerializer
+
+    def to_representation(self, instance):
+        start = time.perf_counter()
+        if not is_fresh(instance):
+            build_snapshots([instance])
+        representation = self.filter_representation(instance.snapshot.data)
+        add_serializer_time(self.context.get('request'), time.perf_counter() - start)
+        return representation
+
+
 class SimpleUserSerializer(serializers.ModelSerializer):
     name = serializers.SerializerMethodField(
         method_name='get_current_user_name')
@@ -52,16 +111,30 @@ class SimpleUserSerializer(serializers.ModelSerializer):
         return obj.get_full_name()
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        reviews = list(data.all() if hasattr(data, 'all') else data)
+        if 'user' in self.child.fields:
+            ReviewSerializer.get_user_loader(self.context).prime(
+                review.user_id for review in reviews)
+        return super().to_representation(reviews)
+
+
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.SerializerMethodField(method_name='get_user')
 
     class Meta:
         model = Review
         fields = ['id', 'user', 'product', 'rating', 'comment']
         read_only_fields = ['user', 'product']
+        list_serializer_class = ReviewListSerializer
+
+    @staticmethod
+    def get_user_loader(context):
+        return context.setdefault('user_loader', UserLoader(SimpleUserSerializer))
 
     def get_user(self, obj):
-        return SimpleUserSerializer(obj.user).data
+        return self.get_user_loader(self.context).load(obj.user_id)
 
     def create(self, validated_data):
         product_id = self.context['product_id']
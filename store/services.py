@@ -0,0 +1,88 @@
+from decimal import Decimal
+from django.db.models import Count, DecimalField, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+from api.cache import bump_model_version, bump_model_version_on_commit
+from store.models import Product, Review
+
+
+def _average(total, count):
+    return Coalesce(
+        Cast(total, FloatField()) / NullIf(count, Value(0)),
+        Value(0), output_field=DecimalField(max_digits=3, decimal_places=2))
+
+
+class RatingService:
+    """
+    Keeps the review aggregates on Product (count, sum, 1-5 star histogram
+    and average) in step with its reviews. Each change is a single
+    conditional UPDATE built from F() expressions, so concurrent reviews
+    never lose increments.
+    """
+
+    @staticmethod
+    def _apply(product_id, added=None, removed=None):
+        count = F('review_count')
+        total = F('rating_sum')
+        changes = {}
+        if added is not None:
+            count, total = count + 1, total + added
+            changes[f'rating_{added}'] = F(f'rating_{added}') + 1
+        if removed is not None:
+            count, total = count - 1, total - removed
+            changes[f'rating_{removed}'] = (
+                changes.get(f'rating_{removed}', F(f'rating_{removed}')) - 1)
+        Product.objects.filter(pk=product_id).update(
+            review_count=count, rating_sum=total,
+            average_rating=_average(total, count),
+            updated_at=timezone.now(), **changes)
+        bump_model_version_on_commit(Product)
+
+    @staticmethod
+    def review_added(review):
+        RatingService._apply(review.product_id, added=review.rating)
+
+    @staticmethod
+    def review_changed(review, old_rating):
+        if old_rating != review.rating:
+            RatingService._apply(
+                review.product_id, added=review.rating, removed=old_rating)
+
+    @staticmethod
+    def review_removed(review):
+        RatingService._apply(review.product_id, removed=review.rating)
+
+    @staticmethod
+    def recompute(product_model=Product, review_model=Review, chunk_size=1000):
+        """Rebuild the aggregates of every product from its reviews"""
+        counts = ['review_count', 'rating_sum', *(f'rating_{star}' for star in range(1, 6))]
+        total = 0
+        last_id = 0
+        while True:
+            products = list(product_model.objects.filter(pk__gt=last_id)
+                            .order_by('pk').only('pk')[:chunk_size])
+            if not products:
+                bump_model_version(product_model)
+                return total
+            stats = {
+                row['product_id']: row for row in review_model.objects
+                .filter(product_id__in=[p.pk for p in products])
+                .values('product_id')
+                .annotate(
+                    review_count=Count('pk'), rating_sum=Sum('rating'),
+                    **{f'rating_{star}': Count('pk', filter=Q(rating=star))
+                       for star in range(1, 6)})
+            }
+            now = timezone.now()
+            for product in products:
+                row = stats.get(product.pk, {})
+                for field in counts:
+                    setattr(product, field, row.get(field, 0))
+                product.average_rating = (
+                    Decimal(product.rating_sum) / product.review_count
+                ).quantize(Decimal('0.01')) if product.review_count else 0
+                product.updated_at = now
+            product_model.objects.bulk_update(
+                products, [*counts, 'average_rating', 'updated_at'])
+            total += len(products)
+            last_id = products[-1].pk
@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from store.models import Category, Product, ProductImage
+from store.search import get_search_backend
+from store.snapshots import build_snapshots, touch_product
+from store.suggest import suggestion_index
+
+
+# The index is shared by the process's requests; a rolled-back write must
+# never reach it
+def update_suggestions(kind, pk, name):
+    transaction.on_commit(lambda: suggestion_index.update(kind, pk, name))
+
+
+def remove_suggestions(kind, pk):
+    transaction.on_commit(lambda: suggestion_index.remove(kind, pk))
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+    build_snapshots([instance])
+    update_suggestions('product', instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+    remove_suggestions('product', instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, **kwargs):
+    update_suggestions('category', instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    remove_suggestions('category', instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_image_product(sender, instance, **kwargs):
+    touch_product(instance.product_id)
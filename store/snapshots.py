@@ -0,0 +1,87 @@
+import json
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from api.renderers import ORJSONRenderer
+from store.models import Product, ProductSnapshot
+
+# Bump whenever ProductSerializer's output changes shape, so snapshots
+# stored by earlier code are rebuilt instead of served
+SNAPSHOT_VERSION = 1
+
+
+def is_fresh(product):
+    """True when the product has a snapshot built from its current state"""
+    try:
+        snapshot = product.snapshot
+    except ProductSnapshot.DoesNotExist:
+        return False
+    return (snapshot is not None and snapshot.updated_at == product.updated_at
+            and snapshot.version == SNAPSHOT_VERSION)
+
+
+def build_snapshots(products, create=True):
+    """
+    Serialize `products` with ProductSerializer and upsert their snapshots.
+    Data is round-tripped through the API's JSON renderer so stored values
+    render exactly as the live serializer's would. With `create=False` only
+    existing snapshot rows are updated.
+    """
+    from store.serializers import ProductSerializer
+
+    products = list(products)
+    if not products:
+        return []
+    prefetch_related_objects(
+        [p for p in products if 'images' not in getattr(
+            p, '_prefetched_objects_cache', {})], 'images')
+    rendered = json.loads(ORJSONRenderer().render(
+        ProductSerializer(products, many=True).data))
+    snapshots = [
+        ProductSnapshot(product=product, updated_at=product.updated_at,
+                        version=SNAPSHOT_VERSION, data=data)
+        for product, data in zip(products, rendered)
+    ]
+    if create:
+        ProductSnapshot.objects.bulk_create(
+            snapshots, update_conflicts=True, unique_fields=['product'],
+            update_fields=['updated_at', 'version', 'data'])
+    else:
+        ProductSnapshot.objects.bulk_update(snapshots, ['updated_at', 'version', 'data'])
+    for product, snapshot in zip(products, snapshots):
+        product.snapshot = snapshot
+    return snapshots
+
+
+def refresh_snapshot(product_id):
+    """
+    Rebuild an existing snapshot. Never inserts, so it is safe to call while
+    the product and its snapshot are being cascade-deleted.
+    """
+    product = Product.objects.filter(pk=product_id).first()
+    if product is not None:
+        build_snapshots([product], create=False)
+
+
+def touch_product(product_id):
+    """
+    Mark a product changed after a write to its images, for the
+    validators and snapshots keyed on its updated_at
+    """
+    Product.objects.filter(pk=product_id).update(updated_at=timezone.now())
+    refresh_snapshot(product_id)
+
+
+def rebuild_all(chunk_size=500, stdout=None):
+    """Rebuild every snapshot in chunks of `chunk_size` products"""
+    total = 0
+    last_id = 0
+    while True:
+        chunk = list(Product.objects.filter(pk__gt=last_id)
+                     .order_by('pk')[:chunk_size])
+        if not chunk:
+            return total
+        build_snapshots(chunk)
+        total += len(chunk)
+        last_id = chunk[-1].pk
+        if stdout is not None:
+            stdout.write(f'Rebuilt {total} product snapshots')
@@ -0,0 +1,116 @@
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'\w+', (text or '').lower()))
+
+
+class PrefixIndex:
+    """
+    In-process typeahead index over product and category names.
+
+    Every word suffix of a name ("denim jacket", "jacket") is kept in one
+    sorted list, so a prefix lookup is two bisects plus a scan of the range.
+    The index is built lazily on first use, patched incrementally from
+    save/delete signals once their transaction commits, and rebuilt after
+    `max_age` seconds so workers that did not see a write still converge.
+    Reads and patches share one lock, since patches edit the list in place.
+    """
+    max_age = 300
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None
+        self._keys = {}
+        self._built_at = 0
+
+    def _items(self):
+        from store.models import Category, Product
+        for pk, name in Category.objects.values_list('id', 'name'):
+            yield 'category', pk, name
+        for pk, name in Product.objects.values_list('id', 'name'):
+            yield 'product', pk, name
+
+    @staticmethod
+    def _suffixes(name):
+        words = normalize(name).split(' ')
+        return [(' '.join(words[i:]), i) for i in range(len(words)) if words[i]]
+
+    def _build(self):
+        entries, keys = [], {}
+        for kind, pk, name in self._items():
+            ref = (kind, pk)
+            keys[ref] = []
+            for key, position in self._suffixes(name):
+                entry = (key, position, kind, pk, name)
+                entries.append(entry)
+                keys[ref].append(entry)
+        entries.sort()
+        self._entries, self._keys = entries, keys
+        self._built_at = time.monotonic()
+
+    def _ensure_built(self):
+        if self._entries is None or \
+                time.monotonic() - self._built_at > self.max_age:
+            with self._lock:
+                if self._entries is None or \
+                        time.monotonic() - self._built_at > self.max_age:
+                    self._build()
+
+    def _discard(self, ref):
+        for entry in self._keys.pop(ref, []):
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def update(self, kind, pk, name):
+        with self._lock:
+            if self._entries is None:
+                return
+            ref = (kind, pk)
+            self._discard(ref)
+            self._keys[ref] = []
+            for key, position in self._suffixes(name):
+                entry = (key, position, kind, pk, name)
+                insort(self._entries, entry)
+                self._keys[ref].append(entry)
+
+    def remove(self, kind, pk):
+        with self._lock:
+            if self._entries is not None:
+                self._discard((kind, pk))
+
+    def clear(self):
+        with self._lock:
+            self._entries, self._keys = None, {}
+
+    def suggest(self, prefix, limit=10):
+        """
+        The `limit` best names with a word starting with `prefix`: whole-name
+        matches first, then shorter names. Ranks every entry in the prefix's
+        range, which stays a slice of the sorted list even for one letter.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self._ensure_built()
+        # Everything starting with `prefix` sorts before this bound
+        bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        best = {}
+        with self._lock:
+            entries = self._entries or []
+            start = bisect_left(entries, (prefix,))
+            end = bisect_left(entries, (bound,), start)
+            for key, position, kind, pk, name in entries[start:end]:
+                rank = (position > 0, len(name), kind, pk, name)
+                if (kind, pk) not in best or rank < best[(kind, pk)]:
+                    best[(kind, pk)] = rank
+        return [{'type': kind, 'id': pk, 'name': name}
+                for _, _, kind, pk, name in heapq.nsmallest(limit, best.values())]
+
+
+suggestion_index = PrefixIndex()
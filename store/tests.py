@@ -1,3 +1,823 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from PIL import Image
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from api.testing import QueryCountMixin
+from django.core.management import CommandError, call_command
+from rest_framework.renderers import JSONRenderer
+from store.models import (
+    Category, Product, ProductImage, ProductSnapshot, Review, StagedUpload)
+from store.pagination import ProductPagination
+from store.serializers import ProductSerializer
+from store.snapshots import SNAPSHOT_VERSION
+from store.suggest import suggestion_index
+from store.uploads import LocalImageBackend, upload_pipeline
+from api.cache import response_cache_stats
+from api.models import Task
+from users.models import User
 
-# Create your tests here.
+
+def make_products(category, count, featured=False, images=2):
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f'Product {Product.objects.count() + 1}',
+            description='Test product',
+            price=Decimal('100.00') + i,
+            stock=10,
+            image='sample',
+            category=category,
+            featured=featured,
+        )
+        for _ in range(images):
+            ProductImage.objects.create(product=product, image='sample')
+        products.append(product)
+    return products
+
+
+def make_reviews(product, count):
+    reviews = []
+    for _ in range(count):
+        user = User.objects.create_user(
+            email=f'reviewer{User.objects.count() + 1}@example.com',
+            first_name='Test', last_name='Reviewer')
+        reviews.append(Review.objects.create(
+            product=product, user=user, rating=5, comment='Great'))
+    return reviews
+
+
+class StoreQueryCountTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Menswear')
+        self.products = make_products(self.category, 2, featured=True)
+
+    def test_product_list_is_constant(self):
+        self.assertConstantQueries(
+            '/api/v1/products/',
+            lambda: make_products(self.category, 5))
+
+    def test_product_list_with_filters_is_constant(self):
+        self.assertConstantQueries(
+            f'/api/v1/products/?category_id={self.category.pk}&ordering=-price',
+            lambda: make_products(self.category, 5))
+
+    def test_featured_products_is_constant(self):
+        self.assertConstantQueries(
+            '/api/v1/products/featured/',
+            lambda: make_products(self.category, 5, featured=True))
+
+    def test_product_detail_is_constant(self):
+        product = self.products[0]
+        self.assertConstantQueries(
+            f'/api/v1/products/{product.pk}/',
+            lambda: [ProductImage.objects.create(product=product, image='sample')
+                     for _ in range(5)])
+
+    def test_category_list_is_constant(self):
+        def grow():
+            for i in range(5):
+                make_products(Category.objects.create(name=f'Category {i}'), 1)
+        self.assertConstantQueries('/api/v1/categories/', grow)
+
+    def test_product_images_is_constant(self):
+        product = self.products[0]
+        self.assertConstantQueries(
+            f'/api/v1/products/{product.pk}/images/',
+            lambda: [ProductImage.objects.create(product=product, image='sample')
+                     for _ in range(5)])
+
+    def test_product_reviews_is_constant(self):
+        product = self.products[0]
+        make_reviews(product, 2)
+        self.assertConstantQueries(
+            f'/api/v1/products/{product.pk}/reviews/',
+            lambda: make_reviews(product, 5))
+
+
+class ReviewPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.product = make_products(None, 1, images=0)[0]
+        self.reviews = make_reviews(self.product, 25)
+
+    def test_reviews_are_paged_by_cursor_newest_first(self):
+        url = f'/api/v1/products/{self.product.pk}/reviews/'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(review['id'] for review in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [review.pk for review in reversed(self.reviews)])
+
+    def test_review_author_is_serialized(self):
+        response = self.client.get(
+            f'/api/v1/products/{self.product.pk}/reviews/{self.reviews[0].pk}/')
+        self.assertEqual(response.data['user'], {
+            'id': self.reviews[0].user_id, 'name': 'Test Reviewer'})
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.menswear = Category.objects.create(name='Menswear')
+        self.kids = Category.objects.create(name='Kids')
+        self.jacket = self.make('Denim Jacket', 'Washed blue denim', self.menswear, 50)
+        self.jeans = self.make('Slim Jeans', 'Stretch denim jeans', self.menswear, 30)
+        self.kids_jacket = self.make('Puffer Jacket', 'Warm winter wear', self.kids, 40)
+
+    def make(self, name, description, category, price):
+        return Product.objects.create(
+            name=name, description=description, price=price,
+            image='sample', category=category)
+
+    def search(self, query):
+        response = self.client.get(f'/api/v1/products/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('search=denim'),
+                         [self.jacket.pk, self.jeans.pk])
+        self.assertEqual(self.search('search=jeans denim'), [self.jeans.pk])
+
+    def test_search_composes_with_filters_and_ordering(self):
+        self.assertEqual(
+            self.search(f'search=jacket&category_id={self.kids.pk}'),
+            [self.kids_jacket.pk])
+        self.assertEqual(self.search('search=jacket&ordering=price'),
+                         [self.kids_jacket.pk, self.jacket.pk])
+        self.assertEqual(self.search('search=jacket&price__lt=45'),
+                         [self.kids_jacket.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.jeans.name = 'Slim Chinos'
+        self.jeans.description = 'Cotton twill'
+        self.jeans.save()
+        self.assertEqual(self.search('search=chinos'), [self.jeans.pk])
+        self.assertEqual(self.search('search=jeans'), [])
+        self.jacket.delete()
+        self.assertEqual(self.search('search=denim'), [])
+
+    def test_punctuation_is_not_query_syntax(self):
+        self.assertEqual(self.search('search="jacket-*'),
+                         [self.jacket.pk, self.kids_jacket.pk])
+        self.assertEqual(len(self.search('search=')), 3)
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        suggestion_index.clear()
+        self.addCleanup(suggestion_index.clear)
+        self.denim = Category.objects.create(name='Denim')
+        self.jacket = make_products(self.denim, 1, images=0)[0]
+        self.jacket.name = 'Denim Jacket'
+        self.jacket.save()
+        self.jeans = make_products(self.denim, 1, images=0)[0]
+        self.jeans.name = 'Slim Denim Jeans'
+        self.jeans.save()
+
+    def suggest(self, q, **params):
+        response = self.client.get(
+            '/api/v1/products/suggest/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(item['type'], item['id']) for item in response.data]
+
+    def test_prefix_matches_word_starts_without_queries(self):
+        self.suggest('den')
+        with self.assertNumQueries(0):
+            results = self.suggest('den')
+        self.assertEqual(results, [
+            ('category', self.denim.pk),
+            ('product', self.jacket.pk),
+            ('product', self.jeans.pk),
+        ])
+        self.assertEqual(self.suggest('jea'), [('product', self.jeans.pk)])
+        self.assertEqual(self.suggest('denim j', limit=1),
+                         [('product', self.jacket.pk)])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.suggest('den')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jeans.name = 'Cargo Pants'
+            self.jeans.save()
+            self.denim.name = 'Workwear'
+            self.denim.save()
+        self.assertEqual(self.suggest('den'), [('product', self.jacket.pk)])
+        self.assertEqual(self.suggest('car'), [('product', self.jeans.pk)])
+        self.assertEqual(self.suggest('work'), [('category', self.denim.pk)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.denim.delete()
+        self.assertEqual(self.suggest('den'), [])
+        self.assertEqual(self.suggest('work'), [])
+
+    def test_rolled_back_writes_are_not_indexed(self):
+        self.suggest('den')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.jeans.name = 'Cargo Pants'
+            self.jeans.save()
+            raise RuntimeError
+        self.assertEqual(self.suggest('car'), [])
+        self.assertIn(('product', self.jeans.pk), self.suggest('den'))
+
+    def test_best_matches_rank_across_the_whole_prefix(self):
+        products = make_products(self.denim, 30, images=0)
+        for i, product in enumerate(products):
+            Product.objects.filter(pk=product.pk).update(name=f'Alpha Zeta {i}')
+        Product.objects.filter(pk=products[0].pk).update(name='Alpine')
+        suggestion_index.clear()
+        self.assertEqual(self.suggest('alp', limit=1), [('product', products[0].pk)])
+
+
+class ProductPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.products = make_products(None, 12, images=0)
+        # Duplicate prices so keyset pages have to break ties on id
+        Product.objects.filter(pk__in=[p.pk for p in self.products[:6]]).update(
+            price=Decimal('50.00'))
+
+    def walk(self, url):
+        seen = []
+        with CaptureQueriesContext(connection) as ctx:
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('count', response.data)
+                seen.extend(product['id'] for product in response.data['results'])
+                url = response.data['next']
+        self.assertFalse(
+            [q for q in ctx.captured_queries if '__count' in q['sql']])
+        return seen
+
+    def test_cursor_mode_orders_by_id(self):
+        self.assertEqual(self.walk('/api/v1/products/?pagination=cursor'),
+                         [p.pk for p in self.products])
+
+    def test_cursor_mode_follows_ordering_with_tie_breaker(self):
+        expected = list(Product.objects.order_by('-price', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(
+            self.walk('/api/v1/products/?pagination=cursor&ordering=-price'),
+            expected)
+
+    def test_page_number_count_is_cached(self):
+        response = self.client.get('/api/v1/products/')
+        self.assertEqual(response.data['count'], 12)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/v1/products/?page=2')
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertFalse(
+            [q for q in ctx.captured_queries if '__count' in q['sql']])
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        response_cache_stats.reset()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Menswear')
+        self.product = make_products(self.category, 1)[0]
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_entries_are_per_host(self):
+        make_products(self.category, ProductPagination.page_size)
+        first = self.client.get('/api/v1/products/', HTTP_HOST='localhost')
+        other = self.client.get('/api/v1/products/', HTTP_HOST='127.0.0.1')
+        self.assertEqual(other['X-Cache'], 'MISS')
+        self.assertTrue(first.data['next'].startswith('http://localhost/'))
+        self.assertTrue(other.data['next'].startswith('http://127.0.0.1/'))
+
+    def test_second_read_is_served_from_cache(self):
+        url = f'/api/v1/products/{self.product.pk}/'
+        self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['id'], self.product.pk)
+
+    def test_query_string_is_part_of_the_key(self):
+        self.get('/api/v1/products/?ordering=price&page=1')
+        self.assertEqual(
+            self.get('/api/v1/products/?page=1&ordering=price')['X-Cache'], 'HIT')
+        self.assertEqual(
+            self.get('/api/v1/products/?ordering=-price')['X-Cache'], 'MISS')
+
+    def test_writes_invalidate_dependent_views(self):
+        product_url = f'/api/v1/products/{self.product.pk}/'
+        category_url = '/api/v1/categories/'
+        self.get(product_url)
+        self.get(category_url)
+
+        ProductImage.objects.create(product=self.product, image='sample')
+        response = self.get(product_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['images']), 3)
+
+        make_products(self.category, 1)
+        response = self.get(category_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data[0]['product_count'], 2)
+
+    def test_stats_are_admin_only(self):
+        self.get('/api/v1/products/featured/')
+        self.get('/api/v1/products/featured/')
+        self.assertEqual(self.client.get('/api/v1/cache-stats/').status_code, 401)
+        admin = User.objects.create_user(
+            email='admin@example.com', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.get('/api/v1/cache-stats/')
+        self.assertEqual(response.data['products-featured'],
+                         {'hits': 1, 'misses': 1})
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Menswear')
+        self.product = make_products(self.category, 1)[0]
+
+    def test_matching_etag_answers_304_from_the_aggregate_alone(self):
+        url = f'/api/v1/products/{self.product.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response['Surrogate-Key'],
+                         f'products product-{self.product.pk}')
+        self.assertIn('s-maxage', response['Cache-Control'])
+        etag = response['ETag']
+
+        cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        url = '/api/v1/categories/'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_change_the_etag(self):
+        product_url = f'/api/v1/products/{self.product.pk}/'
+        images_url = f'/api/v1/products/{self.product.pk}/images/'
+        category_url = f'/api/v1/categories/{self.category.pk}/'
+        etags = [self.client.get(url)['ETag']
+                 for url in (product_url, images_url, category_url)]
+
+        ProductImage.objects.filter(product=self.product).first().delete()
+        make_products(self.category, 1)
+
+        for url, etag in zip((product_url, images_url, category_url), etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_renaming_a_review_author_changes_the_etag(self):
+        review = make_reviews(self.product, 1)[0]
+        url = f'/api/v1/products/{self.product.pk}/reviews/'
+        etag = self.client.get(url)['ETag']
+        review.user.first_name = 'Renamed'
+        review.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['user']['name'], 'Renamed Reviewer')
+
+    def test_review_surrogate_keys_include_the_product(self):
+        review = make_reviews(self.product, 1)[0]
+        response = self.client.get(f'/api/v1/products/{self.product.pk}/reviews/')
+        self.assertEqual(
+            response['Surrogate-Key'],
+            f'product-{self.product.pk} product-review review-{review.pk}')
+
+
+class ProductSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Menswear')
+        self.product = make_products(self.category, 1)[0]
+
+    def live(self, product):
+        product = Product.objects.prefetch_related('images').get(pk=product.pk)
+        return json.loads(JSONRenderer().render(ProductSerializer(product).data))
+
+    def test_detail_matches_live_serializer(self):
+        response = self.client.get(f'/api/v1/products/{self.product.pk}/')
+        self.assertEqual(json.loads(response.content), self.live(self.product))
+
+    def test_snapshots_follow_product_and_image_writes(self):
+        self.product.price = Decimal('10.00')
+        self.product.save()
+        ProductImage.objects.create(product=self.product, image='sample')
+        snapshot = ProductSnapshot.objects.get(product=self.product)
+        self.assertEqual(snapshot.data['price'], 10.0)
+        self.assertEqual(len(snapshot.data['images']), 3)
+        self.assertEqual(snapshot.data, self.live(self.product))
+
+    def test_stale_snapshots_are_rebuilt_on_read(self):
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+        ProductSnapshot.objects.all().delete()
+        response = self.client.get('/api/v1/products/')
+        self.assertEqual(response.data['results'][0]['name'], 'Renamed')
+        self.assertTrue(ProductSnapshot.objects.filter(product=self.product).exists())
+
+    def test_snapshots_of_an_older_shape_are_rebuilt_on_read(self):
+        snapshot = ProductSnapshot.objects.get(product=self.product)
+        del snapshot.data['images'][0]['variants']
+        snapshot.version = 0
+        snapshot.save()
+        response = self.client.get(f'/api/v1/products/{self.product.pk}/')
+        self.assertIn('variants', response.data['images'][0])
+        self.assertEqual(ProductSnapshot.objects.get(product=self.product).version,
+                         SNAPSHOT_VERSION)
+
+    def test_deleting_a_product_with_images(self):
+        self.product.delete()
+        self.assertFalse(ProductSnapshot.objects.exists())
+
+    def test_rebuild_command(self):
+        make_products(self.category, 3)
+        ProductSnapshot.objects.all().delete()
+        call_command('rebuild_product_snapshots', chunk_size=2, stdout=StringIO())
+        self.assertEqual(ProductSnapshot.objects.count(), 4)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Menswear')
+        self.products = make_products(self.category, 2)
+
+    def test_fields_and_omit_on_snapshot_list(self):
+        response = self.client.get('/api/v1/products/?fields=id,name')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        response = self.client.get(
+            f'/api/v1/products/{self.products[0].pk}/?omit=images,description')
+        self.assertNotIn('images', response.data)
+        self.assertNotIn('description', response.data)
+        self.assertIn('price_with_tax', response.data)
+
+    def test_omitted_fields_skip_their_queries(self):
+        full = QueryCountMixin.count_queries(self, '/api/v1/categories/')
+        sparse = QueryCountMixin.count_queries(
+            self, '/api/v1/categories/?fields=id,name')
+        self.assertEqual(full, sparse)
+        response = self.client.get('/api/v1/categories/?omit=product_count')
+        self.assertNotIn('product_count', response.data[0])
+
+    def test_writes_ignore_sparse_fieldsets(self):
+        admin = User.objects.create_user(email='admin@example.com', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.post('/api/v1/categories/?fields=id',
+                                    {'name': 'Kids'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['name'], 'Kids')
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='buyer@example.com')
+        self.client.force_authenticate(self.user)
+        self.products = make_products(None, 2, images=0)
+        self.url = f'/api/v1/products/{self.products[0].pk}/reviews/'
+
+    def review(self, rating, product=None):
+        url = f'/api/v1/products/{(product or self.products[0]).pk}/reviews/'
+        response = self.client.post(url, {'rating': rating, 'comment': 'ok'})
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def product_data(self, product=None):
+        response = self.client.get(
+            f'/api/v1/products/{(product or self.products[0]).pk}/')
+        return response.data
+
+    def test_create_update_delete_keep_aggregates_in_step(self):
+        first = self.review(5)
+        self.review(4)
+        data = self.product_data()
+        self.assertEqual(data['review_count'], 2)
+        self.assertEqual(data['average_rating'], 4.5)
+        self.assertEqual(data['rating_histogram'],
+                         {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1})
+
+        self.client.patch(f'{self.url}{first}/', {'rating': 1})
+        data = self.product_data()
+        self.assertEqual(data['average_rating'], 2.5)
+        self.assertEqual(data['rating_histogram']['1'], 1)
+        self.assertEqual(data['rating_histogram']['5'], 0)
+
+        self.client.delete(f'{self.url}{first}/')
+        data = self.product_data()
+        self.assertEqual(data['review_count'], 1)
+        self.assertEqual(data['average_rating'], 4.0)
+
+    def test_order_and_filter_by_average_rating(self):
+        self.review(2)
+        self.review(5, self.products[1])
+        response = self.client.get('/api/v1/products/?ordering=-average_rating')
+        self.assertEqual([p['id'] for p in response.data['results']],
+                         [self.products[1].pk, self.products[0].pk])
+        response = self.client.get('/api/v1/products/?average_rating__gte=3')
+        self.assertEqual([p['id'] for p in response.data['results']],
+                         [self.products[1].pk])
+
+    def test_recompute_command_repairs_drift(self):
+        self.review(3)
+        Review.objects.create(product=self.products[0], user=self.user,
+                              rating=5, comment='imported')
+        Product.objects.filter(pk=self.products[1].pk).update(review_count=7)
+        call_command('recompute_product_ratings', stdout=StringIO())
+        first, second = Product.objects.order_by('pk')[:2]
+        self.assertEqual((first.review_count, first.rating_sum, first.rating_5),
+                         (2, 8, 1))
+        self.assertEqual(first.average_rating, Decimal('4.00'))
+        self.assertEqual(second.review_count, 0)
+
+    def test_saving_a_stale_product_keeps_the_aggregates(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        self.review(4)
+        product.name = 'Renamed'
+        product.save()
+        self.assertEqual((product.review_count, product.rating_4), (1, 1))
+        stored = Product.objects.get(pk=product.pk)
+        self.assertEqual((stored.name, stored.review_count, stored.rating_sum),
+                         ('Renamed', 1, 4))
+        self.assertEqual(stored.average_rating, Decimal('4.00'))
+
+
+class FailingBackend(LocalImageBackend):
+    calls = 0
+
+    def upload(self, file, name):
+        FailingBackend.calls += 1
+        raise ConnectionError('storage unavailable')
+
+
+class ImageUploadPipelineTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        settings = override_settings(
+            IMAGE_UPLOAD_BACKEND='store.uploads.LocalImageBackend',
+            MEDIA_ROOT=str(Path(self.dir.name, 'media')),
+            IMAGE_UPLOAD_RETRIES=2, TASK_QUEUE_EAGER=True, TASK_RETRY_DELAY=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.product = make_products(None, 1, images=0)[0]
+        self.url = f'/api/v1/products/{self.product.pk}/images/'
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(
+            email='admin@example.com', is_staff=True))
+
+    def png(self, size=(2, 2)):
+        buffer = BytesIO()
+        Image.new('RGB', size).save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.PNG', buffer.getvalue(), 'image/png')
+
+    def upload(self, size=(2, 2)):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                self.url, {'image': self.png(size)}, format='multipart')
+        return response, callbacks
+
+    def media(self, url):
+        return Path(self.dir.name, 'media', url.removeprefix('/media/'))
+
+    def test_upload_responds_before_the_image_is_stored(self):
+        response, callbacks = self.upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        image = ProductImage.objects.get(pk=response.data['id'])
+        self.assertFalse(image.image)
+        self.assertTrue(StagedUpload.objects.filter(name=image.staged_file).exists())
+
+        for callback in callbacks:
+            callback()
+        image.refresh_from_db()
+        self.assertEqual(image.status, ProductImage.READY)
+        self.assertEqual(image.staged_file, '')
+        self.assertTrue(Path(self.dir.name, 'media', str(image.image.public_id)
+                             + '.' + image.image.format).exists())
+        self.assertFalse(StagedUpload.objects.exists())
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(self.client.get(self.url).data[0]['status'], 'ready')
+
+    @override_settings(TASK_QUEUE_EAGER=False)
+    def test_uploads_wait_for_the_task_worker(self):
+        response, callbacks = self.upload()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ProductImage.objects.get(pk=response.data['id']).status,
+                         ProductImage.PENDING)
+        self.assertEqual(Task.objects.get().name, 'store.uploads.upload_image')
+        call_command('run_tasks', '--once', stdout=StringIO())
+        self.assertEqual(ProductImage.objects.get(pk=response.data['id']).status,
+                         ProductImage.READY)
+
+    def test_product_listings_follow_the_upload_status(self):
+        # Snapshot-served and response-cached, so every transition must reach them
+        def statuses():
+            products = self.client.get('/api/v1/products/').data['results']
+            detail = self.client.get(f'/api/v1/products/{self.product.pk}/').data
+            return ([image['status'] for image in products[0]['images']],
+                    [image['status'] for image in detail['images']])
+
+        cache.clear()
+        response, callbacks = self.upload()
+        self.assertEqual(statuses(), (['pending'], ['pending']))
+        self.assertTrue(upload_pipeline.claim(response.data['id']))
+        self.assertEqual(statuses(), (['uploading'], ['uploading']))
+        FailingBackend.calls = 0
+        with override_settings(IMAGE_UPLOAD_BACKEND='store.tests.FailingBackend'):
+            with self.assertRaises(ConnectionError):
+                upload_pipeline.process(response.data['id'],
+                                        statuses=[ProductImage.UPLOADING])
+            self.assertEqual(statuses(), (['pending'], ['pending']))
+            with override_settings(IMAGE_UPLOAD_RETRIES=0), \
+                    self.assertLogs('store.uploads', 'WARNING'):
+                upload_pipeline.process(response.data['id'])
+        self.assertEqual(statuses(), (['failed'], ['failed']))
+        upload_pipeline.process(response.data['id'], statuses=[ProductImage.FAILED])
+        self.assertEqual(statuses(), (['ready'], ['ready']))
+
+    def test_failures_are_retried_then_marked_failed(self):
+        response, callbacks = self.upload()
+        FailingBackend.calls = 0
+        with override_settings(IMAGE_UPLOAD_BACKEND='store.tests.FailingBackend'), \
+                self.assertLogs('api.tasks', 'ERROR'):
+            for callback in callbacks:
+                callback()
+            image = ProductImage.objects.get(pk=response.data['id'])
+            self.assertEqual((image.status, image.attempts), (ProductImage.PENDING, 1))
+            call_command('run_tasks', '--once', stdout=StringIO())
+        image = ProductImage.objects.get(pk=response.data['id'])
+        self.assertEqual(FailingBackend.calls, 3)
+        self.assertEqual((image.status, image.attempts), (ProductImage.FAILED, 3))
+        self.assertIn('storage unavailable', image.error)
+        self.assertFalse(Task.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('process_image_uploads', stdout=StringIO())
+        self.assertEqual(ProductImage.objects.get(pk=image.pk).status,
+                         ProductImage.FAILED)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('process_image_uploads', '--retry-failed', stdout=StringIO())
+        self.assertEqual(ProductImage.objects.get(pk=image.pk).status,
+                         ProductImage.READY)
+
+    def test_invalid_images_are_not_retried(self):
+        with self.assertLogs('store.uploads', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            image = upload_pipeline.stage(
+                SimpleUploadedFile('photo.png', b'not an image', 'image/png'),
+                product=self.product)
+        image.refresh_from_db()
+        self.assertEqual((image.status, image.attempts), (ProductImage.FAILED, 1))
+        self.assertIn('UnidentifiedImageError', image.error)
+        self.assertFalse(Task.objects.exists())
+
+    def test_an_image_is_only_uploaded_once(self):
+        response, callbacks = self.upload()
+        with mock.patch.object(LocalImageBackend, 'upload',
+                               autospec=True, return_value='x.png') as upload:
+            for callback in callbacks:
+                callback()
+            upload_pipeline.process(response.data['id'])
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('process_image_uploads', stdout=StringIO())
+        self.assertEqual(upload.call_count, 1)
+
+    @override_settings(IMAGE_VARIANTS={'thumbnail': 200, 'large': 1200})
+    def test_uploads_store_their_variants(self):
+        response, callbacks = self.upload(size=(1000, 500))
+        self.assertEqual(response.data['variants'], {})
+        for callback in callbacks:
+            callback()
+
+        variants = ProductImage.objects.get(pk=response.data['id']).variants
+        self.assertEqual(set(variants), {'original', 'thumbnail', 'large'})
+        self.assertEqual(
+            [(variants[name]['width'], variants[name]['height'])
+             for name in ('original', 'thumbnail', 'large')],
+            [(1000, 500), (200, 100), (1000, 500)])
+        # Never upscaled
+        self.assertEqual(variants['large'], variants['original'])
+        with Image.open(self.media(variants['thumbnail']['url'])) as thumbnail:
+            self.assertEqual(thumbnail.size, (200, 100))
+
+        data = self.client.get(f'/api/v1/products/{self.product.pk}/').data
+        self.assertEqual(data['images'][0]['variants'], variants)
+        self.assertEqual(data['images'][0]['image'], variants['original']['url'])
+
+    def test_variants_are_built_for_existing_images(self):
+        response, callbacks = self.upload(size=(800, 800))
+        for callback in callbacks:
+            callback()
+        image = ProductImage.objects.get(pk=response.data['id'])
+        variants = image.variants
+        ProductImage.objects.filter(pk=image.pk).update(variants={})
+
+        call_command('build_image_variants', stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual(image.variants['medium']['width'], 600)
+        self.assertEqual(image.variants['original'], variants['original'])
+        self.assertTrue(self.media(image.variants['medium']['url']).exists())
+
+
+class ImportCatalogTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = Path(self.directory.name) / name
+        path.write_text(content)
+        return str(path)
+
+    def test_imports_a_fixture_in_chunks(self):
+        out = StringIO()
+        call_command('import_catalog', 'fixtures/data.json', chunk_size=10, stdout=out)
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 36)
+        self.assertEqual(ProductSnapshot.objects.count(), 36)
+        self.assertEqual(out.getvalue().count(' records, '), 4)
+
+        product = Product.objects.get(pk=1)
+        self.assertEqual(product.created_at,
+                         datetime(2025, 9, 27, 10, 12, tzinfo=dt_timezone.utc))
+
+        # Importing again updates the rows in place
+        created = dict(Product.objects.values_list('pk', 'created_at'))
+        call_command('import_catalog', 'fixtures/data.json', stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 36)
+        self.assertEqual(dict(Product.objects.values_list('pk', 'created_at')), created)
+        self.assertGreater(Product.objects.get(pk=1).updated_at, product.updated_at)
+
+    def test_ndjson_upserts_and_refreshes_derived_data(self):
+        category = Category.objects.create(name='Menswear')
+        product = make_products(category, 1)[0]
+        path = self.write('catalog.ndjson', '\n'.join(json.dumps(record) for record in (
+            {'model': 'store.product', 'pk': product.pk,
+             'fields': {'name': 'Linen shirt', 'price': '19.99'}},
+            {'model': 'store.product', 'pk': product.pk + 1, 'fields': {
+                'name': 'Denim jacket', 'description': 'Blue', 'price': '49.00',
+                'stock': 4, 'image': 'sample', 'category': category.pk}},
+            {'model': 'store.productimage', 'pk': 1000,
+             'fields': {'product': product.pk, 'image': 'sample'}},
+        )))
+        call_command('import_catalog', path, stdout=StringIO())
+
+        created_at = product.created_at
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.price), ('Linen shirt', Decimal('19.99')))
+        self.assertEqual(product.created_at, created_at)
+        self.assertEqual(product.stock, 10)
+        snapshot = ProductSnapshot.objects.get(product=product)
+        self.assertEqual(snapshot.data['name'], 'Linen shirt')
+        self.assertEqual(len(snapshot.data['images']), 3)
+        self.assertEqual(Product.objects.get(pk=product.pk + 1).category, category)
+        # The sequence moved past the imported primary keys
+        self.assertGreater(ProductImage.objects.create(product=product).pk, 1000)
+
+    def test_csv_rows_with_model_option(self):
+        path = self.write('categories.csv', 'id,name,description\n'
+                                            '7,Menswear,\n'
+                                            ',Womenswear,Dresses\n'
+                                            '7,Mens,Shirts\n')
+        call_command('import_catalog', path, model='store.category', stdout=StringIO())
+        self.assertEqual(
+            list(Category.objects.order_by('name').values_list('pk', 'name', 'description')),
+            [(7, 'Mens', 'Shirts'), (8, 'Womenswear', 'Dresses')])
+
+    def test_rejects_unknown_models(self):
+        path = self.write('users.ndjson', '{"model": "users.user", "pk": 1, "fields": {}}')
+        with self.assertRaisesMessage(CommandError, 'Record 1: unsupported model'):
+            call_command('import_catalog', path, stdout=StringIO())
@@ -0,0 +1,277 @@
+import logging
+import os
+from datetime import timedelta
+from io import BytesIO
+from urllib.request import urlopen
+from uuid import uuid4
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from api.cache import bump_model_version_on_commit
+from api.tasks import enqueue_call, task
+from store.models import ProductImage, StagedUpload
+from store.snapshots import touch_product
+from store.variants import fit, image_size, render_variants, variant, verify_image
+
+logger = logging.getLogger(__name__)
+
+
+class LocalImageBackend:
+    """
+    Stores images on the local filesystem under MEDIA_ROOT. A stand-in for
+    Cloudinary in development and tests; the stored value is the file name.
+
+    Backends implement `upload(file, name)`, returning the value stored in
+    the image field, `variants(file, value)`, returning the URL and size of
+    the original and each of IMAGE_VARIANTS, `open(value)` and
+    `is_transient(error)`, whether an error is worth retrying.
+    """
+    folder = 'product-images'
+
+    def __init__(self, location=None):
+        self.storage = FileSystemStorage(
+            location=location or os.path.join(
+                settings.MEDIA_ROOT or settings.BASE_DIR / 'media', self.folder),
+            base_url=f'{settings.MEDIA_URL}{self.folder}/')
+
+    def upload(self, file, name):
+        return f'{self.folder}/{self.storage.save(name, file)}'
+
+    def _name(self, value):
+        if hasattr(value, 'public_id'):
+            # Read back from the CloudinaryField
+            value = f'{value.public_id}.{value.format}' if value.format else value.public_id
+        return value.removeprefix(f'{self.folder}/')
+
+    def open(self, value):
+        return self.storage.open(self._name(value))
+
+    def is_transient(self, error):
+        return isinstance(error, OSError)
+
+    def variants(self, file, value):
+        """Resize the original into each variant and store it next to it"""
+        name = self._name(value)
+        stem, ext = os.path.splitext(name)
+        original = variant(self.storage.url(name), *image_size(file))
+        variants = {'original': original}
+        for label, width, height, data in render_variants(file):
+            if data is None:
+                variants[label] = original
+            else:
+                saved = self.storage.save(f'{stem}_{label}{ext}', ContentFile(data))
+                variants[label] = variant(self.storage.url(saved), width, height)
+        return variants
+
+
+class CloudinaryImageBackend:
+    """Uploads images to Cloudinary; the stored value is the resource"""
+    folder = 'products'
+
+    def upload(self, file, name):
+        from cloudinary import CloudinaryResource, uploader
+        result = uploader.upload(file, folder=self.folder)
+        return CloudinaryResource(
+            result['public_id'], version=str(result['version']),
+            format=result.get('format'), type=result['type'],
+            resource_type=result['resource_type'])
+
+    def open(self, value):
+        with urlopen(value.build_url()) as response:
+            return BytesIO(response.read())
+
+    def is_transient(self, error):
+        from cloudinary import exceptions
+        # Network failures raise the base Error; BadRequest is a bad image
+        return (isinstance(error, (OSError, exceptions.RateLimited,
+                                   exceptions.GeneralError))
+                or type(error) is exceptions.Error)
+
+    def variants(self, file, value):
+        """
+        Declare each variant as a Cloudinary transformation of the original;
+        Cloudinary renders them on first request.
+        """
+        width, height = image_size(file)
+        variants = {'original': variant(value.build_url(), width, height)}
+        for label, size in settings.IMAGE_VARIANTS.items():
+            url = value.build_url(width=size, height=size, crop='limit',
+                                  quality='auto', fetch_format='auto')
+            variants[label] = variant(url, *fit(width, height, size))
+        return variants
+
+
+def get_upload_backend():
+    return import_string(settings.IMAGE_UPLOAD_BACKEND)()
+
+
+def get_staging_storage():
+    return import_string(settings.IMAGE_UPLOAD_STAGING_STORAGE)()
+
+
+class DatabaseStagingStorage(Storage):
+    """Stages uploads in the StagedUpload table, readable by every worker"""
+
+    def _save(self, name, content):
+        StagedUpload.objects.create(name=name, data=b''.join(content.chunks()))
+        return name
+
+    def _open(self, name, mode='rb'):
+        data = StagedUpload.objects.filter(name=name).values_list(
+            'data', flat=True).first()
+        if data is None:
+            raise FileNotFoundError(f'No staged upload named {name!r}')
+        return ContentFile(bytes(data), name=name)
+
+    def exists(self, name):
+        return StagedUpload.objects.filter(name=name).exists()
+
+    def delete(self, name):
+        StagedUpload.objects.filter(name=name).delete()
+
+
+@task(atomic=False)
+def upload_image(image_id, statuses=(ProductImage.PENDING,)):
+    upload_pipeline.process(image_id, statuses)
+
+
+class UploadPipeline:
+    """
+    Moves product images to the storage backend off the request path.
+
+    `stage()` writes the uploaded file to the staging storage
+    (IMAGE_UPLOAD_STAGING_STORAGE), marks the image pending and queues an
+    upload_image task (api.tasks), which runs in-process after the commit
+    when no worker is configured (TASK_QUEUE_EAGER). Each image is claimed
+    with a conditional UPDATE, so a retried task and `manage.py
+    process_image_uploads` never push the same file twice. Storage and
+    network errors are retried IMAGE_UPLOAD_RETRIES times with the task
+    queue's backoff; an invalid image fails at once.
+    """
+
+    def stage(self, uploaded, instance=None, **fields):
+        """
+        Stage `uploaded` for `instance` (or a new ProductImage built from
+        `fields`) and queue its upload. Returns the pending image.
+        """
+        _, ext = os.path.splitext(uploaded.name or '')
+        staged = get_staging_storage().save(f'{uuid4().hex}{ext.lower()}', uploaded)
+        if instance is None:
+            instance = ProductImage(**fields)
+        for name, value in fields.items():
+            setattr(instance, name, value)
+        instance.status = ProductImage.PENDING
+        instance.staged_file = staged
+        instance.attempts = 0
+        instance.error = ''
+        instance.save()
+        self.enqueue(instance.pk)
+        return instance
+
+    def enqueue(self, image_id, statuses=(ProductImage.PENDING,)):
+        # One task attempt per upload attempt, so both give up together
+        return enqueue_call(
+            f'{upload_image.__module__}.{upload_image.__qualname__}',
+            [image_id, list(statuses)],
+            max_attempts=settings.IMAGE_UPLOAD_RETRIES + 1)
+
+    def claim(self, image_id, statuses=(ProductImage.PENDING,)):
+        claimed = ProductImage.objects.filter(
+            pk=image_id, status__in=statuses).update(
+                status=ProductImage.UPLOADING, updated_at=timezone.now()) == 1
+        if claimed:
+            # update() skips the post_save hook that refreshes the listings
+            touch_product(ProductImage.objects.filter(pk=image_id).values_list(
+                'product_id', flat=True).get())
+            bump_model_version_on_commit(ProductImage)
+        return claimed
+
+    def process(self, image_id, statuses=(ProductImage.PENDING,)):
+        """
+        Push one staged image to the backend; returns its final status, or
+        None when it was not in `statuses`. A retryable error puts the
+        image back to pending and is raised for the task queue to retry.
+        """
+        if not self.claim(image_id, statuses):
+            return None
+        image = ProductImage.objects.get(pk=image_id)
+        staging = get_staging_storage()
+        backend = get_upload_backend()
+        image.attempts += 1
+        try:
+            with staging.open(image.staged_file) as staged:
+                file = ContentFile(staged.read(), name=image.staged_file)
+        except FileNotFoundError as e:
+            return self._fail(image, e, retry=False)
+        except OSError as e:
+            return self._fail(image, e, retry=True)
+        try:
+            verify_image(file)
+        except Exception as e:
+            return self._fail(image, e, retry=False)
+        try:
+            value = backend.upload(file, image.staged_file)
+            file.seek(0)
+            variants = backend.variants(file, value)
+        except Exception as e:
+            return self._fail(image, e, retry=backend.is_transient(e))
+
+        image.image = value
+        image.variants = variants
+        image.status = ProductImage.READY
+        image.error = ''
+        staged, image.staged_file = image.staged_file, ''
+        image.save()
+        staging.delete(staged)
+        return image.status
+
+    def _fail(self, image, error, retry):
+        image.error = f'{type(error).__name__}: {error}'
+        retry = retry and image.attempts <= settings.IMAGE_UPLOAD_RETRIES
+        image.status = ProductImage.PENDING if retry else ProductImage.FAILED
+        image.save(update_fields=['status', 'attempts', 'error', 'updated_at'])
+        if retry:
+            raise error
+        logger.warning('Uploading product image %s failed: %s', image.pk, image.error)
+        return image.status
+
+    def process_stale(self, stale_after=timedelta(minutes=10), retry_failed=False):
+        """
+        Queue every pending image again, plus uploads whose worker died
+        mid-way (and failed ones, with fresh attempts, with `retry_failed`).
+        Returns the images queued.
+        """
+        statuses = [ProductImage.PENDING, ProductImage.UPLOADING]
+        if retry_failed:
+            statuses.append(ProductImage.FAILED)
+        stale = ProductImage.objects.filter(
+            status__in=statuses).exclude(
+                status=ProductImage.UPLOADING,
+                updated_at__gt=timezone.now() - stale_after)
+        image_ids = list(stale.values_list('pk', flat=True).order_by('pk'))
+        with transaction.atomic():
+            ProductImage.objects.filter(
+                pk__in=image_ids, status=ProductImage.FAILED).update(attempts=0)
+            for image_id in image_ids:
+                self.enqueue(image_id, statuses)
+        return len(image_ids)
+
+    def build_variants(self, images):
+        """
+        Store variants for images uploaded before they existed, fetching
+        each original back from the backend. Returns the images updated.
+        """
+        backend = get_upload_backend()
+        updated = 0
+        for image in images:
+            with backend.open(image.image) as file:
+                image.variants = backend.variants(file, image.image)
+            image.save(update_fields=['variants', 'updated_at'])
+            updated += 1
+        return updated
+
+
+upload_pipeline = UploadPipeline()
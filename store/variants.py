@@ -0,0 +1,48 @@
+from io import BytesIO
+from django.conf import settings
+from PIL import Image
+
+
+def fit(width, height, size):
+    """Dimensions of a `width` x `height` image scaled to fit a `size` box"""
+    scale = min(1, size / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def image_size(file):
+    """`(width, height)` of an image file, rewound afterwards"""
+    with Image.open(file) as image:
+        size = image.size
+    file.seek(0)
+    return size
+
+
+def verify_image(file):
+    """Decode all of an image file, raising if it is invalid; rewound afterwards"""
+    with Image.open(file) as image:
+        image.load()
+    file.seek(0)
+
+
+def render_variants(file):
+    """
+    Yield `(name, width, height, data)` for each of IMAGE_VARIANTS, where
+    `data` is the resized image encoded like the original, or None when
+    the original already fits and should be used as is.
+    """
+    with Image.open(file) as image:
+        image.load()
+    file.seek(0)
+    for name, size in settings.IMAGE_VARIANTS.items():
+        width, height = fit(*image.size, size)
+        if (width, height) == image.size:
+            yield name, width, height, None
+            continue
+        resized = image.resize((width, height), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, image.format)
+        yield name, width, height, buffer.getvalue()
+
+
+def variant(url, width, height):
+    return {'url': url, 'width': width, 'height': height}
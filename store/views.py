@@ -1,52 +1,66 @@
 
 from store.models import Product, Category, Review, ProductImage
-from store.filters import ProductFilter
-from store.serializers import ProductSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer
-from store.pagination import DefaultPagination
+from store.filters import ProductFilter, ProductSearchFilter
+from store.serializers import ProductSerializer, ProductSnapshotSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer
+from store.pagination import ProductPagination, ReviewCursorPagination
 from store.permissions import IsReviewAuthorOrReadonly
+from store.suggest import suggestion_index
+from store.services import RatingService
+from store.uploads import upload_pipeline
 from api.permissions import IsAdminOrReadOnly
+from api.cache import CachedResponseMixin
+from api.conditional import ConditionalGetMixin
+from api.serializers import wants_field
+from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import Count
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     """
     API endpoint for managing products in the e-commerce store
      - Allows authenticated admin to create, update, and delete products
      - Allows users to browse and filter product
      - Support searching by name, description, and category
-     - Support ordering by price and updated_at
+     - Support ordering by id, price, updated_at and rating
+     - Support keyset pagination with ?pagination=cursor
     """
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related(
+        'category').prefetch_related('images')
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend,
+                       ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
-    search_fields = ['name', 'description']
-    ordering_fields = ['price', 'updated_at']
+    pagination_class = ProductPagination
+    ordering_fields = ['id', 'price', 'updated_at',
+                       'average_rating', 'review_count']
     permission_classes = [IsAdminOrReadOnly]
+    cache_models = (Product, ProductImage)
+    surrogate_key_prefix = 'product'
+    snapshot_actions = ('list', 'retrieve', 'featured')
 
-    @swagger_auto_schema(
-        operation_summary='Retrieve a list of products'
-    )
+    def get_queryset(self):
+        if self.action in self.snapshot_actions:
+            # Snapshots carry the images; join them instead of prefetching
+            return Product.objects.select_related('snapshot')
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action in self.snapshot_actions:
+            return ProductSnapshotSerializer
+        return super().get_serializer_class()
+
+    # list, create and suggest are documented in store.schema
     def list(self, request, *args, **kwargs):
         """Retrieve all the products"""
         return super().list(request, *args, **kwargs)
 
-    @swagger_auto_schema(
-        operation_summary="Create a product by admin",
-        operation_description="This allow an admin to create a product",
-        request_body=ProductSerializer,
-        responses={
-            201: ProductSerializer,
-            400: "Bad Request"
-        }
-    )
     def create(self, request, *args, **kwargs):
         """Only authenticated admin can create product"""
         return super().create(request, *args, **kwargs)
@@ -54,6 +68,10 @@ class ProductViewSet(ModelViewSet):
     @action(detail=False, methods=['get'])
     def featured(self, request):
         """Return all featured products"""
+        return self.conditional_response(
+            request, lambda: self.cached_response(request, self._featured))
+
+    def _featured(self):
         queryset = self.get_queryset().filter(featured=True)
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -62,37 +80,109 @@ class ProductViewSet(ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def suggest(self, request):
+        """Typeahead suggestions served from the in-memory prefix index"""
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 20)
+        except ValueError:
+            limit = 10
+        return Response(suggestion_index.suggest(
+            request.query_params.get('q', ''), limit=max(limit, 1)))
 
-class ProductImageViewSet(ModelViewSet):
+
+class ProductImageViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     serializer_class = ProductImageSerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_models = (ProductImage,)
+    surrogate_key_prefix = 'product-image'
+
+    def get_surrogate_keys(self, data):
+        return [f"product-{self.kwargs.get('product_pk')}",
+                *super().get_surrogate_keys(data)]
 
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs.get('product_pk'))
 
+    def create(self, request, *args, **kwargs):
+        # The image is stored in the background; poll it for `status`
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
     def perform_create(self, serializer):
-        serializer.save(product_id=self.kwargs.get('product_pk'))
+        serializer.instance = upload_pipeline.stage(
+            serializer.validated_data['image'],
+            product_id=self.kwargs.get('product_pk'))
+
+    def perform_update(self, serializer):
+        if 'image' not in serializer.validated_data:
+            return super().perform_update(serializer)
+        serializer.instance = upload_pipeline.stage(
+            serializer.validated_data['image'], instance=serializer.instance)
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
+    cache_models = (Category, Product)
+    surrogate_key_prefix = 'category'
     queryset = Category.objects.annotate(
         product_count=Count('products')).all()
     serializer_class = CategorySerializer
 
-
-class ReviewViewSet(ModelViewSet):
+    def get_queryset(self):
+        if not wants_field(self.request, 'product_count'):
+            return Category.objects.all()
+        return super().get_queryset()
+
+    def get_validator_querysets(self):
+        # product_count changes with the products, not the category rows
+        products = Product.objects.all()
+        if self.action == 'retrieve':
+            products = products.filter(category_id=self.kwargs['pk'])
+        categories = Category.objects.all()
+        if self.action == 'retrieve':
+            categories = categories.filter(pk=self.kwargs['pk'])
+        return [categories, products]
+
+
+class ReviewViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = ReviewCursorPagination
     permission_classes = [IsReviewAuthorOrReadonly]
+    cache_models = (Review, get_user_model())
+    surrogate_key_prefix = 'review'
+
+    def get_surrogate_keys(self, data):
+        return [f"product-{self.kwargs.get('product_pk')}",
+                *super().get_surrogate_keys(data)]
+
+    def get_validator_querysets(self):
+        # Reviews show their author's name, which changes with the user rows
+        reviews = super().get_validator_querysets()
+        authors = get_user_model().objects.filter(
+            pk__in=reviews[0].values('user_id'))
+        return [*reviews, authors]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            review = serializer.save(user=self.request.user)
+            RatingService.review_added(review)
 
     def perform_update(self, serializer):
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            old_rating = serializer.instance.rating
+            review = serializer.save(user=self.request.user)
+            RatingService.review_changed(review, old_rating)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            RatingService.review_removed(instance)
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs.get('product_pk'))
 
     def get_serializer_context(self):
-        return {'product_id': self.kwargs.get('product_pk')}
+        return {**super().get_serializer_context(),
+                'product_id': self.kwargs.get('product_pk')}
@@ -0,0 +1,99 @@
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer as BaseTokenObtainPairSerializer)
+from rest_framework_simplejwt.settings import api_settings
+from users.models import ClaimsUser, User
+
+# User fields copied into tokens at issue time, for clients to read
+CLAIM_FIELDS = ('email', 'first_name', 'last_name', 'is_staff')
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    """Issues tokens that carry CLAIM_FIELDS next to the user id"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for field in CLAIM_FIELDS:
+            token[field] = getattr(user, field)
+        return token
+
+
+class UserStatusCache:
+    """
+    Per-process TTL cache of `user_id -> (is_active, is_staff)` (None for
+    deleted users), so deactivating, demoting or deleting a user takes
+    effect on their tokens within `ttl` seconds without a query on every
+    request.
+    """
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        status = User.objects.filter(pk=user_id).values_list(
+            'is_active', 'is_staff').first()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries = {k: v for k, v in self._entries.items()
+                                 if v[0] > now}
+            if len(self._entries) < self.max_size:
+                self._entries[user_id] = (now + self.ttl, status)
+        return status
+
+    def forget(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries = {}
+
+
+user_status_cache = UserStatusCache(settings.JWT_USER_STATUS_TTL)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that builds `request.user` from the token's user id
+    and UserStatusCache instead of loading the user row. The result is a
+    ClaimsUser, a real User instance, so it works in ORM filters and
+    comparisons. The profile claims (email, names) are not copied onto it,
+    since they are fixed at issue time; they and the rest of the row load
+    only if a view reads them.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = User._meta.pk.to_python(
+                validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        status = user_status_cache.get(user_id)
+        if status is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        is_active, is_staff = status
+        if not is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        # Refreshed tokens copy the issue-time claims forward, so is_staff
+        # comes from the database to stop demoted admins keeping access
+        values = {User._meta.pk.attname: user_id,
+                  'is_active': True, 'is_staff': is_staff}
+        fields = [f.attname for f in User._meta.concrete_fields
+                  if f.attname in values]
+        return ClaimsUser.from_db(
+            DEFAULT_DB_ALIAS, fields, [values[name] for name in fields])
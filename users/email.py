@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from djoser import email
+from api.tasks import task
+
+
+@task
+def send_email(subject, body, from_email, to, cc=(), bcc=(), reply_to=(),
+               alternatives=(), content_subtype='plain'):
+    message = EmailMultiAlternatives(
+        subject, body, from_email, to, cc=cc, bcc=bcc, reply_to=reply_to,
+        alternatives=[tuple(alternative) for alternative in alternatives])
+    message.content_subtype = content_subtype
+    message.send()
+
+
+class QueuedEmailMixin:
+    """
+    Renders a djoser email during the request, where its context (user,
+    token, site) is at hand, but hands delivery to the task queue so the
+    SMTP round trip never holds up the response.
+    """
+
+    def send(self, to, fail_silently=False, **kwargs):
+        self.render()
+        send_email.enqueue(
+            self.subject, self.body,
+            kwargs.get('from_email', settings.DEFAULT_FROM_EMAIL), list(to),
+            cc=kwargs.get('cc', []), bcc=kwargs.get('bcc', []),
+            reply_to=kwargs.get('reply_to', []),
+            alternatives=[list(alternative) for alternative in self.alternatives],
+            content_subtype=self.content_subtype)
+
+
+class ActivationEmail(QueuedEmailMixin, email.ActivationEmail):
+    pass
+
+
+class ConfirmationEmail(QueuedEmailMixin, email.ConfirmationEmail):
+    pass
+
+
+class PasswordResetEmail(QueuedEmailMixin, email.PasswordResetEmail):
+    pass
+
+
+class PasswordChangedConfirmationEmail(
+        QueuedEmailMixin, email.PasswordChangedConfirmationEmail):
+    pass
+
+
+class UsernameChangedConfirmationEmail(
+        QueuedEmailMixin, email.UsernameChangedConfirmationEmail):
+    pass
+
+
+class UsernameResetEmail(QueuedEmailMixin, email.UsernameResetEmail):
+    pass
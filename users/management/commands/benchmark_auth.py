@@ -0,0 +1,49 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from users.authentication import (
+    ClaimsJWTAuthentication, TokenObtainPairSerializer, user_status_cache)
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Compare per-request authentication latency of database-backed '
+            'JWTAuthentication against token claims')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+
+    def measure(self, authentication, request):
+        timings = []
+        for _ in range(self.iterations):
+            start = time.perf_counter()
+            authentication.authenticate(Request(request))
+            timings.append((time.perf_counter() - start) * 1000)
+        with CaptureQueriesContext(connection) as ctx:
+            authentication.authenticate(Request(request))
+        timings.sort()
+        return (statistics.mean(timings), timings[len(timings) // 2],
+                timings[int(len(timings) * 0.99) - 1], len(ctx.captured_queries))
+
+    def handle(self, *args, **options):
+        self.iterations = options['iterations']
+        user = User.objects.filter(is_active=True).first()
+        if user is None:
+            self.stderr.write('No active user to authenticate as')
+            return
+        token = TokenObtainPairSerializer.get_token(user).access_token
+        request = APIRequestFactory().get(
+            '/api/v1/orders/', HTTP_AUTHORIZATION=f'JWT {token}')
+        user_status_cache.clear()
+
+        for name, authentication in (('database', JWTAuthentication()),
+                                     ('claims', ClaimsJWTAuthentication())):
+            mean, p50, p99, queries = self.measure(authentication, request)
+            self.stdout.write(
+                f'{name:<10} mean {mean:.3f} ms  p50 {p50:.3f} ms  '
+                f'p99 {p99:.3f} ms  {queries} queries/request')
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:30
+
+import users.managers
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaimsUser',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('users.user',),
+            managers=[
+                ('objects', users.managers.CustomUserManager()),
+            ],
+        ),
+    ]
@@ -8,6 +8,8 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     address = models.TextField(blank=True, null=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
+    # Validators of responses showing users (review authors) are keyed on it
+    updated_at = models.DateTimeField(auto_now=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -16,3 +18,21 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.email
+
+
+class ClaimsUser(User):
+    """
+    A User built from an access token instead of a database row (see
+    users.authentication). Only the id and status fields are loaded; the
+    first access to any other field loads all of them in one query, so
+    views that need the full model still get it.
+    """
+
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred and set(fields) <= deferred:
+            fields = deferred
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from users.authentication import user_status_cache
+from users.models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_status(sender, instance, **kwargs):
+    # Any save may change is_active or is_staff
+    user_status_cache.forget(instance.pk)
@@ -1,3 +1,139 @@
+from io import StringIO
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from api.models import Task
+from users.authentication import ClaimsJWTAuthentication, user_status_cache
+from users.models import ClaimsUser, User
 
-# Create your tests here.
+
+class ClaimsJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_status_cache.clear()
+        self.user = User.objects.create_user(
+            email='buyer@example.com', password='pass1234', first_name='Rafi',
+            last_name='Hasan', address='Dhaka', phone_number='01700000000')
+        self.client = APIClient()
+
+    def obtain(self):
+        response = self.client.post('/api/v1/auth/jwt/create/', {
+            'email': 'buyer@example.com', 'password': 'pass1234'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['access']
+
+    def get(self, url, token):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def user_queries(self, ctx):
+        table = User._meta.db_table
+        return [q for q in ctx.captured_queries if table in q['sql']]
+
+    def test_tokens_carry_user_claims(self):
+        token = AccessToken(self.obtain())
+        self.assertEqual(
+            {field: token[field] for field in
+             ('email', 'first_name', 'last_name', 'is_staff')},
+            {'email': 'buyer@example.com', 'first_name': 'Rafi',
+             'last_name': 'Hasan', 'is_staff': False})
+
+    def test_refreshed_tokens_keep_the_claims(self):
+        refresh = self.client.post('/api/v1/auth/jwt/create/', {
+            'email': 'buyer@example.com', 'password': 'pass1234'},
+            format='json').data['refresh']
+        response = self.client.post(
+            '/api/v1/auth/jwt/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(AccessToken(response.data['access'])['email'],
+                         'buyer@example.com')
+
+    def test_requests_do_not_load_the_user(self):
+        token = self.obtain()
+        self.get('/api/v1/orders/', token)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get('/api/v1/orders/', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.user_queries(ctx), [])
+
+    def test_other_fields_load_in_one_query(self):
+        token = self.obtain()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get('/api/v1/auth/users/me/', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['address'], 'Dhaka')
+        self.assertEqual(response.data['phone_number'], '01700000000')
+        # One is_active check plus one load of the remaining fields
+        self.assertEqual(len(self.user_queries(ctx)), 2)
+
+    def test_profile_changes_show_with_an_old_token(self):
+        token = self.obtain()
+        self.user.email = 'new@example.com'
+        self.user.first_name = 'Rafiq'
+        self.user.save()
+        response = self.get('/api/v1/auth/users/me/', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['email'], response.data['first_name']),
+                         ('new@example.com', 'Rafiq'))
+
+    def test_deactivated_user_is_rejected(self):
+        token = self.obtain()
+        self.assertEqual(self.get('/api/v1/orders/', token).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get('/api/v1/orders/', token).status_code, 401)
+
+    def test_demoted_admin_is_rejected(self):
+        self.user.is_staff = True
+        self.user.save()
+        token = self.obtain()
+        self.assertEqual(self.get('/api/v1/query-stats/', token).status_code, 200)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.get('/api/v1/query-stats/', token).status_code, 403)
+
+    def test_tokens_without_claims_are_accepted(self):
+        token = AccessToken()
+        token['user_id'] = self.user.pk
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get('/api/v1/orders/', str(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.user_queries(ctx)), 1)
+
+    def test_claims_user_is_the_same_user(self):
+        auth = ClaimsJWTAuthentication()
+        user = auth.get_user(auth.get_validated_token(self.obtain()))
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.get_deferred_fields(), {
+            'password', 'last_login', 'is_superuser', 'date_joined', 'email',
+            'first_name', 'last_name', 'address', 'phone_number', 'updated_at'})
+
+
+class QueuedEmailTests(TestCase):
+    def test_activation_email_is_sent_by_the_worker(self):
+        client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/v1/auth/users/', {
+                'email': 'new@example.com', 'password': 'Str0ng-pass!',
+                'first_name': 'Nadia', 'last_name': 'Karim'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(Task.objects.get().name, 'users.email.send_email')
+
+        call_command('run_tasks', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.to, ['new@example.com'])
+        self.assertIn('http://localhost/activate/', message.body)
+        self.assertFalse(Task.objects.exists())
+
+    def test_password_reset_email_is_queued(self):
+        User.objects.create_user(email='buyer@example.com', password='pass1234')
+        response = APIClient().post('/api/v1/auth/users/reset_password/', {
+            'email': 'buyer@example.com'}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(mail.outbox, [])
+        call_command('run_tasks', '--once', stdout=StringIO())
+        self.assertIn('password/reset/confirm/', mail.outbox[0].body)